@@ -0,0 +1,186 @@
+"""
+Vectorized price statistics.
+
+History is loaded as three contiguous NumPy arrays sorted by product and
+time (product_ids, timestamps, prices), the same layout returned by
+HistoryArchiveReader.load_arrays, so statistics can be computed from the
+database or from the columnar archive. Once history has been archived,
+load_recent_history_arrays reads it from the archive and only the rows
+written since from the database. Every statistic is computed for all
+products at once with segmented reductions; nothing loops over products.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOAD_BATCH_SIZE = 50000
+
+STATISTICS = (
+    'observations', 'min_price', 'max_price', 'mean_price', 'first_price', 'last_price',
+    'volatility_pct', 'last_change_at', 'seconds_since_change', 'max_drop', 'max_drop_pct'
+)
+
+def load_history_arrays(product_ids=None, start=None, end=None, after_id=None):
+    """
+    Return (product_ids, timestamps, prices) for PriceHistory rows with one
+    bulk query. product_ids may be a list or a select of ids; after_id skips
+    rows up to that id.
+    """
+    from sqlalchemy import select
+    from models import db, PriceHistory
+
+    query = select(PriceHistory.product_id, PriceHistory.timestamp, PriceHistory.price)
+    if product_ids is not None:
+        query = query.where(PriceHistory.product_id.in_(product_ids))
+    if start:
+        query = query.where(PriceHistory.timestamp >= start)
+    if end:
+        query = query.where(PriceHistory.timestamp <= end)
+    if after_id:
+        query = query.where(PriceHistory.id > after_id)
+    query = query.order_by(PriceHistory.product_id, PriceHistory.timestamp, PriceHistory.id)
+
+    ids, timestamps, prices = [], [], []
+    result = db.session.execute(query, execution_options={'stream_results': True, 'yield_per': LOAD_BATCH_SIZE})
+    for rows in result.partitions():
+        batch_ids, batch_timestamps, batch_prices = zip(*rows)
+        ids.append(np.array(batch_ids, dtype=np.int64))
+        timestamps.append(np.array(batch_timestamps, dtype='datetime64[us]'))
+        prices.append(np.array(batch_prices, dtype=np.float64))
+
+    if not ids:
+        return np.empty(0, np.int64), np.empty(0, 'datetime64[us]'), np.empty(0, np.float64)
+    return np.concatenate(ids), np.concatenate(timestamps), np.concatenate(prices)
+
+def load_recent_history_arrays(product_ids=None, start=None, end=None, archive_dir=None):
+    """
+    Return the same arrays as load_history_arrays, reading rows up to the
+    archive's last id from the columnar archive and only newer rows from the
+    database. Without pyarrow or an archive everything comes from the database.
+    """
+    from models import db
+    from exports import parquet_available
+
+    if not parquet_available():
+        return load_history_arrays(product_ids, start, end)
+    from archive import HistoryArchiveReader, get_archive_dir
+
+    reader = HistoryArchiveReader(archive_dir or get_archive_dir())
+    last_id = reader.manifest['last_id']
+    if not last_id:
+        return load_history_arrays(product_ids, start, end)
+
+    if product_ids is not None and not isinstance(product_ids, (list, tuple, set)):
+        product_ids = db.session.scalars(product_ids).all()
+    archived = reader.load_arrays(product_ids, start, end)
+    recent = load_history_arrays(product_ids, start, end, after_id=last_id)
+
+    product_ids, timestamps, prices = (np.concatenate(parts) for parts in zip(archived, recent))
+    # Stable sort by product, then time; archived rows keep their place before newer ones
+    order = np.lexsort((timestamps, product_ids))
+    return product_ids[order], timestamps[order], prices[order]
+
+def compute_price_statistics(product_ids, timestamps, prices, now=None):
+    """
+    Return a dict of arrays with one entry per product:
+    - observations, min/max/mean/first/last price
+    - volatility_pct: standard deviation of the percent change between
+      consecutive observations
+    - last_change_at, seconds_since_change: the last observation whose price
+      differs from the one before it (the first observation if none does)
+    - max_drop, max_drop_pct: the largest fall from a running peak to a later
+      price within the loaded range
+    """
+    now = np.datetime64(now or datetime.utcnow(), 's')
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    timestamps = np.asarray(timestamps).astype('datetime64[s]')
+    prices = np.asarray(prices, dtype=np.float64)
+    n = len(prices)
+
+    if n == 0:
+        stats = {name: np.empty(0) for name in STATISTICS}
+        stats['product_id'] = np.empty(0, np.int64)
+        stats['last_change_at'] = np.empty(0, 'datetime64[s]')
+        return stats
+
+    # Segment boundaries: one segment of consecutive rows per product
+    starts = np.flatnonzero(np.r_[True, product_ids[1:] != product_ids[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    segments = np.repeat(np.arange(len(starts)), counts)
+    same_product = segments[1:] == segments[:-1]
+
+    # Percent change between consecutive observations of the same product
+    valid = same_product & (prices[:-1] > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        changes = np.diff(prices) / prices[:-1] * 100
+    change_segments = segments[1:][valid]
+    changes = changes[valid]
+    n_changes = np.bincount(change_segments, minlength=len(starts))
+    sums = np.bincount(change_segments, changes, minlength=len(starts))
+    squares = np.bincount(change_segments, changes * changes, minlength=len(starts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_mean = sums / n_changes
+        variance = np.clip(squares / n_changes - change_mean * change_mean, 0, None)
+    volatility = np.where(n_changes > 0, np.sqrt(variance), 0.0)
+
+    # Last observation whose price differs from the previous one
+    seconds = timestamps.astype(np.int64)
+    changed = np.r_[False, same_product & (prices[1:] != prices[:-1])]
+    candidates = np.where(changed, seconds, seconds[starts][segments])
+    last_change = np.maximum.reduceat(candidates, starts)
+
+    # Segmented running maximum: lifting each product above the previous one
+    # lets a single maximum.accumulate restart at every product boundary
+    lift = (prices.max() - prices.min() + 1) * segments
+    running_peak = np.maximum.accumulate(prices + lift) - lift
+    drops = running_peak - prices
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drop_pct = np.where(running_peak > 0, drops / running_peak * 100, 0.0)
+
+    return {
+        'product_id': product_ids[starts],
+        'observations': counts,
+        'min_price': np.minimum.reduceat(prices, starts),
+        'max_price': np.maximum.reduceat(prices, starts),
+        'mean_price': np.add.reduceat(prices, starts) / counts,
+        'first_price': prices[starts],
+        'last_price': prices[starts + counts - 1],
+        'volatility_pct': volatility,
+        'last_change_at': last_change.astype('datetime64[s]'),
+        'seconds_since_change': now.astype(np.int64) - last_change,
+        'max_drop': np.maximum.reduceat(drops, starts),
+        'max_drop_pct': np.maximum.reduceat(drop_pct, starts),
+    }
+
+def statistics_to_records(stats, names=None):
+    """Convert compute_price_statistics output to a list of JSON-ready dicts"""
+    records = []
+    for i, product_id in enumerate(stats['product_id'].tolist()):
+        record = {'product_id': product_id}
+        if names is not None:
+            record['name'] = names.get(product_id)
+        for name in STATISTICS:
+            value = stats[name][i]
+            if name == 'last_change_at':
+                record[name] = str(value)
+            elif name in ('observations', 'seconds_since_change'):
+                record[name] = int(value)
+            else:
+                record[name] = round(float(value), 4)
+        records.append(record)
+    return records
+
+def get_user_statistics(user_id, start=None, end=None, now=None):
+    """Return statistics records for every product the user tracks"""
+    from sqlalchemy import select
+    from models import db, Product, URL
+
+    product_ids = select(URL.product_id).where(URL.user_id == user_id, URL.product_id.isnot(None))
+    names = dict(db.session.query(Product.id, Product.name).filter(Product.id.in_(product_ids)))
+
+    stats = compute_price_statistics(*load_recent_history_arrays(product_ids, start, end), now=now)
+    return statistics_to_records(stats, names)
@@ -62,7 +62,8 @@ try:
                 
                 # Create all tables
                 logger.info("Creating database tables...")
-                db.create_all()
+                from migrations import upgrade_schema
+                upgrade_schema(db)
                 logger.info("✅ Database tables created successfully")
                 
                 # List all tables
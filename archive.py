@@ -0,0 +1,193 @@
+"""
+Columnar archive of price history.
+
+History is appended incrementally (by PriceHistory id) to uncompressed Arrow
+IPC files partitioned by month:
+
+    <archive dir>/month=2024-05/part-000001234-000005678.arrow
+    <archive dir>/manifest.json
+
+Uncompressed IPC files can be memory-mapped, so analytics reads of
+archived history (analytics.load_recent_history_arrays, behind /api/analytics
+and price-stats) come straight from the page cache instead of the OLTP
+database; only rows newer than the manifest's last_id are queried. Long-range
+charts read the daily and weekly rollups instead (see rollups.py). Rows
+moved to PriceHistoryArchive by compaction are included.
+
+The id cursor stops at exports.history_export_bound(), so rows written in
+the last few seconds wait for the next export until any transaction that
+took a lower id has committed.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('product_id', pa.int64()),
+    ('price', pa.float64()),
+    ('timestamp', pa.timestamp('us')),
+])
+
+def get_archive_dir(app=None):
+    """Return the configured archive directory"""
+    from flask import current_app
+    app = app or current_app
+    return app.config.get('HISTORY_ARCHIVE_DIR') or os.getenv('HISTORY_ARCHIVE_DIR') \
+        or os.path.join(app.instance_path, 'history_archive')
+
+def load_manifest(archive_dir):
+    """Return the archive manifest, or an empty one"""
+    path = os.path.join(archive_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'last_id': 0, 'parts': []}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def save_manifest(archive_dir, manifest):
+    """Atomically replace the archive manifest"""
+    path = os.path.join(archive_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, path)
+
+def _write_part(archive_dir, month, rows):
+    """Write one month's rows to a new IPC file and return its manifest entry"""
+    ids, product_ids, prices, timestamps = zip(*rows)
+    table = pa.Table.from_arrays([
+        pa.array(ids, pa.int64()),
+        pa.array(product_ids, pa.int64()),
+        pa.array(prices, pa.float64()),
+        pa.array(timestamps, pa.timestamp('us')),
+    ], schema=SCHEMA)
+    
+    partition = os.path.join(archive_dir, f'month={month}')
+    os.makedirs(partition, exist_ok=True)
+    filename = f'part-{ids[0]:09d}-{ids[-1]:09d}.arrow'
+    path = os.path.join(partition, filename)
+    
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    
+    return {
+        'month': month,
+        'path': os.path.relpath(path, archive_dir),
+        'rows': len(ids),
+        'first_id': ids[0],
+        'last_id': ids[-1],
+        'min_timestamp': min(timestamps).isoformat(),
+        'max_timestamp': max(timestamps).isoformat(),
+    }
+
+def export_history_archive(archive_dir=None, batch_size=50000):
+    """
+    Append PriceHistory rows newer than the last exported id, up to the
+    committed bound, to the archive. Must run inside an app context. Returns the number of rows exported.
+    """
+    from sqlalchemy import union_all, select, func
+    from models import db, PriceHistory, PriceHistoryArchive
+    from exports import history_export_bound
+    
+    archive_dir = archive_dir or get_archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    exported = 0
+    
+    # Compacted rows are old, so every id below them has committed too
+    until = max(history_export_bound(manifest['last_id']),
+                db.session.query(func.max(PriceHistoryArchive.id)).scalar() or 0)
+    
+    while True:
+        live = select(PriceHistory.id, PriceHistory.product_id, PriceHistory.price, PriceHistory.timestamp) \
+            .where(PriceHistory.id > manifest['last_id'], PriceHistory.id <= until,
+                   PriceHistory.timestamp.isnot(None))
+        archived = select(PriceHistoryArchive.id, PriceHistoryArchive.product_id,
+                          PriceHistoryArchive.price, PriceHistoryArchive.timestamp) \
+            .where(PriceHistoryArchive.id > manifest['last_id'], PriceHistoryArchive.id <= until,
+                   PriceHistoryArchive.timestamp.isnot(None))
+        combined = union_all(live, archived).subquery()
+        
+        rows = db.session.execute(
+            select(combined).order_by(combined.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+            
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row.timestamp.strftime('%Y-%m'), []).append(tuple(row))
+            
+        for month, month_rows in sorted(by_month.items()):
+            manifest['parts'].append(_write_part(archive_dir, month, month_rows))
+            
+        # Only advance the cursor once the part files are safely written
+        manifest['last_id'] = rows[-1].id
+        save_manifest(archive_dir, manifest)
+        exported += len(rows)
+        logger.info(f"Archived {exported} history rows (last id {manifest['last_id']})")
+        
+    return exported
+
+class HistoryArchiveReader:
+    """Memory-mapped reader over the monthly Arrow IPC partitions"""
+    
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.manifest = load_manifest(archive_dir)
+        
+    def _parts(self, start=None, end=None):
+        """Yield manifest entries overlapping [start, end]"""
+        for part in self.manifest['parts']:
+            if start and datetime.fromisoformat(part['max_timestamp']) < start:
+                continue
+            if end and datetime.fromisoformat(part['min_timestamp']) > end:
+                continue
+            yield part
+            
+    def read_table(self, product_ids=None, start=None, end=None):
+        """Return an Arrow table of matching rows sorted by product and time"""
+        tables = []
+        for part in self._parts(start, end):
+            source = pa.memory_map(os.path.join(self.archive_dir, part['path']), 'r')
+            table = pa.ipc.open_file(source).read_all()
+            
+            mask = None
+            if product_ids is not None:
+                mask = pc.is_in(table['product_id'], value_set=pa.array(list(product_ids), pa.int64()))
+            if start:
+                cond = pc.greater_equal(table['timestamp'], pa.scalar(start, pa.timestamp('us')))
+                mask = cond if mask is None else pc.and_(mask, cond)
+            if end:
+                cond = pc.less_equal(table['timestamp'], pa.scalar(end, pa.timestamp('us')))
+                mask = cond if mask is None else pc.and_(mask, cond)
+            tables.append(table.filter(mask) if mask is not None else table)
+            
+        if not tables:
+            return SCHEMA.empty_table()
+        table = pa.concat_tables(tables)
+        return table.sort_by([('product_id', 'ascending'), ('timestamp', 'ascending'), ('id', 'ascending')])
+        
+    def load_arrays(self, product_ids=None, start=None, end=None):
+        """
+        Return (product_ids, timestamps, prices) as contiguous NumPy arrays
+        sorted by product and time; timestamps are datetime64[us].
+        """
+        table = self.read_table(product_ids, start, end)
+        return (
+            table['product_id'].to_numpy(),
+            table['timestamp'].to_numpy(),
+            table['price'].to_numpy()
+        )
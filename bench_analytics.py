@@ -0,0 +1,77 @@
+"""
+Benchmark the vectorized price statistics.
+
+Generates synthetic history (10k products x 1k points by default), times
+compute_price_statistics over all of it and compares with a per-product
+Python loop over a sample of products, extrapolated to the full set.
+
+    python bench_analytics.py --products 10000 --points 1000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import compute_price_statistics
+
+def synthetic_history(products, points, seed=0):
+    """Return sorted (product_ids, timestamps, prices) arrays of random walks"""
+    rng = np.random.default_rng(seed)
+    product_ids = np.repeat(np.arange(1, products + 1, dtype=np.int64), points)
+    steps = rng.integers(600, 7200, size=(products, points)).cumsum(axis=1)
+    timestamps = (np.datetime64('2023-01-01T00:00:00', 's') + steps.ravel()).astype('datetime64[us]')
+    # Prices change on roughly a third of the observations
+    moves = rng.normal(0, 1.5, size=(products, points)) * (rng.random((products, points)) < 0.3)
+    prices = np.round(np.clip(100 + moves.cumsum(axis=1), 1, None), 2).ravel()
+    return product_ids, timestamps, prices
+
+def loop_statistics(timestamps, prices):
+    """Per-product statistics with plain Python, as a baseline"""
+    changes = [(b - a) / a * 100 for a, b in zip(prices, prices[1:])]
+    mean = sum(changes) / len(changes)
+    last_change = timestamps[0]
+    peak = max_drop = 0.0
+    for i, price in enumerate(prices):
+        if i and price != prices[i - 1]:
+            last_change = timestamps[i]
+        peak = max(peak, price)
+        max_drop = max(max_drop, (peak - price) / peak)
+    return (min(prices), max(prices), sum(prices) / len(prices),
+            (sum((c - mean) ** 2 for c in changes) / len(changes)) ** 0.5, last_change, max_drop)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--loop-sample', type=int, default=200, help='Products timed with the Python loop')
+    args = parser.parse_args()
+
+    product_ids, timestamps, prices = synthetic_history(args.products, args.points)
+    print(f"{args.products} products x {args.points} points = {len(prices):,} rows "
+          f"({(product_ids.nbytes + timestamps.nbytes + prices.nbytes) / 2**20:.0f} MiB)")
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        compute_price_statistics(product_ids, timestamps, prices)
+        timings.append(time.perf_counter() - started)
+    print(f"vectorized: best {min(timings):.3f}s of {args.repeat}")
+
+    sample = min(args.loop_sample, args.products)
+    series = [(timestamps[i * args.points:(i + 1) * args.points].tolist(),
+               prices[i * args.points:(i + 1) * args.points].tolist()) for i in range(sample)]
+    started = time.perf_counter()
+    for series_timestamps, series_prices in series:
+        loop_statistics(series_timestamps, series_prices)
+    loop_time = (time.perf_counter() - started) * args.products / sample
+    print(f"python loop: {loop_time:.3f}s (extrapolated from {sample} products), "
+          f"{loop_time / min(timings):.0f}x slower")
+
+if __name__ == '__main__':
+    main()
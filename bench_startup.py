@@ -0,0 +1,81 @@
+"""
+Benchmark serverless cold starts.
+
+Each run starts a fresh interpreter that imports the serverless app the way
+api/index.py does and serves one request, then reports:
+- import: seconds to import api.app_serverless
+- first_request: seconds for the first request (template compilation, first
+  database connection, modules imported by the view)
+- heavy_modules: optional dependencies loaded by the import alone
+
+The database is a temporary SQLite file whose schema is created beforehand,
+as api/init_db.py does after a deploy. Medians over the runs are printed;
+--json prints one line to append to a log tracked across releases.
+
+    python bench_startup.py --runs 10 --path /login
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ('requests', 'bs4', 'lxml', 'numpy', 'pyarrow', 'apscheduler', 'wtforms', 'redis')
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+from api.app_serverless import app
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+response = app.test_client().get({path!r})
+finished = time.perf_counter()
+print(json.dumps({{'import': imported - started, 'first_request': finished - imported,
+                  'status': response.status_code, 'heavy_modules': heavy}}))
+"""
+
+def run_child(code, env):
+    """Run code in a fresh interpreter and return its last line of output as JSON"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login', help='Path of the first request')
+    parser.add_argument('--json', action='store_true', help='Print one JSON line')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SERVERLESS='true', LOG_LEVEL='WARNING',
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        # Create the schema once, outside the measured runs
+        run_child(CHILD.format(heavy=HEAVY_MODULES, path='/login'), dict(env, SCHEMA_CHECK_ON_STARTUP='true'))
+
+        env['SCHEMA_CHECK_ON_STARTUP'] = 'false'
+        runs = [run_child(CHILD.format(heavy=HEAVY_MODULES, path=args.path), env) for _ in range(args.runs)]
+
+    summary = {
+        'runs': args.runs,
+        'path': args.path,
+        'status': runs[-1]['status'],
+        'import': round(statistics.median(run['import'] for run in runs), 4),
+        'first_request': round(statistics.median(run['first_request'] for run in runs), 4),
+        'heavy_modules': runs[-1]['heavy_modules'],
+    }
+    if args.json:
+        print(json.dumps(summary))
+        return
+
+    print(f"{args.runs} cold starts, first request GET {args.path} -> {summary['status']}")
+    print(f"import:        {summary['import'] * 1000:.0f} ms (median)")
+    print(f"first request: {summary['first_request'] * 1000:.0f} ms (median)")
+    print(f"heavy modules loaded by import: {', '.join(summary['heavy_modules']) or 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Cache for serialized dashboard payloads and URL validation results.
+
+Entries are keyed by user, a per-user version number, the version of the
+user's data in the database and the request's filter parameters.
+Invalidation bumps the user's version, so every cached page for that user
+becomes unreachable at once. A payload built while an invalidation happens
+is stored under the old version and never served.
+
+Prices are refreshed by worker.py or the scheduler leader, whose version
+bumps only reach their own LRUCache. The database version (the latest
+Product.updated_at and URL counts of the user, see
+httpcache.user_listing_version) changes with every such refresh, so web
+processes never serve a dashboard older than the database, with either
+backend.
+
+Two backends share the same interface:
+- LRUCache: in-process, thread-safe, used by default
+- RedisCache: shared between workers, enabled by setting CACHE_REDIS_URL
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+# Reuse of a successful URL validation, in seconds
+VALIDATE_URL_TTL = 300
+
+def _initial_version():
+    """Version for a namespace with no stored version; never reuses old numbers"""
+    return int(time.time() * 1000)
+
+class LRUCache:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Versions live outside the LRU so they are never evicted
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_version(self, namespace):
+        with self._lock:
+            return self._versions.setdefault(namespace, _initial_version())
+
+    def bump_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, _initial_version()) + 1
+            return self._versions[namespace]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class RedisCache:
+    """Shared cache backed by a Redis client (or anything with the same API)"""
+
+    def __init__(self, client, prefix='price-monitor:', ttl=DEFAULT_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def get_version(self, namespace):
+        version_key = self.prefix + 'version:' + namespace
+        version = self.client.get(version_key)
+        if version is None:
+            self.client.set(version_key, _initial_version(), nx=True)
+            version = self.client.get(version_key)
+        return int(version)
+
+    def bump_version(self, namespace):
+        return int(self.client.incr(self.prefix + 'version:' + namespace))
+
+def get_cache(app):
+    """Return the app's dashboard cache, creating it from config on first use"""
+    cache = app.extensions.get('dashboard_cache')
+    if cache is None:
+        ttl = int(app.config.get('DASHBOARD_CACHE_TTL', DEFAULT_TTL))
+        redis_url = app.config.get('CACHE_REDIS_URL')
+        if redis_url:
+            import redis
+            cache = RedisCache(redis.Redis.from_url(redis_url), ttl=ttl)
+            logger.info("Using Redis dashboard cache")
+        else:
+            cache = LRUCache(max_entries=int(app.config.get('DASHBOARD_CACHE_SIZE', DEFAULT_MAX_ENTRIES)), ttl=ttl)
+        app.extensions['dashboard_cache'] = cache
+    return cache
+
+def dashboard_cache_key(cache, user_id, params, data_version=None):
+    """
+    Build the cache key for a user's dashboard with the given query parameters
+    and the version of the user's data in the database
+    """
+    version = cache.get_version(f'user:{user_id}')
+    digest = hashlib.sha1(json.dumps([sorted(params.items()), str(data_version)]).encode('utf-8')).hexdigest()
+    return f'dashboard:{user_id}:{version}:{digest}'
+
+def validate_url_cache_key(url):
+    """Build the cache key for the validation result of a product URL"""
+    return 'validate-url:' + hashlib.sha1(url.strip().encode('utf-8')).hexdigest()
+
+def invalidate_user_dashboards(app, user_ids):
+    """Drop every cached dashboard page of the given users"""
+    cache = get_cache(app)
+    for user_id in set(user_ids):
+        cache.bump_version(f'user:{user_id}')
+
+def invalidate_product_followers(app, product_id):
+    """Drop cached dashboards of every user tracking product_id"""
+    from models import db, URL
+
+    user_ids = [row.user_id for row in db.session.query(URL.user_id)
+                .filter(URL.product_id == product_id, URL.user_id.isnot(None))
+                .distinct()]
+    invalidate_user_dashboards(app, user_ids)
+    return user_ids
@@ -0,0 +1,121 @@
+"""
+Flask CLI commands for database maintenance.
+Run with e.g. `flask --app app upgrade-db`.
+"""
+
+import click
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app"""
+    
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Create missing tables, columns and indexes"""
+        from models import db
+        from migrations import upgrade_schema
+        
+        result = upgrade_schema(db)
+        click.echo(f"Added {len(result['columns'])} columns and {len(result['indexes'])} indexes")
+        if result['search_index']:
+            click.echo("Created and filled the product search index")
+        if result['normalized_names']:
+            click.echo(f"Filled normalized names of {result['normalized_names']} products")
+        for name in result['columns'] + result['indexes']:
+            click.echo(f"  {name}")
+    
+    @app.cli.command('backfill-price-changes')
+    @click.option('--batch-size', default=500, show_default=True, help='Products per batch')
+    def backfill_price_changes_command(batch_size):
+        """Populate the denormalized price change fields on Product"""
+        from tasks import backfill_price_changes
+        
+        updated = backfill_price_changes(batch_size=batch_size)
+        click.echo(f"Backfilled {updated} products")
+    
+    @app.cli.command('rebuild-rollups')
+    @click.option('--product-id', 'product_ids', type=int, multiple=True, help='Only rebuild these products')
+    @click.option('--batch-size', default=200, show_default=True, help='Products per batch')
+    def rebuild_rollups_command(product_ids, batch_size):
+        """Recompute daily and weekly price rollups from PriceHistory"""
+        from rollups import rebuild_rollups
+        
+        written = rebuild_rollups(product_ids=list(product_ids) or None, batch_size=batch_size)
+        click.echo(f"Wrote {written} rollup rows")
+    
+    @app.cli.command('compact-history')
+    @click.option('--full-days', type=int, help='Days of history kept at full resolution')
+    @click.option('--archive-days', type=int, help='Days after which history is archived')
+    @click.option('--flap-window-hours', type=int, help='Maximum duration of a price blip that is merged away')
+    @click.option('--batch-size', default=100, show_default=True, help='Products per batch')
+    @click.option('--dry-run', is_flag=True, help='Report what would be reclaimed without changing anything')
+    def compact_history_command(full_days, archive_days, flap_window_hours, batch_size, dry_run):
+        """Merge, downsample and archive old PriceHistory rows"""
+        from compaction import RetentionPolicy, compact_price_history
+        
+        defaults = RetentionPolicy.from_env()
+        policy = RetentionPolicy(
+            full_resolution_days=full_days if full_days is not None else defaults.full_resolution_days,
+            archive_after_days=archive_days if archive_days is not None else defaults.archive_after_days,
+            flap_window_hours=flap_window_hours if flap_window_hours is not None else int(defaults.flap_window.total_seconds() // 3600)
+        )
+        report = compact_price_history(policy, batch_size=batch_size, dry_run=dry_run)
+        click.echo(f"Merged {report['merged']}, archived {report['archived']}, reclaimed {report['reclaimed']} rows")
+    
+    @app.cli.command('prune-refresh-ledger')
+    @click.option('--days', default=30, show_default=True, help='Days of refresh runs to keep')
+    def prune_refresh_ledger_command(days):
+        """Delete refresh runs and their per-URL attempts older than --days"""
+        from refresh_ledger import prune_ledger
+        
+        runs, attempts = prune_ledger(days)
+        click.echo(f"Deleted {runs} refresh runs and {attempts} attempts")
+    
+    @app.cli.command('export-archive')
+    @click.option('--archive-dir', help='Archive directory (defaults to HISTORY_ARCHIVE_DIR)')
+    @click.option('--batch-size', default=50000, show_default=True, help='Rows per batch')
+    def export_archive_command(archive_dir, batch_size):
+        """Append new price history to the columnar archive"""
+        from archive import export_history_archive
+        
+        exported = export_history_archive(archive_dir=archive_dir, batch_size=batch_size)
+        click.echo(f"Exported {exported} history rows")
+    
+    @app.cli.command('rebuild-match-index')
+    @click.option('--batch-size', default=500, show_default=True, help='Products per batch')
+    def rebuild_match_index_command(batch_size):
+        """Recompute normalized names, name tokens and match groups of all products"""
+        from matching import rebuild_match_index
+        
+        indexed = rebuild_match_index(batch_size=batch_size)
+        click.echo(f"Indexed {indexed} products")
+    
+    @app.cli.command('rebuild-search-index')
+    @click.option('--batch-size', default=500, show_default=True, help='Products per batch')
+    def rebuild_search_index_command(batch_size):
+        """Re-index every product for full-text search"""
+        from search import rebuild_search_index
+        
+        indexed = rebuild_search_index(batch_size=batch_size)
+        click.echo(f"Indexed {indexed} products")
+    
+    @app.cli.command('price-stats')
+    @click.option('--product-id', 'product_ids', type=int, multiple=True, help='Only these products')
+    @click.option('--days', type=int, help='Only history from the last N days')
+    @click.option('--from-archive', is_flag=True, help='Read archived history from the columnar archive')
+    def price_stats_command(product_ids, days, from_archive):
+        """Print per-product price statistics as JSON lines"""
+        import json
+        from datetime import datetime, timedelta
+        from analytics import (load_history_arrays, load_recent_history_arrays,
+                               compute_price_statistics, statistics_to_records)
+        
+        start = datetime.utcnow() - timedelta(days=days) if days else None
+        product_ids = list(product_ids) or None
+        
+        if from_archive:
+            arrays = load_recent_history_arrays(product_ids, start)
+        else:
+            arrays = load_history_arrays(product_ids, start)
+            
+        for record in statistics_to_records(compute_price_statistics(*arrays)):
+            click.echo(json.dumps(record))
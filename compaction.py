@@ -0,0 +1,165 @@
+"""
+PriceHistory compaction and retention.
+
+History is kept in three tiers:
+- newer than full_resolution_days: every row is kept
+- up to archive_after_days: identical and flapping observations are merged
+  and at most one row per day (the day's last price) is kept
+- older than archive_after_days: rows move to PriceHistoryArchive
+
+Daily/weekly rollups are not touched, so charts keep their OHLC detail for
+compacted ranges. Running `flask rebuild-rollups` afterwards would recompute
+them from the compacted history.
+
+Work is done batch_size products at a time with a commit per batch, so the
+job can run against a live database without holding long locks.
+"""
+
+import os
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of ids per DELETE/INSERT statement
+CHUNK_SIZE = 500
+
+class RetentionPolicy:
+    """How long history is kept at each resolution"""
+    
+    def __init__(self, full_resolution_days=90, archive_after_days=365, flap_window_hours=24):
+        if archive_after_days < full_resolution_days:
+            raise ValueError("archive_after_days must not be shorter than full_resolution_days")
+        self.full_resolution_days = full_resolution_days
+        self.archive_after_days = archive_after_days
+        self.flap_window = timedelta(hours=flap_window_hours)
+        
+    @classmethod
+    def from_env(cls):
+        """Build a policy from the HISTORY_* environment variables"""
+        return cls(
+            full_resolution_days=int(os.getenv('HISTORY_FULL_RESOLUTION_DAYS', 90)),
+            archive_after_days=int(os.getenv('HISTORY_ARCHIVE_AFTER_DAYS', 365)),
+            flap_window_hours=int(os.getenv('HISTORY_FLAP_WINDOW_HOURS', 24))
+        )
+
+def merge_observations(rows, flap_window):
+    """
+    Drop redundant observations from rows (sorted by time, each with .price
+    and .timestamp). A row repeating the previous price is dropped, and an
+    A -> B -> A sequence where B lasted less than flap_window collapses to A.
+    Returns the rows to keep.
+    """
+    kept = []
+    for row in rows:
+        if kept and row.price == kept[-1].price:
+            continue
+        if len(kept) >= 2 and row.price == kept[-2].price and row.timestamp - kept[-1].timestamp < flap_window:
+            # kept[-1] was a short-lived blip; the price is back where it was
+            kept.pop()
+            continue
+        kept.append(row)
+    return kept
+
+def downsample_daily(rows):
+    """Keep only the last observation of each calendar day"""
+    by_day = {}
+    for row in rows:
+        by_day[row.timestamp.date()] = row
+    return sorted(by_day.values(), key=lambda row: (row.timestamp, row.id))
+
+def plan_product_compaction(rows, policy, now):
+    """
+    Decide what to do with one product's rows (sorted by time, all older than
+    the full-resolution cutoff). The newest row is always kept in place.
+    Returns (rows_to_archive, ids_to_delete).
+    """
+    if not rows:
+        return [], []
+        
+    archive_cutoff = now - timedelta(days=policy.archive_after_days)
+    newest = rows[-1]
+    
+    to_archive = [row for row in rows if row.timestamp < archive_cutoff and row is not newest]
+    archived_ids = {row.id for row in to_archive}
+    tier = [row for row in rows if row.id not in archived_ids]
+    
+    kept = merge_observations(tier, policy.flap_window)
+    kept = merge_observations(downsample_daily(kept), policy.flap_window)
+    kept_ids = {row.id for row in kept}
+    kept_ids.add(newest.id)
+    
+    to_delete = [row.id for row in tier if row.id not in kept_ids]
+    return to_archive, to_delete
+
+def compact_price_history(policy=None, batch_size=100, now=None, dry_run=False):
+    """
+    Apply the retention policy to all products. Must run inside an app
+    context. Returns a Counter with 'merged', 'archived' and 'reclaimed'
+    (rows removed from the live PriceHistory table).
+    """
+    from models import db, Product, PriceHistory, PriceHistoryArchive
+    
+    policy = policy or RetentionPolicy.from_env()
+    now = now or datetime.utcnow()
+    full_cutoff = now - timedelta(days=policy.full_resolution_days)
+    report = Counter()
+    
+    last_id = 0
+    while True:
+        product_ids = [row.id for row in db.session.query(Product.id)
+                       .filter(Product.id > last_id)
+                       .order_by(Product.id)
+                       .limit(batch_size)]
+        if not product_ids:
+            break
+        last_id = product_ids[-1]
+        
+        rows = db.session.query(
+            PriceHistory.id, PriceHistory.product_id, PriceHistory.price, PriceHistory.timestamp
+        ).filter(
+            PriceHistory.product_id.in_(product_ids),
+            PriceHistory.timestamp < full_cutoff
+        ).order_by(PriceHistory.product_id, PriceHistory.timestamp, PriceHistory.id).all()
+        
+        by_product = {}
+        for row in rows:
+            by_product.setdefault(row.product_id, []).append(row)
+            
+        archive_rows = []
+        delete_ids = []
+        for product_rows in by_product.values():
+            to_archive, to_delete = plan_product_compaction(product_rows, policy, now)
+            archive_rows.extend(to_archive)
+            delete_ids.extend(to_delete)
+            
+        report['merged'] += len(delete_ids)
+        report['archived'] += len(archive_rows)
+        report['reclaimed'] += len(delete_ids) + len(archive_rows)
+        report['products'] += len(product_ids)
+        
+        if dry_run:
+            continue
+            
+        for start in range(0, len(archive_rows), CHUNK_SIZE):
+            chunk = archive_rows[start:start + CHUNK_SIZE]
+            db.session.bulk_insert_mappings(PriceHistoryArchive, [
+                {'id': row.id, 'product_id': row.product_id, 'price': row.price,
+                 'timestamp': row.timestamp, 'archived_at': now}
+                for row in chunk
+            ])
+            delete_ids.extend(row.id for row in chunk)
+            
+        for start in range(0, len(delete_ids), CHUNK_SIZE):
+            chunk = delete_ids[start:start + CHUNK_SIZE]
+            PriceHistory.query.filter(PriceHistory.id.in_(chunk)).delete(synchronize_session=False)
+            
+        db.session.commit()
+        
+    logger.info(
+        f"History compaction {'planned' if dry_run else 'finished'}: "
+        f"{report['merged']} merged, {report['archived']} archived, "
+        f"{report['reclaimed']} rows reclaimed across {report['products']} products"
+    )
+    return report
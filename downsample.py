@@ -0,0 +1,122 @@
+"""
+Shape-preserving downsampling of price series for charts.
+
+Both methods take x (numeric, ascending) and y arrays and return the sorted
+indices of the points to keep, so callers can pick timestamps and prices
+from their own arrays:
+- lttb: Largest-Triangle-Three-Buckets, keeps the visually significant points
+- minmax: keeps the lowest and highest point of every bucket, so no price
+  spike or drop is ever lost
+"""
+
+import numpy as np
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+METHODS = ('lttb', 'minmax')
+
+def bucket_edges(start, stop, buckets):
+    """Return buckets + 1 increasing integer edges splitting [start, stop)"""
+    return np.linspace(start, stop, buckets + 1).astype(np.intp)
+
+def lttb(x, y, threshold):
+    """Return indices of the threshold points chosen by LTTB"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest is split into buckets
+    edges = bucket_edges(1, n - 1, threshold - 2)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # The third triangle corner is the next bucket's mean, or the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    # Each bucket depends on the point chosen in the previous one, so only the
+    # buckets are iterated; the area computation within a bucket is vectorized
+    for i in range(threshold - 2):
+        a = selected[i]
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a])
+        )
+        selected[i + 1] = lo + np.argmax(area)
+
+    return selected
+
+def minmax(x, y, threshold):
+    """Return indices of the minimum and maximum of each of threshold / 2 buckets"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+
+    edges = bucket_edges(0, n, threshold // 2)
+    bucket_ids = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    # Sorting by (bucket, price) puts each bucket's min first and max last
+    order = np.lexsort((y, bucket_ids))
+    lows = order[edges[:-1]]
+    highs = order[edges[1:] - 1]
+
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+def downsample(x, y, threshold, method='lttb'):
+    """Return indices of at most about threshold points using method"""
+    if method == 'minmax':
+        return minmax(x, y, threshold)
+    return lttb(x, y, threshold)
+
+def get_chart_data(product_id, start=None, end=None, points=DEFAULT_POINTS, method='lttb'):
+    """
+    Return the downsampled price history of a product between start and end
+    as chart-ready dates and prices. Ranges with more daily or weekly buckets
+    than points are read from the rollups, so the raw rows are only loaded
+    when they are what the chart would show.
+    """
+    from sqlalchemy import func
+    from models import db, PriceHistory
+    from rollups import choose_resolution, get_rollups
+
+    filters = [PriceHistory.product_id == product_id]
+    if start:
+        filters.append(PriceHistory.timestamp >= start)
+    if end:
+        filters.append(PriceHistory.timestamp <= end)
+    total, first, last = db.session.query(
+        func.count(PriceHistory.id), func.min(PriceHistory.timestamp), func.max(PriceHistory.timestamp)
+    ).filter(*filters).one()
+
+    resolution = 'raw'
+    if total > points:
+        resolution = choose_resolution(start or first, end or last, points)
+
+    if resolution == 'raw':
+        rows = db.session.query(PriceHistory.timestamp, PriceHistory.price) \
+            .filter(*filters).order_by(PriceHistory.timestamp).all()
+        series = [(row.timestamp, row.price) for row in rows]
+    elif method == 'minmax':
+        # Each bucket contributes its low and high, so no spike is lost
+        series = [(row.bucket_start, price) for row in get_rollups(product_id, resolution, start, end)
+                  for price in (row.low_price, row.high_price)]
+    else:
+        series = [(row.bucket_start, row.close_price) for row in get_rollups(product_id, resolution, start, end)]
+
+    timestamps = np.array([timestamp for timestamp, price in series], dtype='datetime64[s]')
+    prices = np.array([price for timestamp, price in series], dtype=np.float64)
+    keep = downsample(timestamps.astype(np.int64), prices, points, method)
+
+    return {
+        'product_id': product_id,
+        'method': method,
+        'resolution': resolution,
+        'total_points': total,
+        'dates': [str(ts)[:16].replace('T', ' ') for ts in timestamps[keep]],
+        'prices': prices[keep].tolist()
+    }
@@ -0,0 +1,252 @@
+"""
+Streaming data exports.
+
+Exports are generated row by row from a single server-side cursor, so worker
+memory stays flat no matter how many products or history rows an account has.
+
+The history export is meant for incremental syncs: rows are ordered by
+PriceHistory id, and a client passes the last id it has seen as "since" to
+fetch only newer rows. Ids are assigned at insert, not at commit, so a
+lower id can become visible after a higher one; the cursor therefore stops
+at rows older than EXPORT_LAG_SECONDS, whose transactions have committed.
+
+Parquet needs pyarrow, which the serverless build (api/requirements.txt)
+leaves out; parquet_available() tells the route whether it can offer it.
+"""
+
+import csv
+import json
+import logging
+import importlib.util
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, literal, null, cast, union_all, String, Float, DateTime
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 1000
+PARQUET_ROW_GROUP_SIZE = 50000
+# Rows written more recently than this may still have uncommitted lower ids
+EXPORT_LAG_SECONDS = 60
+
+CSV_HEADER = ['Product Name', 'Current Price', 'Currency', 'Last Change %', 'Platform', 'URLs', 'Price History']
+
+# Row kinds of the export stream, in the order they arrive for each product
+ROW_PRODUCT, ROW_URL, ROW_HISTORY = 0, 1, 2
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+def product_export_query(user_id):
+    """
+    Return one UNION ALL statement yielding, for each of the user's products,
+    the product row, then its URLs, then its price history in time order.
+    Each branch is a plain indexed scan, and nothing is aggregated in SQL.
+    """
+    from models import Product, URL, PriceHistory
+
+    product_ids = select(URL.product_id).where(URL.user_id == user_id, URL.product_id.isnot(None))
+
+    products = select(
+        Product.id.label('product_id'),
+        literal(ROW_PRODUCT).label('kind'),
+        Product.id.label('item_id'),
+        cast(null(), DateTime).label('timestamp'),
+        Product.name.label('text'),
+        Product.currency.label('extra'),
+        Product.current_price.label('price'),
+        Product.last_change_pct.label('change_pct')
+    ).where(Product.id.in_(product_ids))
+
+    urls = select(
+        URL.product_id,
+        literal(ROW_URL),
+        URL.id,
+        cast(null(), DateTime),
+        URL.url,
+        URL.platform,
+        cast(null(), Float),
+        cast(null(), Float)
+    ).where(URL.user_id == user_id, URL.product_id.isnot(None))
+
+    history = select(
+        PriceHistory.product_id,
+        literal(ROW_HISTORY),
+        PriceHistory.id,
+        PriceHistory.timestamp,
+        cast(null(), String),
+        cast(null(), String),
+        PriceHistory.price,
+        cast(null(), Float)
+    ).where(PriceHistory.product_id.in_(product_ids))
+
+    stream = union_all(products, urls, history).subquery()
+    return select(stream).order_by(stream.c.product_id, stream.c.kind, stream.c.timestamp, stream.c.item_id)
+
+def iter_product_exports(user_id):
+    """Yield one dict per product, built from the ordered export stream"""
+    from models import db
+
+    result = db.session.execute(
+        product_export_query(user_id),
+        execution_options={'stream_results': True, 'yield_per': STREAM_BATCH_SIZE}
+    )
+
+    current = None
+    for row in result:
+        if row.kind == ROW_PRODUCT:
+            if current is not None:
+                yield current
+            current = {
+                'name': row.text,
+                'current_price': row.price,
+                'currency': row.extra,
+                'last_change_pct': row.change_pct or 0,
+                'urls': [],
+                'platforms': [],
+                'history': []
+            }
+        elif row.kind == ROW_URL:
+            current['urls'].append(row.text)
+            current['platforms'].append(row.extra)
+        else:
+            current['history'].append(f"{row.price} ({row.timestamp.strftime('%Y-%m-%d')})")
+
+    if current is not None:
+        yield current
+
+def generate_products_csv(user_id):
+    """Yield the product export as CSV lines"""
+    writer = csv.writer(_Echo())
+    empty = True
+
+    for product in iter_product_exports(user_id):
+        if empty:
+            yield writer.writerow(CSV_HEADER)
+            empty = False
+        yield writer.writerow([
+            product['name'],
+            product['current_price'],
+            product['currency'],
+            product['last_change_pct'],
+            ', '.join(product['platforms']),
+            ', '.join(product['urls']),
+            ', '.join(product['history'])
+        ])
+
+    if empty:
+        yield 'No data available'
+
+def history_export_query(user_id, start=None, end=None, since=None, until=None):
+    """
+    Return the user's price history rows with product details, ordered by id.
+    since and until bound the history id range as (since, until].
+    """
+    from models import Product, URL, PriceHistory
+
+    product_ids = select(URL.product_id).where(URL.user_id == user_id, URL.product_id.isnot(None))
+
+    query = select(
+        PriceHistory.id,
+        PriceHistory.product_id,
+        Product.name.label('product_name'),
+        PriceHistory.price,
+        Product.currency,
+        PriceHistory.timestamp
+    ).join(Product, Product.id == PriceHistory.product_id) \
+        .where(PriceHistory.product_id.in_(product_ids))
+
+    if start:
+        query = query.where(PriceHistory.timestamp >= start)
+    if end:
+        query = query.where(PriceHistory.timestamp <= end)
+    if since:
+        query = query.where(PriceHistory.id > since)
+    if until:
+        query = query.where(PriceHistory.id <= until)
+
+    return query.order_by(PriceHistory.id)
+
+def history_export_bound(since=None, lag_seconds=EXPORT_LAG_SECONDS):
+    """
+    Return the highest history id an export started now should include: the
+    latest row written more than lag_seconds ago, so no transaction can
+    still commit a lower id. Pinning it up front gives a consistent snapshot
+    and lets the next cursor be sent before the body is streamed.
+    """
+    from models import db, PriceHistory
+
+    cutoff = datetime.utcnow() - timedelta(seconds=lag_seconds)
+    # Walks the primary key down from the newest row, past only the last few seconds' rows
+    bound = db.session.query(PriceHistory.id).filter(PriceHistory.timestamp <= cutoff) \
+        .order_by(PriceHistory.id.desc()).limit(1).scalar()
+    return max(bound or 0, since or 0)
+
+def parquet_available():
+    """Return True if pyarrow is installed for Parquet exports"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def iter_history_rows(user_id, start=None, end=None, since=None, until=None):
+    """Yield the history export rows from a streaming cursor"""
+    from models import db
+
+    result = db.session.execute(
+        history_export_query(user_id, start, end, since, until),
+        execution_options={'stream_results': True, 'yield_per': STREAM_BATCH_SIZE}
+    )
+    for row in result:
+        yield row
+
+def generate_history_jsonl(user_id, start=None, end=None, since=None, until=None):
+    """Yield the history export as JSON lines"""
+    for row in iter_history_rows(user_id, start, end, since, until):
+        yield json.dumps({
+            'id': row.id,
+            'product_id': row.product_id,
+            'product_name': row.product_name,
+            'price': row.price,
+            'currency': row.currency,
+            'timestamp': row.timestamp.isoformat()
+        }, ensure_ascii=False) + '\n'
+
+def write_history_parquet(fileobj, user_id, start=None, end=None, since=None, until=None):
+    """
+    Write the history export to fileobj as Parquet, one row group per
+    PARQUET_ROW_GROUP_SIZE rows, and return the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('product_id', pa.int64()),
+        ('product_name', pa.string()),
+        ('price', pa.float64()),
+        ('currency', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+    ])
+
+    def to_table(rows):
+        columns = list(zip(*rows))
+        return pa.Table.from_arrays(
+            [pa.array(column, field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        )
+
+    total = 0
+    batch = []
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for row in iter_history_rows(user_id, start, end, since, until):
+            batch.append(tuple(row))
+            if len(batch) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(to_table(batch))
+                total += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(to_table(batch))
+            total += len(batch)
+
+    return total
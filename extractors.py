@@ -1,14 +1,18 @@
 import requests
 import json
 import re
+import hashlib
 import logging
 from bs4 import BeautifulSoup
 import random
 import time
+from collections import namedtuple
 from urllib.parse import urlparse
 import os
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -34,8 +38,16 @@ def get_random_proxy():
         return random.choice(PROXY_LIST)
     return None
 
-def get_page_content(url):
-    """Get page content with retry mechanism"""
+# Outcome of fetching a page: content is None on failure, status is the last
+# HTTP status (None if no response arrived), error the last request error and
+# size the bytes downloaded over all attempts
+PageFetch = namedtuple('PageFetch', ['content', 'status', 'error', 'size'], defaults=(None, None, 0))
+
+# Error statuses worth retrying within one fetch; other 4xx are final
+RETRY_STATUSES = {408, 425, 429}
+
+def fetch_page(url):
+    """Fetch a page with retries, keeping the status so failures can be classified"""
     max_retries = 3
     retry_delay = 2
     headers = {
@@ -43,32 +55,85 @@ def get_page_content(url):
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'en-US,en;q=0.5',
     }
+    status, error, size = None, None, 0
+    platform = metrics.platform_label(url)
     
     for attempt in range(max_retries):
         try:
             proxy = get_random_proxy()
             proxies = {'http': proxy, 'https': proxy} if proxy else None
             
-            response = requests.get(
-                url, 
-                headers=headers, 
-                proxies=proxies,
-                timeout=10
-            )
+            with metrics.FETCH_SECONDS.time(platform=platform):
+                response = requests.get(
+                    url, 
+                    headers=headers, 
+                    proxies=proxies,
+                    timeout=10
+                )
+            metrics.FETCH_RESPONSES.inc(platform=platform, status=response.status_code)
+            metrics.FETCH_BYTES.inc(len(response.content), platform=platform)
+            size += len(response.content)
             
             if response.status_code == 200:
-                return response.text
+                return PageFetch(response.text, 200, None, size)
                 
+            status, error = response.status_code, None
             logger.warning(f"Request failed with status code {response.status_code}")
+            # A missing or forbidden page will not appear on a retry
+            if status < 500 and status not in RETRY_STATUSES:
+                break
             
         except requests.exceptions.RequestException as e:
+            metrics.FETCH_RESPONSES.inc(platform=platform, status='error')
+            status, error = None, str(e)
             logger.error(f"Request error: {e}")
         
         # Wait before retrying
-        time.sleep(retry_delay * (attempt + 1))
+        if attempt < max_retries - 1:
+            time.sleep(retry_delay * (attempt + 1))
     
-    logger.error(f"Failed to retrieve page content after {max_retries} attempts")
-    return None
+    logger.error(f"Failed to retrieve page content from {url} (status {status})")
+    return PageFetch(None, status, error, size)
+
+def get_page_content(url):
+    """Get page content with retry mechanism; None on failure"""
+    return fetch_page(url).content
+
+# Volatile fragments that change on every render without the product changing
+VOLATILE_CONTENT_PATTERNS = [
+    # HTML comments (build ids, "generated in 0.12s" footers)
+    re.compile(r'<!--.*?-->', re.DOTALL),
+    # CSRF tokens in meta tags and hidden inputs
+    re.compile(r'<meta[^>]+name=["\'](?:csrf[-_]token|_token|csrf-param)["\'][^>]*>', re.IGNORECASE),
+    re.compile(r'<input[^>]+name=["\'](?:_token|csrf[-_]?token|csrfmiddlewaretoken|authenticity_token)["\'][^>]*>', re.IGNORECASE),
+    re.compile(r'(["\']?(?:csrf[-_]?token|_token|nonce)["\']?\s*[:=]\s*)["\'][^"\']*["\']', re.IGNORECASE),
+    # CSP nonces on script/style tags
+    re.compile(r'\snonce=["\'][^"\']*["\']', re.IGNORECASE),
+    # ISO-8601 timestamps and unix epoch seconds/milliseconds
+    re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?'),
+    re.compile(r'(?<![\d.])1\d{9}(?:\d{3})?(?![\d.])'),
+]
+
+def normalize_page_content(html_content):
+    """Strip tokens, nonces and timestamps so identical pages compare equal"""
+    if not html_content:
+        return ''
+    
+    for pattern in VOLATILE_CONTENT_PATTERNS:
+        # Keep the key part of "token: '...'" style assignments
+        if pattern.groups:
+            html_content = pattern.sub(r'\1""', html_content)
+        else:
+            html_content = pattern.sub('', html_content)
+    
+    return re.sub(r'\s+', ' ', html_content).strip()
+
+def page_fingerprint(html_content):
+    """Return a SHA-256 fingerprint of the normalized page content"""
+    if not html_content:
+        return None
+    normalized = normalize_page_content(html_content)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 def detect_platform(url, html_content=None):
     """
@@ -172,7 +237,7 @@ class BaseExtractor:
             'Upgrade-Insecure-Requests': '1',
         }
         
-    def get_product_data(self, url):
+    def get_product_data(self, url, page_content=None):
         """Get product data from URL - to be implemented by subclasses"""
         raise NotImplementedError("Subclasses must implement this method")
         
@@ -213,9 +278,10 @@ class BaseExtractor:
 class SallaExtractor(BaseExtractor):
     """Extractor for Salla platform"""
     
-    def get_product_data(self, url):
+    def get_product_data(self, url, page_content=None):
         """Extract product data from Salla product page"""
-        page_content = self.get_page_content(url)
+        if not page_content:
+            page_content = self.get_page_content(url)
         if not page_content:
             return None
             
@@ -381,9 +447,10 @@ class SallaExtractor(BaseExtractor):
 class ZidExtractor(BaseExtractor):
     """Extractor for Zid platform"""
     
-    def get_product_data(self, url):
+    def get_product_data(self, url, page_content=None):
         """Extract product data from Zid product page"""
-        page_content = self.get_page_content(url)
+        if not page_content:
+            page_content = self.get_page_content(url)
         if not page_content:
             return None
             
@@ -536,25 +603,35 @@ class ZidExtractor(BaseExtractor):
         return product_data
 
 # Function to be used by external code
-def get_product_info(url):
+def get_product_info(url, page_content=None):
     """
     Get product information for a single URL.
     This improved version tries to detect the platform from page content
     and will attempt both extractors if platform detection is ambiguous.
+    Pass page_content to reuse a page that was already fetched.
     """
     # Step 1: Get the page content (do this once to avoid multiple requests)
-    page_content = get_page_content(url)
+    if not page_content:
+        page_content = get_page_content(url)
     if not page_content:
         logger.error(f"Could not fetch content from URL: {url}")
         return None
     
+    started = time.perf_counter()
+    product_data = extract_product_info(url, page_content)
+    platform = product_data['platform'] if product_data else 'unknown'
+    metrics.PARSE_SECONDS.observe(time.perf_counter() - started, platform=platform)
+    return product_data
+
+def extract_product_info(url, page_content):
+    """Extract product information from a fetched page, trying both extractors if needed"""
     # Step 2: Try to detect the platform using the page content
     platform = detect_platform(url, page_content)
     
     # If platform detection succeeded, use the appropriate extractor
     if platform == 'salla':
         extractor = SallaExtractor()
-        product_data = extractor.get_product_data(url)
+        product_data = extractor.get_product_data(url, page_content)
         if product_data:
             product_data['url'] = url
             product_data['platform'] = platform
@@ -562,7 +639,7 @@ def get_product_info(url):
     
     elif platform == 'zid':
         extractor = ZidExtractor()
-        product_data = extractor.get_product_data(url)
+        product_data = extractor.get_product_data(url, page_content)
         if product_data:
             product_data['url'] = url
             product_data['platform'] = platform
@@ -573,7 +650,7 @@ def get_product_info(url):
     
     # Try Salla extractor first
     extractor = SallaExtractor()
-    product_data = extractor.get_product_data(url)
+    product_data = extractor.get_product_data(url, page_content)
     if product_data and product_data.get('price'):
         product_data['url'] = url
         product_data['platform'] = 'salla'
@@ -581,7 +658,7 @@ def get_product_info(url):
     
     # Try Zid extractor next
     extractor = ZidExtractor()
-    product_data = extractor.get_product_data(url)
+    product_data = extractor.get_product_data(url, page_content)
     if product_data and product_data.get('price'):
         product_data['url'] = url
         product_data['platform'] = 'zid'
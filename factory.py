@@ -0,0 +1,202 @@
+"""
+Application factory.
+
+create_app(profile) builds the Flask app from independent components, and
+each profile lists only the components its deployment needs:
+- web: the site and API behind gunicorn, plus CLI commands; runs the
+  scheduler and schema check in development only (one process leads the
+  scheduler, see scheduler.py)
+- serverless: the site and API on Vercel; no scheduler, no CLI, and no
+  schema checks at import unless the database is in memory
+- worker: the price refresh scheduler, without views or login and with
+  no schema check by default; metrics are served on METRICS_PORT instead
+  of /metrics
+- cli: database access and maintenance commands only
+
+For example `gunicorn "factory:create_app('web')"`, `python worker.py`
+or `flask --app "factory:create_app('cli')" upgrade-db`.
+"""
+
+import os
+import logging
+
+from flask import Flask, render_template
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+PROFILES = {
+    'web': ('database', 'login', 'views', 'metrics', 'commands', 'schema', 'scheduler'),
+    'serverless': ('database', 'login', 'views', 'schema'),
+    'worker': ('database', 'metrics', 'schema', 'scheduler'),
+    'cli': ('database', 'commands'),
+}
+
+def env_flag(name, default):
+    """Return a boolean environment variable"""
+    return os.getenv(name, str(default)).lower() == 'true'
+
+def is_production_environment():
+    """Return True on Render, Heroku, Vercel or with FLASK_ENV=production"""
+    return (os.environ.get('RENDER') is not None or os.environ.get('HEROKU_APP_ID') is not None
+            or os.environ.get('VERCEL_ENV') is not None or os.environ.get('SERVERLESS') is not None
+            or os.environ.get('FLASK_ENV') == 'production')
+
+def database_uri(production):
+    """Return the database URI for the environment"""
+    if production:
+        # In production environment, use DATABASE_URL (for PostgreSQL or other external DB)
+        db_url = os.getenv('DATABASE_URL', 'sqlite:///:memory:')
+        if db_url.startswith('postgres://'):
+            # Render uses postgres:// but SQLAlchemy requires postgresql://
+            db_url = db_url.replace('postgres://', 'postgresql://', 1)
+        return db_url
+    # In development environment, use DATABASE_URI (local SQLite)
+    return os.getenv('DATABASE_URI', 'sqlite:///price_monitor.db')
+
+def configure(app, profile):
+    """Load configuration from the environment"""
+    production = profile == 'serverless' or is_production_environment()
+    app.config['PROFILE'] = profile
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(production)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    logger.info(f"Running {profile} profile in {'production' if production else 'development'} mode "
+                f"with database: {app.config['SQLALCHEMY_DATABASE_URI']}")
+
+    # Create and upgrade tables at startup in development only. Production
+    # runs `flask upgrade-db` once per release instead of having every web
+    # and worker process race to upgrade, unless the database is in memory
+    # and has no other way to get its tables. Workers leave it to the web.
+    in_memory = app.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///:memory:'
+    app.config['SCHEMA_CHECK_ON_STARTUP'] = env_flag('SCHEMA_CHECK_ON_STARTUP',
+                                                     profile != 'worker' and (in_memory or not production))
+    # Workers always run the scheduler; the web profile only in development
+    app.config['RUN_SCHEDULER'] = env_flag('RUN_SCHEDULER', profile == 'worker' or not production)
+    # Default refresh interval until one is saved through /update-schedule
+    app.config['SCHEDULER_INTERVAL_MINUTES'] = int(os.getenv('SCHEDULER_INTERVAL_MINUTES', 1440))
+    app.config['SCHEDULER_HEARTBEAT_SECONDS'] = int(os.getenv('SCHEDULER_HEARTBEAT_SECONDS', 30))
+    app.config['REFRESH_DISPATCH_SECONDS'] = int(os.getenv('REFRESH_DISPATCH_SECONDS', 60))
+    # Refresh runs older than this are pruned as the scheduler closes each run
+    app.config['REFRESH_LEDGER_RETENTION_DAYS'] = int(os.getenv('REFRESH_LEDGER_RETENTION_DAYS', 30))
+
+    # Dashboard payload cache (in-process LRU unless CACHE_REDIS_URL is set)
+    app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL')
+    app.config['DASHBOARD_CACHE_TTL'] = int(os.getenv('DASHBOARD_CACHE_TTL', 300))
+    app.config['DASHBOARD_CACHE_SIZE'] = int(os.getenv('DASHBOARD_CACHE_SIZE', 1024))
+
+    # Cached user loading; session claims let GET requests skip the user lookup
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+    app.config['USER_SESSION_CLAIMS'] = env_flag('USER_SESSION_CLAIMS', False)
+
+    # Refresh pipeline metrics; the token, if set, is required to scrape them,
+    # and production serves no metrics until one is set
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['METRICS_REQUIRE_TOKEN'] = env_flag('METRICS_REQUIRE_TOKEN', production)
+    app.config['METRICS_PORT'] = int(os.getenv('METRICS_PORT', 0)) or None
+
+def init_database(app):
+    """Bind the models and keep the search index in sync with writes"""
+    from models import db
+    from search import register_search
+
+    db.init_app(app)
+    register_search(app)
+
+def init_login(app):
+    """Set up Flask-Login with the cached user loader"""
+    from flask_login import LoginManager
+    from user_cache import register_user_loader
+
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.login_view = 'login'
+    register_user_loader(app, login_manager)
+
+def init_views(app):
+    """Register routes, template helpers, HTTP caching and error pages"""
+    from context_processors import register_context_processors
+    from routes import register_routes
+    from httpcache import register_http_cache
+
+    register_context_processors(app)
+    register_routes(app)
+    register_http_cache(app)
+
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('errors/404.html'), 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        logger.error(f"Internal server error: {str(e)}")
+        return render_template('errors/500.html'), 500
+
+    @app.errorhandler(403)
+    def forbidden(e):
+        return render_template('errors/403.html'), 403
+
+def init_metrics(app):
+    """Expose the refresh metrics on /metrics, or on METRICS_PORT without views"""
+    from metrics import register_metrics, serve_metrics
+
+    if 'views' in PROFILES[app.config['PROFILE']]:
+        register_metrics(app)
+    elif app.config['METRICS_PORT']:
+        serve_metrics(app, app.config['METRICS_PORT'])
+
+def init_commands(app):
+    """Register the maintenance CLI commands"""
+    from commands import register_commands
+
+    register_commands(app)
+
+def init_schema(app):
+    """Create missing tables, columns and indexes if enabled"""
+    if not app.config['SCHEMA_CHECK_ON_STARTUP']:
+        return
+    from models import db
+    from migrations import upgrade_schema
+
+    with app.app_context():
+        upgrade_schema(db)
+        logger.info("Database tables created/verified")
+
+def init_scheduler(app):
+    """Start the leader-elected price refresh scheduler if enabled"""
+    if not app.config['RUN_SCHEDULER']:
+        logger.info("Scheduler disabled")
+        return
+    from scheduler import start_scheduler
+
+    start_scheduler(app)
+    logger.info("Scheduler started; prices are refreshed by whichever process holds the leader lock")
+
+COMPONENTS = {
+    'database': init_database,
+    'login': init_login,
+    'views': init_views,
+    'metrics': init_metrics,
+    'commands': init_commands,
+    'schema': init_schema,
+    'scheduler': init_scheduler,
+}
+
+def create_app(profile='web'):
+    """Build the app with the components of the given profile"""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}, expected one of {', '.join(PROFILES)}")
+
+    load_dotenv()
+    logging.basicConfig(
+        level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    app = Flask(__name__)
+    # Set by the scheduler component; None in processes without one
+    app.apscheduler = None
+    configure(app, profile)
+    for component in PROFILES[profile]:
+        COMPONENTS[component](app)
+    return app
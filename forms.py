@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, SelectField, FloatField, IntegerField
-from wtforms.validators import DataRequired, Email, EqualTo, URL, Optional, ValidationError
+from wtforms.validators import DataRequired, Email, EqualTo, URL, Optional, Length, ValidationError
 import re
 
 class LoginForm(FlaskForm):
@@ -30,9 +30,12 @@ class URLBatchForm(FlaskForm):
     submit = SubmitField('Add URLs')
     
 class ProductFilterForm(FlaskForm):
+    q = StringField('Search', validators=[Optional(), Length(max=200)])
     platform = SelectField('Platform', choices=[('all', 'All'), ('salla', 'Salla'), ('zid', 'Zid')], default='all')
     price_min = FloatField('Min Price', validators=[Optional()])
     price_max = FloatField('Max Price', validators=[Optional()])
+    change_min = FloatField('Min Change %', validators=[Optional()])
+    change_max = FloatField('Max Change %', validators=[Optional()])
     sort_by = SelectField('Sort By', choices=[
         ('name', 'Name'), 
         ('price_asc', 'Price (Low to High)'), 
@@ -0,0 +1,182 @@
+"""
+HTTP caching for pages, JSON endpoints and static assets.
+
+Dynamic GET views are wrapped with conditional(), which asks a cheap version
+function for the data the view depends on (e.g. the latest Product.updated_at
+and URL counts of the current user) before running the view. The ETag is
+derived from that version, the user and the full request path, so a
+revalidation with a matching If-None-Match gets a 304 without running the
+view's queries or rendering its template. Responses are marked private and
+must be revalidated, so browsers and proxies never serve another user's page
+or a stale one.
+
+Static assets are served from fingerprinted URLs (css/style.<hash>.css) with
+a one-year immutable Cache-Control, and the templates link to them through
+asset_url().
+"""
+
+import os
+import re
+import time
+import hashlib
+from functools import wraps
+from datetime import timezone
+
+from flask import g, request, session, make_response, send_from_directory, url_for, current_app
+from flask_login import current_user
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 12
+FINGERPRINTED_NAME = re.compile(r'^(?P<root>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+# (filename, mtime) -> digest
+_fingerprints = {}
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+
+def csrf_window():
+    """
+    Return a counter that advances every half CSRF lifetime, so a page kept
+    fresh by revalidation never carries an expired form token.
+    """
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 0
+    return int(time.time() // (limit / 2)) if limit else 0
+
+def not_modified(etag, last_modified):
+    """
+    Return True if the request's validators match the current version.
+    If-Modified-Since is only honoured without an ETag: the latest timestamp
+    does not move when a product or URL is deleted, while the ETag's
+    version (which includes the counts) does.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if etag is None and last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
+
+def conditional(version_func):
+    """
+    Decorator for GET views. version_func receives the view arguments and
+    returns (version, last_modified) describing everything the response
+    depends on, or None to skip caching (e.g. the object does not exist).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Pages rendering one-off flash messages are never cached
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            current = version_func(*args, **kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+
+            version, last_modified = current
+            # Views reuse it, e.g. in their server-side cache keys
+            g.data_version = version
+            etag = _digest(current_user.get_id(), request.full_path, version, csrf_window())
+
+            if not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapped
+    return decorator
+
+def user_listing_version(*args, **kwargs):
+    """Version of the current user's products and URLs, in one query"""
+    from sqlalchemy import select, func
+    from models import db, Product, URL
+
+    user_id = current_user.id
+    products = Product.urls.any(URL.user_id == user_id)
+    row = db.session.execute(select(
+        select(func.max(Product.updated_at)).where(products).scalar_subquery(),
+        select(func.count(Product.id)).where(products).scalar_subquery(),
+        select(func.max(URL.id)).where(URL.user_id == user_id).scalar_subquery(),
+        select(func.count(URL.id)).where(URL.user_id == user_id).scalar_subquery(),
+        select(func.max(URL.last_checked)).where(URL.user_id == user_id).scalar_subquery()
+    )).one()
+
+    timestamps = [value for value in (row[0], row[4]) if value is not None]
+    return tuple(row), max(timestamps) if timestamps else None
+
+def product_version(product_id, *args, **kwargs):
+    """Version of one product, its history, URLs and match group, in one query"""
+    from sqlalchemy import select, func
+    from sqlalchemy.orm import aliased
+    from models import db, Product, PriceHistory, URL
+
+    member = aliased(Product)
+    row = db.session.execute(select(
+        Product.updated_at,
+        select(func.max(PriceHistory.id)).where(PriceHistory.product_id == Product.id).scalar_subquery(),
+        select(func.count(PriceHistory.id)).where(PriceHistory.product_id == Product.id).scalar_subquery(),
+        select(func.max(URL.id)).where(URL.product_id == Product.id).scalar_subquery(),
+        select(func.count(URL.id)).where(URL.product_id == Product.id).scalar_subquery(),
+        select(func.max(member.updated_at)).where(member.match_key == Product.match_key).scalar_subquery()
+    ).where(Product.id == product_id)).first()
+    if row is None:
+        return None
+
+    timestamps = [value for value in (row[0], row[5]) if value is not None]
+    return tuple(row), max(timestamps) if timestamps else None
+
+def asset_fingerprint(filename):
+    """Return the content digest of a static file, cached until it changes"""
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    key = (filename, mtime)
+    if key not in _fingerprints:
+        with open(path, 'rb') as f:
+            _fingerprints[key] = hashlib.md5(f.read()).hexdigest()[:FINGERPRINT_LENGTH]
+    return _fingerprints[key]
+
+def asset_url(filename):
+    """Return the fingerprinted URL of a static file"""
+    try:
+        digest = asset_fingerprint(filename)
+    except OSError:
+        return url_for('static', filename=filename)
+    root, ext = os.path.splitext(filename)
+    return url_for('fingerprinted_asset', filename=f'{root}.{digest}{ext}')
+
+def register_http_cache(app):
+    """Register the fingerprinted asset route and the asset_url template helper"""
+
+    @app.route('/assets/<path:filename>')
+    def fingerprinted_asset(filename):
+        """Serve a static file by its fingerprinted name"""
+        match = FINGERPRINTED_NAME.match(filename)
+        if not match:
+            return send_from_directory(app.static_folder, filename)
+
+        original = match.group('root') + match.group('ext')
+        response = send_from_directory(app.static_folder, original, max_age=STATIC_MAX_AGE)
+        try:
+            current = asset_fingerprint(original) == match.group('digest')
+        except OSError:
+            current = False
+
+        if current:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        else:
+            # An outdated fingerprint still gets the file, but only briefly cached
+            response.cache_control.max_age = 0
+            response.cache_control.no_cache = True
+        return response
+
+    app.add_template_global(asset_url)
@@ -0,0 +1,197 @@
+"""
+Keyset (cursor) pagination for the product and URL listings.
+
+Pages are fetched with "WHERE (sort_key, id) > (last_key, last_id)" instead
+of OFFSET, so every page costs the same no matter how deep it is or how many
+items a user tracks. The cursor is an opaque URL-safe token holding the sort
+key and id of the last item on the previous page. Items without a sort key
+(e.g. no price yet) follow all the others, ordered by id.
+"""
+
+import json
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import and_, or_, false
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+def get_sort_spec(sort_by):
+    """Return (column, descending) for a ProductFilterForm sort mode"""
+    from models import Product
+
+    specs = {
+        'name': (Product.name, False),
+        'price_asc': (Product.current_price, False),
+        'price_desc': (Product.current_price, True),
+        'change_asc': (Product.last_change_pct, False),
+        'change_desc': (Product.last_change_pct, True),
+        'updated': (Product.updated_at, True),
+    }
+    return specs.get(sort_by, specs['updated'])
+
+def encode_cursor(value, item_id):
+    """Encode the last sort key and id of a page as an opaque token"""
+    if isinstance(value, datetime):
+        value = {'dt': value.isoformat()}
+    payload = json.dumps([value, item_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor into (value, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(value, dict) and 'dt' in value:
+            value = datetime.fromisoformat(value['dt'])
+        return value, int(item_id)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def keyset_page(query, column, id_column, descending=False, cursor=None, page_size=DEFAULT_PAGE_SIZE, key=None):
+    """
+    Return (items, next_cursor) for one page of query ordered by (column, id).
+    key extracts the sort value from an item; defaults to the column's attribute.
+    Rows with a NULL sort key come last in both directions, on every database.
+    """
+    page_size = max(1, min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        after_id = id_column < last_id if descending else id_column > last_id
+        if value is None:
+            # Already in the NULL tail, which is ordered by id alone
+            query = query.filter(column.is_(None), after_id)
+        else:
+            after_value = column < value if descending else column > value
+            query = query.filter(or_(after_value, and_(column == value, after_id), column.is_(None)))
+
+    if descending:
+        query = query.order_by(column.desc().nulls_last(), id_column.desc())
+    else:
+        query = query.order_by(column.asc().nulls_last(), id_column)
+
+    items = query.limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        value = key(last) if key else getattr(last, column.key)
+        next_cursor = encode_cursor(value, last.id)
+
+    return items, next_cursor
+
+def product_listing_query(user_id, form):
+    """Return the filtered (unsorted) product query for a ProductFilterForm"""
+    from models import Product, URL
+
+    url_filters = [URL.user_id == user_id]
+    if form.platform.data and form.platform.data != 'all':
+        url_filters.append(URL.platform == form.platform.data)
+
+    # EXISTS instead of a join, so products with several URLs appear once
+    query = Product.query.filter(Product.urls.any(and_(*url_filters)))
+
+    # Full-text matches keep the selected sort order and keyset pagination
+    if form.q.data and form.q.data.strip():
+        from search import search_filter
+        clause = search_filter(form.q.data)
+        query = query.filter(clause if clause is not None else false())
+
+    if form.price_min.data is not None:
+        query = query.filter(Product.current_price >= form.price_min.data)
+
+    if form.price_max.data is not None:
+        query = query.filter(Product.current_price <= form.price_max.data)
+
+    # Change thresholds use the maintained column, so they are indexed like the sorts
+    if form.change_min.data is not None:
+        query = query.filter(Product.last_change_pct >= form.change_min.data)
+
+    if form.change_max.data is not None:
+        query = query.filter(Product.last_change_pct <= form.change_max.data)
+
+    return query
+
+def product_listing_page(user_id, form, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Return (products, next_cursor) for one dashboard page"""
+    from sqlalchemy.orm import selectinload
+    from models import Product
+
+    column, descending = get_sort_spec(form.sort_by.data)
+    query = product_listing_query(user_id, form).options(selectinload(Product.urls))
+    return keyset_page(query, column, Product.id, descending, cursor, page_size)
+
+def build_dashboard_payload(user_id, form, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return the JSON-serializable dashboard payload for one page: the
+    products, their chart history and the next cursor.
+    """
+    from models import PriceHistory
+
+    products, next_cursor = product_listing_page(user_id, form, cursor, page_size)
+
+    items = []
+    for product in products:
+        item = product_to_dict(product)
+        item['updated_label'] = product.updated_at.strftime('%Y-%m-%d %H:%M') if product.updated_at else ''
+        items.append(item)
+
+    # Chart history for all products on the page with a single query
+    price_history = {}
+    if products:
+        history = PriceHistory.query.with_entities(
+            PriceHistory.product_id, PriceHistory.timestamp, PriceHistory.price
+        ).filter(
+            PriceHistory.product_id.in_([product.id for product in products])
+        ).order_by(PriceHistory.product_id, PriceHistory.timestamp)
+
+        for h in history:
+            series = price_history.setdefault(str(h.product_id), {'dates': [], 'prices': []})
+            series['dates'].append(h.timestamp.strftime('%Y-%m-%d'))
+            series['prices'].append(h.price)
+
+    return {'items': items, 'price_history': price_history, 'next_cursor': next_cursor}
+
+def url_listing_page(user_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Return (urls, next_cursor) for one page of a user's URLs, newest first"""
+    from sqlalchemy.orm import joinedload
+    from models import URL
+
+    query = URL.query.filter(URL.user_id == user_id).options(joinedload(URL.product))
+    return keyset_page(query, URL.id, URL.id, True, cursor, page_size)
+
+def product_to_dict(product):
+    """Serialize a product for the JSON listing"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'current_price': product.current_price,
+        'currency': product.currency,
+        'last_change_pct': product.last_change_pct,
+        'image_url': product.image_url,
+        'availability': product.availability,
+        'updated_at': product.updated_at.isoformat() if product.updated_at else None,
+        'platforms': sorted({url.platform for url in product.urls if url.platform}),
+    }
+
+def url_to_dict(url):
+    """Serialize a tracked URL for the JSON listing"""
+    return {
+        'id': url.id,
+        'url': url.url,
+        'platform': url.platform,
+        'is_valid': url.is_valid,
+        'last_checked': url.last_checked.isoformat() if url.last_checked else None,
+        'next_check_at': url.next_check_at.isoformat() if url.next_check_at else None,
+        'failure_kind': url.failure_kind,
+        'failure_count': url.failure_count or 0,
+        'product_id': url.product_id,
+        'product_name': url.product.name if url.product else None,
+    }
@@ -0,0 +1,224 @@
+"""
+Cross-store product matching.
+
+Every product gets a match_key shared by all equivalent products, so the
+offers for an item across Salla and Zid stores are one indexed range on
+(match_key, current_price) instead of a pairwise comparison:
+- products with a SKU match on the normalized SKU (and brand, when known)
+- other products match on the set of normalized name and brand tokens
+- a product whose token set is new joins the group of an existing product
+  from the token index when the names are near-identical and they agree on
+  quantities and variant words (organic, light, sugar-free, ...)
+
+Name normalization handles Arabic spelling variants (hamza forms, taa
+marbuta, alef maqsura, diacritics, tatweel, Arabic-Indic digits and the
+definite article) so the same item is spelled identically across stores.
+"""
+
+import re
+import hashlib
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Minimum Jaccard similarity of name tokens for a fuzzy match
+MIN_SIMILARITY = 0.8
+MAX_CANDIDATES = 20
+MIN_SKU_LENGTH = 4
+
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{digit: str(i) for i, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    **{digit: str(i) for i, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+})
+# Words that make a different product of an otherwise identical name; in normalized form
+VARIANT_TOKENS = {
+    'عضوي', 'organic', 'لايت', 'light', 'دايت', 'diet', 'زيرو', 'zero',
+    'خالي', 'بدون', 'free', 'منزوع', 'decaf', 'قليل', 'low',
+}
+STOPWORDS = {'و', 'من', 'في', 'مع', 'على', 'the', 'and', 'with', 'for', 'of'}
+UNIT_ALIASES = {
+    'مل': 'ml', 'ملل': 'ml', 'مللي': 'ml',
+    'لتر': 'l', 'ltr': 'l', 'liter': 'l', 'litre': 'l',
+    'جم': 'g', 'جرام': 'g', 'غرام': 'g', 'غ': 'g', 'gm': 'g', 'gram': 'g', 'grams': 'g',
+    'كجم': 'kg', 'كيلو': 'kg', 'كغ': 'kg', 'kilo': 'kg',
+    'حبه': 'pcs', 'حبات': 'pcs', 'قطعه': 'pcs', 'pc': 'pcs', 'piece': 'pcs', 'pieces': 'pcs',
+}
+
+def normalize_name(text):
+    """Return text lowercased, with Arabic variants unified and punctuation removed"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ARABIC_MARKS.sub('', text).translate(ARABIC_LETTERS)
+    text = re.sub(r'[\W_]+', ' ', text)
+    # Separate quantities from units: 500ml -> 500 ml
+    text = re.sub(r'(?<=\d)(?=[^\d\s])|(?<=[^\d\s])(?=\d)', ' ', text)
+    return ' '.join(text.split())
+
+def name_terms(normalized):
+    """Return the matching terms of a normalized text, in order"""
+    terms = []
+    for token in normalized.split():
+        if token.startswith('ال') and len(token) > 3:
+            token = token[2:]
+        token = UNIT_ALIASES.get(token, token)
+        if token in STOPWORDS or (len(token) < 2 and not token.isdigit() and token not in UNIT_ALIASES.values()):
+            continue
+        terms.append(token[:50])
+    return terms
+
+def name_tokens(normalized):
+    """Return the set of matching tokens of a normalized name"""
+    return set(name_terms(normalized))
+
+def normalize_sku(sku):
+    """Return the SKU uppercased with separators removed"""
+    return re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', str(sku or ''))).upper()
+
+def _digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+def exact_match_key(product, tokens):
+    """Return the match key implied by the product's SKU or name tokens alone"""
+    sku = normalize_sku(product.sku)
+    if len(sku) >= MIN_SKU_LENGTH:
+        return 'sku:' + _digest(f"{sku}@{normalize_name(product.brand)}")[:56]
+    if tokens:
+        return 'name:' + _digest(' '.join(sorted(tokens)))[:55]
+    return None
+
+def similarity(tokens, other):
+    """Jaccard similarity of two token sets; quantities and variant words must agree exactly"""
+    if {t for t in tokens if t.isdigit()} != {t for t in other if t.isdigit()}:
+        return 0.0
+    if tokens & VARIANT_TOKENS != other & VARIANT_TOKENS:
+        return 0.0
+    return len(tokens & other) / len(tokens | other) if tokens or other else 0.0
+
+def find_similar_product(product, tokens):
+    """
+    Return the most similar other product with a name match key, using the
+    token index to count shared tokens instead of comparing every product.
+    """
+    from sqlalchemy import func
+    from models import db, Product, ProductNameToken
+
+    if not tokens:
+        return None
+
+    shared = func.count(ProductNameToken.token).label('shared')
+    candidates = db.session.query(ProductNameToken.product_id, shared) \
+        .filter(ProductNameToken.token.in_(tokens)) \
+        .filter(ProductNameToken.product_id != product.id) \
+        .group_by(ProductNameToken.product_id) \
+        .having(shared >= MIN_SIMILARITY * len(tokens)) \
+        .order_by(shared.desc()) \
+        .limit(MAX_CANDIDATES).all()
+    if not candidates:
+        return None
+
+    best, best_score = None, MIN_SIMILARITY
+    others = Product.query.filter(Product.id.in_([c.product_id for c in candidates]),
+                                  Product.match_key.like('name:%')).all()
+    for other in others:
+        other_tokens = name_tokens(' '.join(filter(None, [other.normalized_name, normalize_name(other.brand)])))
+        score = similarity(tokens, other_tokens)
+        if score >= best_score:
+            best, best_score = other, score
+    return best
+
+def index_product(product):
+    """
+    Recompute the product's normalized name, token index rows and match key.
+    The caller commits.
+    """
+    from models import db, Product, ProductNameToken
+
+    product.normalized_name = normalize_name(product.name)[:200]
+    tokens = name_tokens(' '.join(filter(None, [product.normalized_name, normalize_name(product.brand)])))
+
+    existing = {row.token: row for row in product.name_tokens}
+    for token, row in existing.items():
+        if token not in tokens:
+            product.name_tokens.remove(row)
+    for token in tokens - existing.keys():
+        product.name_tokens.append(ProductNameToken(token=token))
+
+    key = exact_match_key(product, tokens)
+    if key and key.startswith('name:'):
+        exists = db.session.query(Product.id).filter(Product.match_key == key, Product.id != product.id).first()
+        if not exists:
+            similar = find_similar_product(product, tokens)
+            if similar is not None:
+                key = similar.match_key
+    product.match_key = key
+    return key
+
+def apply_product_identity(product, product_data):
+    """
+    Copy sku, brand and store_name from extracted product_data.
+    Returns True if any of them changed.
+    """
+    changed = False
+    for field, length in (('sku', 100), ('brand', 100), ('store_name', 200)):
+        value = product_data.get(field)
+        if value:
+            value = str(value).strip()[:length]
+            if value != getattr(product, field):
+                setattr(product, field, value)
+                changed = True
+    return changed
+
+def cheapest_across_stores(product, user_id, limit=10):
+    """
+    Return the user's products in the same match group, cheapest first.
+    Products only other users track are left out, so their URLs and prices
+    are never shown.
+    """
+    from sqlalchemy.orm import selectinload
+    from models import Product, URL
+
+    if not product.match_key:
+        return [product]
+    return Product.query.options(selectinload(Product.urls)) \
+        .filter(Product.match_key == product.match_key, Product.current_price.isnot(None)) \
+        .filter(Product.urls.any(URL.user_id == user_id)) \
+        .order_by(Product.current_price, Product.id) \
+        .limit(limit).all()
+
+def offer_to_dict(product, user_id):
+    """Serialize a match group member for the offers API, with the user's URL for it"""
+    url = next((url for url in product.urls if url.user_id == user_id), None)
+    return {
+        'product_id': product.id,
+        'name': product.name,
+        'store_name': product.store_name,
+        'price': product.current_price,
+        'currency': product.currency,
+        'platform': url.platform if url else None,
+        'url': url.url if url else None,
+    }
+
+def rebuild_match_index(batch_size=500):
+    """Index every product; returns the number of products indexed"""
+    from models import db, Product
+
+    indexed = 0
+    last_id = 0
+    while True:
+        products = Product.query.filter(Product.id > last_id).order_by(Product.id).limit(batch_size).all()
+        if not products:
+            break
+        for product in products:
+            index_product(product)
+            # Flush so later products in the batch can match this one
+            db.session.flush()
+        db.session.commit()
+        indexed += len(products)
+        last_id = products[-1].id
+        logger.info(f"Indexed {indexed} products for matching")
+    return indexed
@@ -0,0 +1,328 @@
+"""
+Refresh pipeline metrics in the Prometheus text exposition format.
+
+A small in-process registry of counters, gauges and histograms, named and
+shaped like prometheus_client's so the two can be swapped. The refresh
+pipeline records into the module-level metrics below:
+- extractors.fetch_page: per-host request latency, status and bytes
+- extractors.get_product_info: parse time per platform
+- tasks.update_product_price: check outcome and duration, database write
+  time and detected price changes
+The refresh queue depth is read from the app's database on each scrape.
+
+Fetch metrics are labelled by store platform (salla, zid or other) rather
+than by host, since hosts come from user-submitted URLs: a host label would
+grow without bound and reveal which stores users track.
+
+Each process keeps its own values. The web app serves them on /metrics;
+worker.py, where the scheduler leader runs the refresh, serves them on
+METRICS_PORT. Set METRICS_TOKEN to require "Authorization: Bearer <token>";
+in production (METRICS_REQUIRE_TOKEN) nothing is served without one.
+"""
+
+import time
+import hmac
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Store platforms by domain suffix; every other host is reported as 'other'
+PLATFORM_DOMAINS = {
+    'salla': ('salla.sa', 'salla.com'),
+    'zid': ('zid.store', 'zid.sa'),
+}
+# Scrapes within this many seconds share one queue depth count
+QUEUE_DEPTH_TTL = 15
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FETCH_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def unregister(self, metric):
+        with self._lock:
+            self._metrics.pop(metric.name, None)
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class Metric:
+    """Base for labelled metrics; label values are passed as keyword arguments"""
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        """Current value for one label set, mainly for tests"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, format_labels(self.labelnames, key), value) for key, value in items]
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        Compute the gauge on each scrape instead. function returns a number,
+        or a dict of label-value tuples to numbers for labelled gauges.
+        """
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            result = self._function()
+        except Exception as e:
+            logger.error(f"Could not collect {self.name}: {str(e)}")
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [(self.name, format_labels(self.labelnames, key), value) for key, value in sorted(result.items())]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][index] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def value(self, **labels):
+        """Number of observations for one label set"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry['count'] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, dict(entry, counts=list(entry['counts']))) for key, entry in self._values.items())
+        samples = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['counts']):
+                cumulative += count
+                labels = format_labels(self.labelnames + ('le',), key + (format_value(bound),))
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, entry['sum']))
+            samples.append((f"{self.name}_count", labels, entry['count']))
+        return samples
+
+def platform_label(url):
+    """Return the store platform of url from its domain, or 'other'"""
+    host = (urlparse(url).hostname or '').lower()
+    for platform, domains in PLATFORM_DOMAINS.items():
+        if any(host == domain or host.endswith('.' + domain) for domain in domains):
+            return platform
+    return 'other'
+
+FETCH_SECONDS = Histogram('pricetracker_fetch_seconds', 'Duration of each product page request',
+                          ['platform'], buckets=FETCH_BUCKETS)
+FETCH_RESPONSES = Counter('pricetracker_fetch_responses_total',
+                          'Product page requests by HTTP status, "error" when no response arrived',
+                          ['platform', 'status'])
+FETCH_BYTES = Counter('pricetracker_fetch_bytes_total', 'Bytes of product pages downloaded', ['platform'])
+PARSE_SECONDS = Histogram('pricetracker_parse_seconds', 'Time to extract product data from a page',
+                          ['platform'])
+DB_WRITE_SECONDS = Histogram('pricetracker_db_write_seconds', 'Time to write the result of a URL check')
+URL_CHECKS = Counter('pricetracker_url_checks_total', 'URL checks by outcome', ['outcome'])
+URL_CHECK_SECONDS = Histogram('pricetracker_url_check_seconds', 'Duration of a whole URL check',
+                              buckets=FETCH_BUCKETS)
+PRICE_CHANGES = Counter('pricetracker_price_changes_total', 'Price changes detected', ['direction'])
+QUEUE_URLS = Gauge('pricetracker_refresh_queue_urls', 'URLs in the refresh queue by state', ['state'])
+
+def record_check(outcome, started):
+    """Count a finished URL check; started is its time.perf_counter()"""
+    URL_CHECKS.inc(outcome=outcome)
+    URL_CHECK_SECONDS.observe(time.perf_counter() - started)
+
+# Database URL -> (expiry, counts) of the latest queue depth count
+_queue_depths = {}
+
+def queue_depth():
+    """
+    Return {(state,): count} of due, scheduled and quarantined URLs in the
+    current app's database, counted at most once per QUEUE_DEPTH_TTL
+    """
+    from datetime import datetime
+    from flask import has_app_context
+    from sqlalchemy import case, func
+    from models import db, URL
+
+    if not has_app_context():
+        return {}
+    key = str(db.engine.url)
+    cached = _queue_depths.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    now = datetime.utcnow()
+    valid, due, quarantined = db.session.query(
+        func.count(case((URL.is_valid == True, 1))),
+        func.count(case(((URL.is_valid == True) & (URL.next_check_at <= now), 1))),
+        func.count(case((URL.is_valid == False, 1))),
+    ).one()
+    counts = {('due',): due, ('scheduled',): valid - due, ('quarantined',): quarantined}
+    _queue_depths[key] = (time.monotonic() + QUEUE_DEPTH_TTL, counts)
+    return counts
+
+QUEUE_URLS.set_function(queue_depth)
+
+def authorized(token, header):
+    """Check an Authorization header against METRICS_TOKEN, if one is set"""
+    if not token:
+        return True
+    # Bytes, since compare_digest rejects non-ASCII str
+    expected = f'Bearer {token}'.encode('utf-8')
+    return hmac.compare_digest((header or '').encode('utf-8', 'replace'), expected)
+
+def token_missing(app):
+    """Return True if metrics must not be served because METRICS_TOKEN is required but unset"""
+    return app.config.get('METRICS_REQUIRE_TOKEN') and not app.config.get('METRICS_TOKEN')
+
+def register_metrics(app):
+    """Serve the metrics on /metrics"""
+    from flask import Response, request
+
+    if token_missing(app):
+        logger.warning("METRICS_TOKEN is not set, /metrics is disabled")
+
+    @app.route('/metrics')
+    def metrics():
+        if token_missing(app):
+            return Response('Metrics are disabled until METRICS_TOKEN is set\n', status=404, mimetype='text/plain')
+        if not authorized(app.config.get('METRICS_TOKEN'), request.headers.get('Authorization')):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE,
+                        headers={'Cache-Control': 'no-store'})
+
+def serve_metrics(app, port):
+    """
+    Serve the metrics on port from a daemon thread, for processes without
+    routes. Returns the server, or None if a required token is missing.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if token_missing(app):
+        logger.warning(f"METRICS_TOKEN is not set, not serving metrics on port {port}")
+        return None
+    token = app.config.get('METRICS_TOKEN')
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            if not authorized(token, self.headers.get('Authorization')):
+                self.send_error(401)
+                return
+            with app.app_context():
+                body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
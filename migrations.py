@@ -0,0 +1,141 @@
+"""
+Lightweight schema upgrades for existing databases.
+db.create_all() only creates missing tables, so columns and indexes added to
+existing models are applied here with plain ALTER TABLE / CREATE INDEX
+statements, and the full-text search table is created. Works on both SQLite
+and PostgreSQL.
+
+Upgrades run from `flask upgrade-db` (the release step in production) and,
+in development, at startup. On PostgreSQL they hold an advisory lock so
+processes started together upgrade one after another.
+"""
+
+import hashlib
+import logging
+from contextlib import contextmanager
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_LOCK_NAME = 'schema_upgrade'
+
+@contextmanager
+def schema_lock(engine):
+    """Hold a PostgreSQL advisory lock while the schema is upgraded"""
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+    # pg advisory locks take a signed 64-bit key
+    key = int(hashlib.sha1(SCHEMA_LOCK_NAME.encode('utf-8')).hexdigest()[:15], 16)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': key})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+            conn.commit()
+
+def add_missing_columns(engine, metadata):
+    """Add columns declared on the models but missing from existing tables"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    # Guards against a process upgrading outside the lock, e.g. an older release
+    if_not_exists = 'IF NOT EXISTS ' if engine.dialect.name == 'postgresql' else ''
+    added = []
+    
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+                
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                    
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {if_not_exists}{preparer.quote(column.name)} {column_type}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, str):
+                        default = "'" + default.replace("'", "''") + "'"
+                    else:
+                        default = default.compile(dialect=engine.dialect)
+                    ddl += f" DEFAULT {default}"
+                    
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+                logger.info(f"Added column {table.name}.{column.name}")
+                
+    return added
+
+def add_missing_indexes(engine, metadata):
+    """Create indexes declared on the models but missing from existing tables"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    is_postgres = engine.dialect.name == 'postgresql'
+    added = []
+    
+    # PostgreSQL builds indexes CONCURRENTLY so large live tables are not
+    # write-locked; that statement cannot run inside a transaction
+    options = {'isolation_level': 'AUTOCOMMIT'} if is_postgres else {}
+    with engine.connect().execution_options(**options) as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+                
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                    
+                if is_postgres:
+                    columns = ', '.join(preparer.quote(column.name) for column in index.columns)
+                    conn.execute(text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {preparer.quote(index.name)} "
+                        f"ON {preparer.quote(table.name)} ({columns})"
+                    ))
+                else:
+                    index.create(bind=conn)
+                added.append(index.name)
+                logger.info(f"Created index {index.name} on {table.name}")
+                
+        if not is_postgres:
+            conn.commit()
+            
+    return added
+
+def upgrade_schema(db):
+    """Create missing tables and bring existing ones up to date with the models"""
+    with schema_lock(db.engine):
+        db.create_all()
+        return _upgrade_schema(db)
+
+def _upgrade_schema(db):
+    from search import create_search_index, rebuild_search_index, backfill_normalized_names
+    
+    added_columns = add_missing_columns(db.engine, db.metadata)
+    added_indexes = add_missing_indexes(db.engine, db.metadata)
+    
+    # The search table is engine-specific DDL outside the models; fill it
+    # once when it is first created
+    search_index = create_search_index(db.engine)
+    
+    # Pooled connections keep the schema they were opened with; drop them so
+    # every statement is planned against the new columns and indexes. An
+    # in-memory database lives only in its one connection, so it is kept.
+    in_memory = db.engine.url.database in (None, '', ':memory:')
+    if (added_columns or added_indexes or search_index) and not in_memory:
+        db.engine.dispose()
+        
+    if search_index:
+        rebuild_search_index()
+        
+    # The LIKE search fallback matches on normalized names, which older rows lack
+    normalized = backfill_normalized_names()
+        
+    return {'columns': added_columns, 'indexes': added_indexes, 'search_index': search_index,
+            'normalized_names': normalized}
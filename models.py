@@ -28,9 +28,21 @@ class URL(db.Model):
     platform = db.Column(db.String(50))  # 'salla', 'zid', etc.
     is_valid = db.Column(db.Boolean, default=True)
     last_checked = db.Column(db.DateTime)
+    next_check_at = db.Column(db.DateTime)  # When the refresh queue releases this URL next
+    failure_kind = db.Column(db.String(20))  # 'network', 'http_4xx', 'http_5xx' or 'parse' after a failed check
+    failure_count = db.Column(db.Integer, default=0, server_default='0')  # Consecutive failed checks
+    failed_rechecks = db.Column(db.Integer, default=0, server_default='0')  # Failed checks since quarantine
+    last_error = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64))  # Fingerprint of the last extracted page
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), index=True)
+    
+    # Refresh runs select valid URLs ordered by staleness or due time
+    __table_args__ = (
+        db.Index('ix_url_is_valid_last_checked', 'is_valid', 'last_checked'),
+        db.Index('ix_url_is_valid_next_check_at', 'is_valid', 'next_check_at'),
+    )
     
     user = db.relationship('User', backref=db.backref('urls', lazy=True))
     product = db.relationship('Product', backref=db.backref('urls', lazy=True))
@@ -49,31 +61,115 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Denormalized from the two latest PriceHistory rows, maintained on price writes
+    previous_price = db.Column(db.Float)
+    last_change_pct = db.Column(db.Float, default=0, server_default='0')
+    last_changed_at = db.Column(db.DateTime)
+    
+    # Store identity as extracted, and the cross-store match group (see matching.py)
+    sku = db.Column(db.String(100), index=True)
+    brand = db.Column(db.String(100))
+    store_name = db.Column(db.String(200))
+    normalized_name = db.Column(db.String(200))
+    match_key = db.Column(db.String(64))
+    
+    __table_args__ = (
+        db.Index('ix_product_last_change_pct', 'last_change_pct'),
+        # Cheapest offer in a match group is the first row of an index range
+        db.Index('ix_product_match_key_current_price', 'match_key', 'current_price'),
+    )
+    
     price_history = db.relationship('PriceHistory', backref=db.backref('product', lazy=True), 
                                    order_by="desc(PriceHistory.timestamp)")
+    name_tokens = db.relationship('ProductNameToken', backref='product', lazy=True, cascade='all, delete-orphan')
     
     @property
     def last_price_change(self):
         """Return the last price change percentage"""
-        if len(self.price_history) >= 2:
-            current = self.price_history[0].price
-            previous = self.price_history[1].price
-            if previous > 0:
-                return ((current - previous) / previous) * 100
-        return 0
+        return self.last_change_pct or 0
+    
+    def record_price_change(self, new_price, changed_at=None):
+        """Move current_price to previous_price and store the change percentage"""
+        previous = self.current_price
+        self.previous_price = previous
+        self.current_price = new_price
+        self.last_changed_at = changed_at or datetime.utcnow()
+        if previous and previous > 0:
+            self.last_change_pct = ((new_price - previous) / previous) * 100
+        else:
+            self.last_change_pct = 0
     
     def __repr__(self):
         return f'<Product {self.name}>'
 
+class ProductNameToken(db.Model):
+    """Inverted index of normalized product name tokens, used to find match candidates"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    token = db.Column(db.String(50), primary_key=True)
+    
+    __table_args__ = (
+        db.Index('ix_product_name_token_token', 'token'),
+    )
+    
+    def __repr__(self):
+        return f'<ProductNameToken {self.product_id}: {self.token}>'
+
 class PriceHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     price = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Charts, exports and the dashboard read one product's history in time order
+    __table_args__ = (
+        db.Index('ix_price_history_product_id_timestamp', 'product_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<PriceHistory {self.product_id}: {self.price} at {self.timestamp}>'
 
+class PriceHistoryArchive(db.Model):
+    """PriceHistory rows moved out of the live table by history compaction"""
+    id = db.Column(db.Integer, primary_key=True)  # Same id as the original PriceHistory row
+    product_id = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_price_history_archive_product_id_timestamp', 'product_id', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<PriceHistoryArchive {self.product_id}: {self.price} at {self.timestamp}>'
+
+class PriceRollup(db.Model):
+    """Daily/weekly OHLC aggregate of a product's PriceHistory rows"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    resolution = db.Column(db.String(10), nullable=False)  # 'day', 'week'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    open_price = db.Column(db.Float, nullable=False)
+    high_price = db.Column(db.Float, nullable=False)  # Maximum in the bucket
+    low_price = db.Column(db.Float, nullable=False)  # Minimum in the bucket
+    close_price = db.Column(db.Float, nullable=False)
+    price_sum = db.Column(db.Float, nullable=False, default=0)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'resolution', 'bucket_start', name='uq_price_rollup_bucket'),
+    )
+    
+    @property
+    def mean_price(self):
+        """Return the average price of the bucket"""
+        return self.price_sum / self.sample_count if self.sample_count else self.close_price
+    
+    def __repr__(self):
+        return f'<PriceRollup {self.product_id} {self.resolution} {self.bucket_start}>'
+
 class PriceAlert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -84,8 +180,71 @@ class PriceAlert(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_price_alert_product_id_is_active', 'product_id', 'is_active'),
+    )
+    
     product = db.relationship('Product', backref=db.backref('alerts', lazy=True))
     user = db.relationship('User', backref=db.backref('alerts', lazy=True))
     
     def __repr__(self):
         return f'<PriceAlert {self.product_id} {self.alert_type} {self.target_price}>'
+
+class AppSetting(db.Model):
+    """Runtime setting shared by every process, e.g. the refresh interval"""
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AppSetting {self.key}={self.value}>'
+
+class SchedulerLock(db.Model):
+    """Lease held by the process that runs scheduled jobs (databases without advisory locks)"""
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<SchedulerLock {self.name} held by {self.owner} until {self.expires_at}>'
+
+class RefreshRun(db.Model):
+    """One refresh pass: a manual update of all URLs or a scheduled dispatch"""
+    id = db.Column(db.Integer, primary_key=True)
+    trigger = db.Column(db.String(20), nullable=False)  # 'manual', 'schedule'
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_seconds = db.Column(db.Float)
+    checked = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)  # Price written, including new products
+    unchanged = db.Column(db.Integer, default=0)  # Same page fingerprint, extraction skipped
+    failed = db.Column(db.Integer, default=0)
+    
+    def __repr__(self):
+        return f'<RefreshRun {self.id} {self.trigger} at {self.started_at}>'
+
+class RefreshAttempt(db.Model):
+    """Timings and outcome of one URL check within a RefreshRun"""
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('refresh_run.id'), nullable=False)
+    # Not a foreign key: the ledger keeps attempts of URLs deleted since
+    url_id = db.Column(db.Integer)
+    url = db.Column(db.String(500))
+    host = db.Column(db.String(255))
+    started_at = db.Column(db.DateTime, nullable=False)
+    fetch_ms = db.Column(db.Float)
+    parse_ms = db.Column(db.Float)
+    write_ms = db.Column(db.Float)
+    total_ms = db.Column(db.Float)
+    bytes = db.Column(db.Integer)
+    status = db.Column(db.Integer)  # HTTP status, None when no response arrived
+    outcome = db.Column(db.String(30))  # 'updated', 'created', 'unchanged', 'failed_<kind>', 'error'
+    
+    # Per-run listings and the slowest hosts/URLs over a recent window
+    __table_args__ = (
+        db.Index('ix_refresh_attempt_run_id', 'run_id'),
+        db.Index('ix_refresh_attempt_started_at_host', 'started_at', 'host'),
+    )
+    
+    def __repr__(self):
+        return f'<RefreshAttempt {self.url_id} in run {self.run_id}: {self.outcome}>'
@@ -0,0 +1,252 @@
+"""
+Persistent ledger of refresh runs.
+
+Every manual update (tasks.update_all_prices) records a RefreshRun, and
+every URL check in it a RefreshAttempt with its fetch, parse and write
+durations, bytes, HTTP status and outcome. Scheduled dispatches
+(refresh_queue.dispatch_due) run every minute, so they share one open
+'schedule' run per refresh interval (at most a day) instead of one each,
+which keeps runs comparable with each other.
+
+Attempts are buffered and inserted BATCH_SIZE rows at a time, or once the
+oldest has waited FLUSH_SECONDS, in one executemany that also updates the
+run's totals, so the ledger adds no round trip per URL, and a failing
+ledger write is logged without interrupting the refresh. The scheduler
+closes its run from the heartbeat thread when it loses leadership; a
+dispatch still checking URLs on another thread writes its remaining
+attempts straight to the closed run, so none are lost.
+
+The admin page /admin/refresh-runs reads the slowest hosts and URLs and the
+run-over-run and daily trends from it. Runs older than
+REFRESH_LEDGER_RETENTION_DAYS are pruned whenever a schedule run closes, and
+`flask prune-refresh-ledger` drops them on demand.
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from sqlalchemy import case, func, insert, update, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+# Longest time a recorded attempt waits in the buffer
+FLUSH_SECONDS = 300
+# Longest span of one shared schedule run
+MAX_SCHEDULE_RUN_MINUTES = 24 * 60
+DEFAULT_RETENTION_DAYS = 30
+ATTEMPT_FIELDS = ('started_at', 'fetch_ms', 'parse_ms', 'write_ms', 'total_ms', 'bytes', 'status', 'outcome')
+
+def url_host(url):
+    return urlparse(url).netloc.lower() or 'unknown'
+
+def is_failure(outcome):
+    return outcome is None or outcome == 'error' or outcome.startswith('failed_')
+
+class RefreshLedger:
+    """Records one RefreshRun and its attempts; use within an app context"""
+
+    def __init__(self, trigger, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        from models import db, RefreshRun
+
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.pending = []
+        self.outcomes = Counter()
+        self.started = time.perf_counter()
+        self.flushed = self.started
+        # The scheduler heartbeat may close a run while a dispatch still records into it
+        self.lock = threading.Lock()
+        self.closed = False
+        run = RefreshRun(trigger=trigger, started_at=datetime.utcnow())
+        db.session.add(run)
+        db.session.commit()
+        self.run_id = run.id
+
+    def age(self):
+        """Seconds since the run started"""
+        return time.perf_counter() - self.started
+
+    def record(self, url_id, url, attempt):
+        """Buffer the attempt dict filled by tasks.update_product_price"""
+        row = {field: attempt.get(field) for field in ATTEMPT_FIELDS}
+        row.update(run_id=self.run_id, url_id=url_id, url=url, host=url_host(url))
+        row['started_at'] = row['started_at'] or datetime.utcnow()
+        with self.lock:
+            self.pending.append(row)
+            self.outcomes[row['outcome']] += 1
+            # Attempts recorded after the run was closed are written at once
+            due = self.closed or len(self.pending) >= self.batch_size \
+                or time.perf_counter() - self.flushed >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def totals(self):
+        """Column values of the run's totals so far"""
+        return {
+            'duration_seconds': self.age(),
+            'checked': sum(self.outcomes.values()),
+            'updated': self.outcomes['updated'] + self.outcomes['created'],
+            'unchanged': self.outcomes['unchanged'],
+            'failed': sum(count for outcome, count in self.outcomes.items() if is_failure(outcome)),
+        }
+
+    def flush(self, **values):
+        """Insert the buffered attempts in one statement and store the totals, in one commit"""
+        from models import db, RefreshRun, RefreshAttempt
+
+        # Held through the write, so totals are never overwritten by older ones
+        with self.lock:
+            self.flushed = time.perf_counter()
+            if not self.pending and not values:
+                return
+            rows, self.pending = self.pending, []
+            try:
+                if rows:
+                    db.session.execute(insert(RefreshAttempt), rows)
+                db.session.execute(
+                    update(RefreshRun).where(RefreshRun.id == self.run_id).values(**self.totals(), **values)
+                )
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                logger.error(f"Could not record {len(rows)} refresh attempts of run {self.run_id}: {str(e)}")
+
+    def finish(self):
+        """Flush the remaining attempts and close the run"""
+        with self.lock:
+            self.closed = True
+        self.flush(finished_at=datetime.utcnow())
+
+def schedule_ledger(app, interval_minutes):
+    """
+    Return the app's open 'schedule' ledger for a dispatch. A run that has
+    lasted one refresh interval (at most a day) is closed and a new one is
+    started, pruning runs past the retention period. Call within an app
+    context.
+    """
+    ledger = app.extensions.get('schedule_ledger')
+    if ledger is not None and ledger.age() >= min(interval_minutes, MAX_SCHEDULE_RUN_MINUTES) * 60:
+        finish_schedule_ledger(app)
+        ledger = None
+        try:
+            runs, attempts = prune_ledger(app.config.get('REFRESH_LEDGER_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+            if runs:
+                logger.info(f"Pruned {runs} refresh runs and {attempts} attempts")
+        except SQLAlchemyError as e:
+            from models import db
+            db.session.rollback()
+            logger.error(f"Could not prune the refresh ledger: {str(e)}")
+    if ledger is None:
+        ledger = app.extensions['schedule_ledger'] = RefreshLedger('schedule')
+    return ledger
+
+def finish_schedule_ledger(app):
+    """Close the app's open 'schedule' run, if any; call within an app context"""
+    ledger = app.extensions.pop('schedule_ledger', None)
+    if ledger is not None:
+        ledger.finish()
+
+def failure_count():
+    """SQL expression counting failed attempts in a group"""
+    from models import RefreshAttempt
+
+    failed = or_(RefreshAttempt.outcome == 'error', RefreshAttempt.outcome.like('failed\\_%', escape='\\'))
+    return func.sum(case((failed, 1), else_=0))
+
+def slowest_hosts(days=7, limit=10):
+    """Return hosts by average check time over the last days"""
+    from models import db, RefreshAttempt
+
+    since = datetime.utcnow() - timedelta(days=days)
+    average = func.avg(RefreshAttempt.total_ms)
+    return db.session.query(
+        RefreshAttempt.host,
+        func.count(RefreshAttempt.id).label('checks'),
+        average.label('avg_ms'),
+        func.avg(RefreshAttempt.fetch_ms).label('avg_fetch_ms'),
+        func.max(RefreshAttempt.total_ms).label('max_ms'),
+        func.sum(RefreshAttempt.bytes).label('bytes'),
+        failure_count().label('failures'),
+    ).filter(RefreshAttempt.started_at >= since) \
+        .group_by(RefreshAttempt.host) \
+        .order_by(average.desc()) \
+        .limit(limit).all()
+
+def slowest_urls(days=7, limit=10):
+    """Return URLs by average check time over the last days"""
+    from models import db, RefreshAttempt
+
+    since = datetime.utcnow() - timedelta(days=days)
+    average = func.avg(RefreshAttempt.total_ms)
+    return db.session.query(
+        RefreshAttempt.url_id,
+        RefreshAttempt.url,
+        func.count(RefreshAttempt.id).label('checks'),
+        average.label('avg_ms'),
+        func.avg(RefreshAttempt.parse_ms).label('avg_parse_ms'),
+        func.max(RefreshAttempt.total_ms).label('max_ms'),
+        failure_count().label('failures'),
+    ).filter(RefreshAttempt.started_at >= since) \
+        .group_by(RefreshAttempt.url_id, RefreshAttempt.url) \
+        .order_by(average.desc()) \
+        .limit(limit).all()
+
+def daily_trend(days=14):
+    """Return per-day check counts, average timings and failures, oldest first"""
+    from models import db, RefreshAttempt
+
+    since = datetime.utcnow() - timedelta(days=days)
+    day = func.date(RefreshAttempt.started_at)
+    return db.session.query(
+        day.label('day'),
+        func.count(RefreshAttempt.id).label('checks'),
+        func.avg(RefreshAttempt.total_ms).label('avg_ms'),
+        func.avg(RefreshAttempt.fetch_ms).label('avg_fetch_ms'),
+        func.avg(RefreshAttempt.parse_ms).label('avg_parse_ms'),
+        func.avg(RefreshAttempt.write_ms).label('avg_write_ms'),
+        failure_count().label('failures'),
+    ).filter(RefreshAttempt.started_at >= since) \
+        .group_by(day) \
+        .order_by(day).all()
+
+def recent_runs(limit=20):
+    """
+    Return the latest runs as dicts with their average check time and its
+    change from the previous run of the same trigger, newest first.
+    """
+    from models import db, RefreshRun, RefreshAttempt
+
+    runs = RefreshRun.query.order_by(RefreshRun.started_at.desc(), RefreshRun.id.desc()).limit(limit).all()
+    averages = dict(db.session.query(RefreshAttempt.run_id, func.avg(RefreshAttempt.total_ms))
+                    .filter(RefreshAttempt.run_id.in_([run.id for run in runs]))
+                    .group_by(RefreshAttempt.run_id).all()) if runs else {}
+
+    results = []
+    for index, run in enumerate(runs):
+        avg_ms = averages.get(run.id)
+        previous = next((older for older in runs[index + 1:] if older.trigger == run.trigger), None)
+        previous_ms = averages.get(previous.id) if previous else None
+        results.append({
+            'run': run,
+            'avg_ms': avg_ms,
+            'change_pct': (avg_ms - previous_ms) * 100.0 / previous_ms if avg_ms and previous_ms else None,
+        })
+    return results
+
+def prune_ledger(days=DEFAULT_RETENTION_DAYS):
+    """Delete runs older than days with their attempts; returns (runs, attempts) deleted"""
+    from models import db, RefreshRun, RefreshAttempt
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    old_runs = db.session.query(RefreshRun.id).filter(RefreshRun.started_at < cutoff)
+    attempts = RefreshAttempt.query.filter(RefreshAttempt.run_id.in_(old_runs.scalar_subquery())) \
+        .delete(synchronize_session=False)
+    runs = RefreshRun.query.filter(RefreshRun.started_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return runs, attempts
@@ -0,0 +1,277 @@
+"""
+Due-time refresh queue.
+
+Every valid URL carries next_check_at, and the index on (is_valid,
+next_check_at) serves as the priority queue. Instead of refreshing every URL
+at once each interval, the scheduler leader dispatches every
+REFRESH_DISPATCH_SECONDS:
+- URLs without a due time (new rows, or after the interval shrank) get one
+  spread uniformly over the interval
+- at most the steady-rate budget of due URLs is released, earliest first:
+  enough to check every URL once per interval, plus slack to catch up
+- the released URLs are interleaved by store and paced across the dispatch
+  window with jittered start times, so no store sees a burst; time spent
+  fetching counts toward the pacing, so a dispatch ends within its window
+
+Dispatches record their checks in a shared 'schedule' run of the refresh
+ledger (see refresh_ledger.py).
+
+A checked URL is due again after the interval, with random jitter so URLs
+checked together drift apart instead of staying synchronized.
+
+Failed checks are classified (network, HTTP 4xx/5xx, parse) and counted per
+URL. A failing URL is retried sooner than the interval with exponential
+backoff; once the page is gone (404/410) or QUARANTINE_AFTER checks in a row
+failed, the URL is quarantined (is_valid = False) and rechecked on a backoff
+from one interval up to MAX_QUARANTINE_MINUTES, doubling with each failed
+recheck (URL.failed_rechecks), with its own small dispatch budget. A successful recheck brings it back.
+"""
+
+import math
+import time
+import random
+import logging
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+# Due times vary by up to this fraction of the interval either way
+JITTER_FRACTION = 0.1
+# Release up to this multiple of the steady rate, to work off a backlog
+CATCH_UP_FACTOR = 1.5
+# Never send requests faster than this, even with a large budget
+MIN_REQUEST_DELAY = 0.5
+DEFAULT_DISPATCH_SECONDS = 60
+SPREAD_BATCH_SIZE = 1000
+
+# Failure kinds stored in URL.failure_kind
+FAILURE_NETWORK = 'network'
+FAILURE_CLIENT = 'http_4xx'
+FAILURE_SERVER = 'http_5xx'
+FAILURE_PARSE = 'parse'
+# Responses that mean the product page is gone, quarantining the URL at once
+GONE_STATUSES = {404, 410}
+# Consecutive failures of any kind before a URL is quarantined
+QUARANTINE_AFTER = 3
+# First retry of a still-valid URL; doubles per failure, up to one interval
+RETRY_BASE_MINUTES = 15
+# Quarantined URLs are rechecked at least this often
+MAX_QUARANTINE_MINUTES = 30 * 24 * 60
+
+def next_check_time(interval_minutes, now=None, rng=random):
+    """Return when a URL checked at now is due again"""
+    now = now or datetime.utcnow()
+    jitter = rng.uniform(-JITTER_FRACTION, JITTER_FRACTION)
+    return now + timedelta(minutes=interval_minutes * (1 + jitter))
+
+def schedule_next_check(url, interval_minutes, now=None):
+    """Set url.next_check_at after a check; the caller commits"""
+    url.next_check_at = next_check_time(interval_minutes, now)
+
+def classify_failure(fetch):
+    """Return the failure kind of a check given its extractors.PageFetch"""
+    if fetch.content is not None:
+        return FAILURE_PARSE
+    if fetch.status is None:
+        return FAILURE_NETWORK
+    return FAILURE_SERVER if fetch.status >= 500 else FAILURE_CLIENT
+
+def retry_delay_minutes(failure_count, interval_minutes, quarantined, failed_rechecks=0):
+    """Return how long to wait before rechecking a URL after its latest failure"""
+    if quarantined:
+        # Backoff starts at one interval after the failure that quarantined the
+        # URL, whether that was a gone page or the QUARANTINE_AFTER-th failure,
+        # and doubles with every failed recheck since
+        return min(interval_minutes * 2 ** failed_rechecks, max(interval_minutes, MAX_QUARANTINE_MINUTES))
+    return min(RETRY_BASE_MINUTES * 2 ** (failure_count - 1), interval_minutes)
+
+def record_failure(url, fetch, interval_minutes, now=None, rng=random):
+    """
+    Count a failed check on url, quarantine it if the page is gone or it
+    keeps failing, and schedule the recheck. The caller commits.
+    Returns the failure kind.
+    """
+    now = now or datetime.utcnow()
+    kind = classify_failure(fetch)
+    url.failure_kind = kind
+    url.failure_count = (url.failure_count or 0) + 1
+    if fetch.error:
+        url.last_error = fetch.error[:255]
+    elif fetch.status and fetch.status != 200:
+        url.last_error = f"HTTP {fetch.status}"
+    else:
+        url.last_error = "No price found on the page"
+    url.last_checked = now
+
+    if url.is_valid is False:
+        url.failed_rechecks = (url.failed_rechecks or 0) + 1
+    elif fetch.status in GONE_STATUSES or url.failure_count >= QUARANTINE_AFTER:
+        logger.warning(f"Quarantining URL {url.id} after {url.failure_count} failed checks ({kind})")
+        url.is_valid = False
+        url.failed_rechecks = 0
+
+    delay = retry_delay_minutes(url.failure_count, interval_minutes, quarantined=not url.is_valid,
+                                failed_rechecks=url.failed_rechecks or 0)
+    jitter = rng.uniform(-JITTER_FRACTION, JITTER_FRACTION)
+    url.next_check_at = now + timedelta(minutes=delay * (1 + jitter))
+    return kind
+
+def record_success(url):
+    """Clear the failure state of url after a successful check; the caller commits"""
+    if url.is_valid is False:
+        logger.info(f"URL {url.id} recovered after {url.failure_count} failed checks")
+    url.is_valid = True
+    url.failure_kind = None
+    url.failure_count = 0
+    url.failed_rechecks = 0
+    url.last_error = None
+
+def refresh_interval(app):
+    """Return the refresh interval in minutes, from the database if set"""
+    from scheduler import get_schedule_interval
+
+    return get_schedule_interval(app.config.get('SCHEDULER_INTERVAL_MINUTES', 1440))
+
+def spread_unscheduled(interval_minutes, now=None, rng=random):
+    """
+    Give URLs without a due time one spread uniformly over the next
+    interval. Invalid URLs from before quarantine existed get one recheck
+    this way too. Returns the number of URLs scheduled.
+    """
+    from models import db, URL
+
+    now = now or datetime.utcnow()
+    scheduled = 0
+    while True:
+        ids = [row.id for row in db.session.query(URL.id)
+               .filter(URL.next_check_at.is_(None))
+               .limit(SPREAD_BATCH_SIZE)]
+        if not ids:
+            break
+        db.session.bulk_update_mappings(URL, [
+            {'id': url_id, 'next_check_at': now + timedelta(minutes=rng.uniform(0, interval_minutes))}
+            for url_id in ids
+        ])
+        db.session.commit()
+        scheduled += len(ids)
+    if scheduled:
+        logger.info(f"Spread {scheduled} unscheduled URLs over {interval_minutes} minutes")
+    return scheduled
+
+def reschedule_beyond(interval_minutes, now=None):
+    """
+    Clear due times further away than one interval, e.g. after the interval
+    was shortened, so spread_unscheduled() spreads them over the new one.
+    Returns the number of URLs cleared.
+    """
+    from models import db, URL
+
+    now = now or datetime.utcnow()
+    latest = now + timedelta(minutes=interval_minutes * (1 + JITTER_FRACTION))
+    cleared = URL.query.filter(URL.is_valid == True, URL.next_check_at > latest) \
+        .update({'next_check_at': None}, synchronize_session=False)
+    db.session.commit()
+    return cleared
+
+def dispatch_budget(total_urls, interval_minutes, dispatch_seconds):
+    """Return how many URLs one dispatch may release to keep a steady rate"""
+    if not total_urls:
+        return 0
+    per_dispatch = total_urls * dispatch_seconds / (interval_minutes * 60.0)
+    return max(1, math.ceil(per_dispatch * CATCH_UP_FACTOR))
+
+def claim_due_urls(limit, interval_minutes, now=None, valid=True):
+    """
+    Return [(id, url)] of up to limit due URLs, earliest first, and push
+    their due time forward so a crashed check is not retried immediately.
+    Pass valid=False to claim quarantined URLs instead.
+    """
+    from models import db, URL
+
+    now = now or datetime.utcnow()
+    if not limit:
+        return []
+    rows = db.session.query(URL.id, URL.url) \
+        .filter(URL.is_valid == valid, URL.next_check_at <= now) \
+        .order_by(URL.next_check_at) \
+        .limit(limit).all()
+    if rows:
+        db.session.bulk_update_mappings(URL, [
+            {'id': row.id, 'next_check_at': next_check_time(interval_minutes, now)} for row in rows
+        ])
+        db.session.commit()
+    return [(row.id, row.url) for row in rows]
+
+def interleave_hosts(rows):
+    """Order (id, url) rows round-robin by host, keeping due order per host"""
+    by_host = OrderedDict()
+    for url_id, url in rows:
+        by_host.setdefault(urlparse(url).netloc.lower(), deque()).append(url_id)
+    ordered = []
+    while by_host:
+        for host in list(by_host):
+            queue = by_host[host]
+            ordered.append(queue.popleft())
+            if not queue:
+                del by_host[host]
+    return ordered
+
+def dispatch_due(app, dispatch_seconds=DEFAULT_DISPATCH_SECONDS, interval_minutes=None, stats=None,
+                 sleep=time.sleep, rng=random, clock=time.monotonic):
+    """
+    Release one dispatch window's share of due URLs and check them, paced
+    across the window. Returns the number of URLs checked successfully.
+    """
+    from models import db, URL
+    from tasks import update_product_price
+    from refresh_ledger import schedule_ledger
+
+    if stats is None:
+        stats = Counter()
+    with app.app_context():
+        interval_minutes = interval_minutes or refresh_interval(app)
+        now = datetime.utcnow()
+        spread_unscheduled(interval_minutes, now, rng)
+
+        counts = dict(db.session.query(URL.is_valid, func.count(URL.id)).group_by(URL.is_valid).all())
+        total = counts.get(True, 0)
+        budget = dispatch_budget(total, interval_minutes, dispatch_seconds)
+        # Quarantined URLs get their own share, so they never take a live URL's slot
+        quarantine_budget = dispatch_budget(counts.get(False, 0), interval_minutes, dispatch_seconds)
+        rows = claim_due_urls(budget, interval_minutes, now) + \
+            claim_due_urls(quarantine_budget, interval_minutes, now, valid=False)
+        url_ids = interleave_hosts(rows)
+        if not url_ids:
+            return 0
+
+        urls = dict(rows)
+        slot = dispatch_seconds / len(url_ids)
+        updated = 0
+        started = clock()
+        last_request = None
+        # Dispatches share one run per interval; it flushes by size or age
+        ledger = schedule_ledger(app, interval_minutes)
+        for position, url_id in enumerate(url_ids):
+            if position:
+                # Each check starts in its own jittered slot of the window; the
+                # time earlier checks took is already spent, not added on top
+                target = started + (position + rng.uniform(-0.5, 0.5)) * slot
+                wait = max(target - clock(), last_request + MIN_REQUEST_DELAY - clock())
+                if wait > 0:
+                    sleep(wait)
+            last_request = clock()
+            stats['checked'] += 1
+            attempt = {}
+            try:
+                if update_product_price(url_id, stats=stats, interval_minutes=interval_minutes, attempt=attempt):
+                    updated += 1
+            finally:
+                ledger.record(url_id, urls[url_id], attempt)
+
+    logger.info(f"Checked {len(url_ids)} due URLs (budget {budget} of {total} valid) in {clock() - started:.1f}s, "
+                f"{updated} succeeded")
+    return updated
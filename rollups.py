@@ -0,0 +1,155 @@
+"""
+Daily and weekly OHLC rollups of PriceHistory.
+Rollups are updated incrementally as prices are written and can be rebuilt
+from scratch with `flask rebuild-rollups`. Charts of long ranges read the
+coarsest resolution that still has more buckets than the chart has points
+(see downsample.get_chart_data) instead of every raw row.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths, finest first
+RESOLUTIONS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+def bucket_start(timestamp, resolution):
+    """Return the start of the bucket containing timestamp"""
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if resolution == 'day':
+        return day
+    if resolution == 'week':
+        # Weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f"Unknown rollup resolution: {resolution}")
+
+def _merge_price(rollup, price, timestamp):
+    """Fold one observation into an existing rollup row"""
+    rollup.high_price = max(rollup.high_price, price)
+    rollup.low_price = min(rollup.low_price, price)
+    rollup.price_sum = (rollup.price_sum or 0) + price
+    rollup.sample_count = (rollup.sample_count or 0) + 1
+    if timestamp >= rollup.last_timestamp:
+        rollup.close_price = price
+        rollup.last_timestamp = timestamp
+    if timestamp < rollup.first_timestamp:
+        rollup.open_price = price
+        rollup.first_timestamp = timestamp
+
+def update_rollups(product_id, price, timestamp):
+    """
+    Fold a newly written price into every rollup resolution.
+    Changes are added to the current session; the caller commits them together
+    with the PriceHistory row.
+    """
+    from models import db, PriceRollup
+    
+    for resolution in RESOLUTIONS:
+        start = bucket_start(timestamp, resolution)
+        rollup = PriceRollup.query.filter_by(
+            product_id=product_id,
+            resolution=resolution,
+            bucket_start=start
+        ).first()
+        
+        if rollup:
+            _merge_price(rollup, price, timestamp)
+        else:
+            db.session.add(PriceRollup(
+                product_id=product_id,
+                resolution=resolution,
+                bucket_start=start,
+                open_price=price,
+                high_price=price,
+                low_price=price,
+                close_price=price,
+                price_sum=price,
+                sample_count=1,
+                first_timestamp=timestamp,
+                last_timestamp=timestamp
+            ))
+
+def rebuild_rollups(product_ids=None, batch_size=200):
+    """
+    Recompute rollups from PriceHistory, batch_size products at a time.
+    Must run inside an app context. Returns the number of rollup rows written.
+    """
+    from models import db, Product, PriceHistory, PriceRollup
+    
+    if product_ids is None:
+        product_ids = [row.id for row in db.session.query(Product.id).order_by(Product.id)]
+        
+    written = 0
+    for offset in range(0, len(product_ids), batch_size):
+        batch = product_ids[offset:offset + batch_size]
+        
+        history = db.session.query(
+            PriceHistory.product_id, PriceHistory.price, PriceHistory.timestamp
+        ).filter(
+            PriceHistory.product_id.in_(batch),
+            PriceHistory.timestamp.isnot(None)
+        ).order_by(PriceHistory.product_id, PriceHistory.timestamp).yield_per(1000)
+        
+        buckets = {}
+        for product_id, price, timestamp in history:
+            for resolution in RESOLUTIONS:
+                key = (product_id, resolution, bucket_start(timestamp, resolution))
+                row = buckets.get(key)
+                if row is None:
+                    buckets[key] = {
+                        'product_id': product_id,
+                        'resolution': resolution,
+                        'bucket_start': key[2],
+                        'open_price': price,
+                        'high_price': price,
+                        'low_price': price,
+                        'close_price': price,
+                        'price_sum': price,
+                        'sample_count': 1,
+                        'first_timestamp': timestamp,
+                        'last_timestamp': timestamp
+                    }
+                else:
+                    # Rows arrive in time order, so the latest is always the close
+                    row['high_price'] = max(row['high_price'], price)
+                    row['low_price'] = min(row['low_price'], price)
+                    row['close_price'] = price
+                    row['price_sum'] += price
+                    row['sample_count'] += 1
+                    row['last_timestamp'] = timestamp
+                    
+        PriceRollup.query.filter(PriceRollup.product_id.in_(batch)).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(PriceRollup, list(buckets.values()))
+        db.session.commit()
+        written += len(buckets)
+        logger.info(f"Rebuilt rollups for {min(offset + batch_size, len(product_ids))}/{len(product_ids)} products")
+        
+    return written
+
+def choose_resolution(start, end, points):
+    """
+    Return the coarsest rollup resolution that still has at least points
+    buckets between start and end, or 'raw' when none has.
+    """
+    span = end - start
+    for resolution, width in reversed(RESOLUTIONS.items()):
+        if span / width >= points:
+            return resolution
+    return 'raw'
+
+def get_rollups(product_id, resolution, start=None, end=None):
+    """Return a product's rollup rows of one resolution between start and end, oldest first"""
+    from models import db, PriceRollup
+    
+    query = db.session.query(
+        PriceRollup.bucket_start, PriceRollup.low_price, PriceRollup.high_price, PriceRollup.close_price
+    ).filter(PriceRollup.product_id == product_id, PriceRollup.resolution == resolution)
+    if start:
+        query = query.filter(PriceRollup.bucket_start >= bucket_start(start, resolution))
+    if end:
+        query = query.filter(PriceRollup.bucket_start <= end)
+    return query.order_by(PriceRollup.bucket_start).all()
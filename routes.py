@@ -1,11 +1,10 @@
 import os
-import csv
-import io
 import json
 from datetime import datetime, timedelta
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask import abort, g, render_template, redirect, url_for, flash, request, jsonify, send_file, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-import pandas as pd
+from httpcache import conditional, user_listing_version, product_version
+from user_cache import current_user_is_admin
 
 # Import these within functions to avoid circular imports
 # from models import db, User, Product, PriceHistory, URL, PriceAlert
@@ -13,6 +12,10 @@ import pandas as pd
 # from extractors import get_product_info, detect_platform
 # from tasks import update_product_price
 
+def filter_args():
+    """Return the current request's listing filters, without the cursor"""
+    return {key: value for key, value in request.args.items() if key != 'cursor'}
+
 def register_routes(app):
     """Register all routes with the Flask app"""
     
@@ -82,63 +85,73 @@ def register_routes(app):
         logout_user()
         return redirect(url_for('index'))
     
+    def cached_dashboard_payload():
+        """Return the current user's dashboard payload, from cache when possible"""
+        from forms import ProductFilterForm
+        from listing import build_dashboard_payload
+        from cache import get_cache, dashboard_cache_key
+        
+        cache = get_cache(app)
+        # The database version catches refreshes made by the worker or scheduler processes
+        data_version = g.get('data_version') or user_listing_version()[0]
+        key = dashboard_cache_key(cache, current_user.id, request.args.to_dict(), data_version)
+        payload = cache.get(key)
+        if payload is None:
+            form = ProductFilterForm(request.args)
+            payload = build_dashboard_payload(
+                current_user.id, form,
+                cursor=request.args.get('cursor'),
+                page_size=request.args.get('per_page', type=int)
+            )
+            cache.set(key, payload)
+        return payload
+    
     @app.route('/dashboard')
     @login_required
+    @conditional(user_listing_version)
     def dashboard():
         """Main dashboard"""
-        from models import Product, PriceHistory
         from forms import ProductFilterForm
+        from listing import InvalidCursor
         
         form = ProductFilterForm(request.args)
         
-        # Get all products linked to the current user's URLs
-        query = Product.query.join(Product.urls).filter_by(user_id=current_user.id)
-        
-        # Apply filters
-        if form.platform.data and form.platform.data != 'all':
-            query = query.join(Product.urls).filter_by(platform=form.platform.data)
-            
-        if form.price_min.data is not None:
-            query = query.filter(Product.current_price >= form.price_min.data)
-            
-        if form.price_max.data is not None:
-            query = query.filter(Product.current_price <= form.price_max.data)
-            
-        # Apply sorting
-        if form.sort_by.data == 'name':
-            query = query.order_by(Product.name)
-        elif form.sort_by.data == 'price_asc':
-            query = query.order_by(Product.current_price)
-        elif form.sort_by.data == 'price_desc':
-            query = query.order_by(Product.current_price.desc())
-        elif form.sort_by.data == 'updated':
-            query = query.order_by(Product.updated_at.desc())
-        
-        products = query.all()
-        
-        # For price change sorting (requires post-query processing)
-        if form.sort_by.data == 'change_asc':
-            products.sort(key=lambda p: p.last_price_change or 0)
-        elif form.sort_by.data == 'change_desc':
-            products.sort(key=lambda p: p.last_price_change or 0, reverse=True)
-            
-        # Get price history data for charts
-        price_history_data = {}
-        for product in products:
-            history = PriceHistory.query.filter_by(product_id=product.id).order_by(PriceHistory.timestamp).all()
-            if history:
-                price_history_data[product.id] = {
-                    'dates': [h.timestamp.strftime('%Y-%m-%d') for h in history],
-                    'prices': [h.price for h in history]
-                }
+        # One keyset page of the current user's products with chart history
+        try:
+            payload = cached_dashboard_payload()
+        except InvalidCursor:
+            return redirect(url_for('dashboard', **filter_args()))
+            
+        next_cursor = payload['next_cursor']
+        next_url = url_for('dashboard', cursor=next_cursor, **filter_args()) if next_cursor else None
+        first_url = url_for('dashboard', **filter_args()) if request.args.get('cursor') else None
         
         return render_template(
             'dashboard.html', 
-            products=products, 
-            price_history=json.dumps(price_history_data),
-            form=form
+            products=payload['items'], 
+            price_history=json.dumps(payload['price_history']),
+            form=form,
+            next_url=next_url,
+            first_url=first_url
         )
     
+    @app.route('/api/products')
+    @login_required
+    @conditional(user_listing_version)
+    def api_products():
+        """JSON variant of the dashboard listing"""
+        from listing import InvalidCursor
+        
+        try:
+            payload = cached_dashboard_payload()
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+            
+        return jsonify({
+            'items': payload['items'],
+            'next_cursor': payload['next_cursor']
+        })
+    
     @app.route('/add-url', methods=['GET', 'POST'])
     @login_required
     def add_url():
@@ -147,6 +160,7 @@ def register_routes(app):
         from models import db, URL
         from extractors import detect_platform
         from tasks import update_product_price
+        from cache import invalidate_user_dashboards
         
         form = URLForm()
         if form.validate_on_submit():
@@ -170,6 +184,7 @@ def register_routes(app):
             )
             db.session.add(new_url)
             db.session.commit()
+            invalidate_user_dashboards(app, [current_user.id])
             
             # Now update the product info right away
             success = update_product_price(new_url.id)
@@ -185,15 +200,55 @@ def register_routes(app):
     
     @app.route('/urls', methods=['GET'])
     @login_required
+    @conditional(user_listing_version)
     def urls():
         """Manage URLs"""
         from models import URL
         from forms import URLBatchForm
+        from listing import url_listing_page, InvalidCursor
         
-        urls = URL.query.filter_by(user_id=current_user.id).all()
+        try:
+            urls, next_cursor = url_listing_page(
+                current_user.id,
+                cursor=request.args.get('cursor'),
+                page_size=request.args.get('per_page', type=int)
+            )
+        except InvalidCursor:
+            return redirect(url_for('urls'))
+            
+        total_urls = URL.query.filter_by(user_id=current_user.id).count()
         form = URLBatchForm()
         
-        return render_template('urls.html', urls=urls, form=form, title='Manage URLs')
+        return render_template(
+            'urls.html',
+            urls=urls,
+            total_urls=total_urls,
+            form=form,
+            title='Manage URLs',
+            next_url=url_for('urls', cursor=next_cursor) if next_cursor else None,
+            first_url=url_for('urls') if request.args.get('cursor') else None
+        )
+    
+    @app.route('/api/urls')
+    @login_required
+    @conditional(user_listing_version)
+    def api_urls():
+        """JSON variant of the URL management listing"""
+        from listing import url_listing_page, url_to_dict, InvalidCursor
+        
+        try:
+            urls, next_cursor = url_listing_page(
+                current_user.id,
+                cursor=request.args.get('cursor'),
+                page_size=request.args.get('per_page', type=int)
+            )
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+            
+        return jsonify({
+            'items': [url_to_dict(url) for url in urls],
+            'next_cursor': next_cursor
+        })
     
     @app.route('/batch-urls', methods=['POST'])
     @login_required
@@ -203,6 +258,7 @@ def register_routes(app):
         from models import db, URL
         from extractors import detect_platform
         from tasks import update_product_price
+        from cache import invalidate_user_dashboards
         
         form = URLBatchForm()
         if form.validate_on_submit():
@@ -236,6 +292,7 @@ def register_routes(app):
                 added += 1
                 
             db.session.commit()
+            invalidate_user_dashboards(app, [current_user.id])
             
             # Update prices synchronously for new URLs
             new_urls = URL.query.filter_by(user_id=current_user.id, last_checked=None).all()
@@ -254,16 +311,19 @@ def register_routes(app):
     def delete_url(url_id):
         """Delete a URL"""
         from models import db, URL
+        from cache import invalidate_user_dashboards
         
         url = URL.query.get_or_404(url_id)
         
         # Check if URL belongs to current user
-        if url.user_id != current_user.id and not current_user.is_admin:
+        if url.user_id != current_user.id and not current_user_is_admin():
             flash('You do not have permission to delete this URL', 'danger')
             return redirect(url_for('urls'))
             
+        owner_id = url.user_id
         db.session.delete(url)
         db.session.commit()
+        invalidate_user_dashboards(app, [owner_id])
         
         flash('URL deleted successfully', 'success')
         return redirect(url_for('urls'))
@@ -281,10 +341,12 @@ def register_routes(app):
     
     @app.route('/product/<int:product_id>')
     @login_required
+    @conditional(product_version)
     def product_detail(product_id):
         """Product detail page"""
         from models import Product, PriceHistory
         from forms import PriceAlertForm
+        from matching import cheapest_across_stores
         
         product = Product.query.get_or_404(product_id)
         
@@ -293,82 +355,211 @@ def register_routes(app):
             flash('You do not have permission to view this product', 'danger')
             return redirect(url_for('dashboard'))
             
-        # Get price history
-        history = PriceHistory.query.filter_by(product_id=product.id).order_by(PriceHistory.timestamp).all()
+        # Only the latest changes are listed; one extra row gives the last change its base
+        history_rows = 50
+        recent_history = PriceHistory.query.filter_by(product_id=product.id) \
+            .order_by(PriceHistory.timestamp.desc()).limit(history_rows + 1).all()
         
-        # Prepare data for price history chart
-        chart_data = {
-            'dates': [h.timestamp.strftime('%Y-%m-%d') for h in history],
-            'prices': [h.price for h in history]
-        }
+        # Same item in other stores, cheapest first
+        offers = [offer for offer in cheapest_across_stores(product, current_user.id) if offer.id != product.id]
         
         # Alert form
         alert_form = PriceAlertForm()
         
+        # The chart is loaded asynchronously from api_product_chart
         return render_template(
             'product_detail.html',
             product=product,
-            chart_data=json.dumps(chart_data),
+            recent_history=recent_history,
+            history_rows=history_rows,
+            offers=offers,
             alert_form=alert_form
         )
     
-    @app.route('/export-data', methods=['GET'])
+    @app.route('/api/products/<int:product_id>/chart')
     @login_required
-    def export_data():
-        """Export product data as CSV"""
-        from models import Product, PriceHistory
+    @conditional(product_version)
+    def api_product_chart(product_id):
+        """Downsampled price history for the product detail chart"""
+        from models import Product
+        from downsample import get_chart_data, DEFAULT_POINTS, MAX_POINTS, METHODS
+        
+        product = Product.query.get_or_404(product_id)
         
-        # Get all products linked to the current user's URLs
-        products = Product.query.join(Product.urls).filter_by(user_id=current_user.id).all()
-        
-        # Create DataFrame for export
-        data = []
-        for product in products:
-            # Get the URL(s) for this product
-            urls = [url.url for url in product.urls if url.user_id == current_user.id]
-            url_str = ', '.join(urls)
-            
-            # Get the platform(s) for this product
-            platforms = [url.platform for url in product.urls if url.user_id == current_user.id]
-            platform_str = ', '.join(platforms)
-            
-            # Get the last price change
-            last_change = product.last_price_change
-            
-            # Get the price history
-            history = PriceHistory.query.filter_by(product_id=product.id).order_by(PriceHistory.timestamp).all()
-            price_history = ', '.join([f"{h.price} ({h.timestamp.strftime('%Y-%m-%d')})" for h in history])
-            
-            data.append({
-                'Product Name': product.name,
-                'Current Price': product.current_price,
-                'Currency': product.currency,
-                'Last Change %': last_change,
-                'Platform': platform_str,
-                'URLs': url_str,
-                'Price History': price_history
-            })
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        if data:
-            df = pd.DataFrame(data)
-            df.to_csv(output, index=False)
-        else:
-            output.write('No data available')
+        if not any(url.user_id == current_user.id for url in product.urls):
+            return jsonify({'error': 'You do not have permission to view this product'}), 403
             
-        output.seek(0)
+        try:
+            start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        except ValueError:
+            return jsonify({'error': 'start and end must be ISO dates'}), 400
+            
+        points = max(3, min(request.args.get('points', DEFAULT_POINTS, type=int), MAX_POINTS))
+        method = request.args.get('method', 'lttb')
+        if method not in METHODS:
+            return jsonify({'error': f"method must be one of {', '.join(METHODS)}"}), 400
+            
+        return jsonify(get_chart_data(product.id, start, end, points, method))
+    
+    @app.route('/api/products/<int:product_id>/offers')
+    @login_required
+    @conditional(product_version)
+    def api_product_offers(product_id):
+        """The same item across stores, cheapest first"""
+        from models import Product
+        from matching import cheapest_across_stores, offer_to_dict
+        
+        product = Product.query.get_or_404(product_id)
+        
+        if not any(url.user_id == current_user.id for url in product.urls):
+            return jsonify({'error': 'You do not have permission to view this product'}), 403
+            
+        limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+        return jsonify({
+            'product_id': product.id,
+            'match_key': product.match_key,
+            'offers': [offer_to_dict(offer, current_user.id)
+                       for offer in cheapest_across_stores(product, current_user.id, limit)]
+        })
+    
+    @app.route('/api/search')
+    @login_required
+    @conditional(user_listing_version)
+    def api_search():
+        """Ranked full-text search over the user's products"""
+        from listing import product_to_dict
+        from search import search_products, clamp_page
+        
+        q = request.args.get('q', '').strip()
+        if not q:
+            return jsonify({'error': 'q is required'}), 400
+            
+        page, per_page = clamp_page(request.args.get('page', type=int), request.args.get('per_page', type=int))
+        results, total = search_products(current_user.id, q, page, per_page)
+        
+        items = []
+        for product, score in results:
+            item = product_to_dict(product)
+            # Engines rank ascending; report higher-is-better relevance
+            item['score'] = round(0.0 - score, 4)
+            items.append(item)
+            
+        return jsonify({
+            'items': items,
+            'total': total,
+            'page': page,
+            'next_page': page + 1 if page * per_page < total else None
+        })
+    
+    @app.route('/api/analytics')
+    @login_required
+    def api_analytics():
+        """Price statistics for every product the user tracks"""
+        from analytics import get_user_statistics
+        
+        days = request.args.get('days', 30, type=int)
+        start = datetime.utcnow() - timedelta(days=days) if days > 0 else None
+        
+        return jsonify({
+            'days': days,
+            'products': get_user_statistics(current_user.id, start=start)
+        })
+
+    @app.route('/api/user-cache/stats')
+    @login_required
+    def api_user_cache_stats():
+        """User loader cache counters of this worker (admins only)"""
+        from user_cache import get_user_cache
+
+        if not current_user_is_admin():
+            return jsonify({'error': 'Forbidden'}), 403
+
+        return jsonify(get_user_cache(app).snapshot_stats())
+
+    @app.route('/admin/refresh-runs')
+    @login_required
+    def refresh_runs():
+        """Refresh ledger: slowest hosts and URLs, recent runs and daily trend (admins only)"""
+        from refresh_ledger import recent_runs, slowest_hosts, slowest_urls, daily_trend
+
+        if not current_user_is_admin():
+            abort(403)
+
+        days = min(max(request.args.get('days', 7, type=int), 1), 90)
+        return render_template('refresh_runs.html',
+                               days=days,
+                               runs=recent_runs(),
+                               hosts=slowest_hosts(days),
+                               slow_urls=slowest_urls(days),
+                               trend=daily_trend(max(days, 14)))
+
+    @app.route('/export-data', methods=['GET'])
+    @login_required
+    def export_data():
+        """Export product data as CSV, streamed row by row"""
+        from exports import generate_products_csv
         
         # Generate filename with timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'price_data_export_{timestamp}.csv'
         
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
+        return Response(
+            stream_with_context(generate_products_csv(current_user.id)),
             mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    @app.route('/api/export/history')
+    @login_required
+    def api_export_history():
+        """
+        Export the user's price history as JSONL (streamed) or Parquet.
+        start/end filter by timestamp; since returns only rows with a larger
+        id. The X-Next-Since header holds the cursor for the next sync.
+        """
+        import tempfile
+        from exports import generate_history_jsonl, write_history_parquet, history_export_bound, parquet_available
+        
+        export_format = request.args.get('format', 'jsonl')
+        if export_format not in ('jsonl', 'parquet'):
+            return jsonify({'error': 'format must be jsonl or parquet'}), 400
+        if export_format == 'parquet' and not parquet_available():
+            return jsonify({'error': 'Parquet export is not available on this server, use format=jsonl'}), 501
+            
+        try:
+            start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+            since = int(request.args['since']) if request.args.get('since') else None
+        except ValueError:
+            return jsonify({'error': 'start and end must be ISO dates and since an integer'}), 400
+            
+        until = history_export_bound(since)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        headers = {'X-Next-Since': str(until)}
+        
+        if export_format == 'jsonl':
+            headers['Content-Disposition'] = f'attachment; filename=price_history_{timestamp}.jsonl'
+            return Response(
+                stream_with_context(generate_history_jsonl(current_user.id, start, end, since, until)),
+                mimetype='application/x-ndjson',
+                headers=headers
+            )
+            
+        # Parquet needs a seekable file; row groups are written to disk, not memory
+        output = tempfile.TemporaryFile()
+        rows = write_history_parquet(output, current_user.id, start, end, since, until)
+        output.seek(0)
+        app.logger.info(f"Exported {rows} history rows as Parquet for user {current_user.id}")
+        
+        response = send_file(
+            output,
+            mimetype='application/vnd.apache.parquet',
             as_attachment=True,
-            download_name=filename
+            download_name=f'price_history_{timestamp}.parquet'
         )
+        response.headers.update(headers)
+        return response
     
     @app.route('/set-alert/<int:product_id>', methods=['POST'])
     @login_required
@@ -428,38 +619,52 @@ def register_routes(app):
     @login_required
     def validate_url():
         """API endpoint to validate a URL"""
-        from extractors import detect_platform, get_product_info
-        
-        data = request.get_json()
-        url = data.get('url')
+        from cache import get_cache, validate_url_cache_key, VALIDATE_URL_TTL
         
+        # POST with a JSON body only, so other sites cannot make us fetch pages
+        url = (request.get_json(silent=True) or {}).get('url')
         if not url:
             return jsonify({'valid': False, 'message': 'No URL provided'})
+        
+        # Fetching a store page is slow; reuse a recent successful validation
+        cache = get_cache(app)
+        key = validate_url_cache_key(url)
+        result = cache.get(key)
+        if result is None:
+            result = validate_product_url(url)
+            if result['valid']:
+                cache.set(key, result, ttl=VALIDATE_URL_TTL)
+        return jsonify(result)
+    
+    def validate_product_url(url):
+        """Check that url is supported and its product can be extracted"""
+        from extractors import detect_platform, get_product_info
             
         # Check platform
         platform = detect_platform(url)
         if not platform:
-            return jsonify({'valid': False, 'message': 'Unsupported platform'})
+            return {'valid': False, 'message': 'Unsupported platform'}
             
         # Try to get product info
         product_data = get_product_info(url)
         
         if not product_data or 'price' not in product_data or product_data['price'] is None:
-            return jsonify({'valid': False, 'message': 'Could not extract product information'})
+            return {'valid': False, 'message': 'Could not extract product information'}
             
-        return jsonify({
+        return {
             'valid': True,
             'platform': platform,
             'name': product_data.get('name', 'Unknown Product'),
             'price': product_data['price'],
             'currency': product_data.get('currency', 'SAR')
-        })
+        }
     
     @app.route('/update-schedule', methods=['POST'])
     @login_required
     def update_schedule():
         """Update the price check schedule"""
         from forms import ScheduleForm
+        from scheduler import set_schedule_interval, HEARTBEAT_JOB_ID
         
         form = ScheduleForm()
         if form.validate_on_submit():
@@ -469,25 +674,13 @@ def register_routes(app):
             if interval == 'custom' and form.custom_interval.data:
                 interval = str(form.custom_interval.data)
                 
-            # Update in .env file
-            with open('.env', 'r') as file:
-                env_lines = file.readlines()
-                
-            with open('.env', 'w') as file:
-                for line in env_lines:
-                    if line.startswith('SCHEDULER_INTERVAL_MINUTES='):
-                        file.write(f'SCHEDULER_INTERVAL_MINUTES={interval}\n')
-                    else:
-                        file.write(line)
-            
-            # Update scheduler dynamically
-            app.apscheduler.remove_all_jobs()
-            app.apscheduler.add_job(
-                'tasks:update_all_prices',
-                'interval',
-                minutes=int(interval),
-                args=[app]
-            )
+            # Stored in the database; the scheduler leader applies it on its next heartbeat
+            set_schedule_interval(int(interval))
+            
+            # Nudge this process's scheduler so a local leader applies it right away
+            leader = app.extensions.get('leader_scheduler')
+            if leader is not None and leader.scheduler.running:
+                leader.scheduler.modify_job(HEARTBEAT_JOB_ID, next_run_time=datetime.now())
             
             flash('Schedule updated successfully', 'success')
             
@@ -504,9 +697,18 @@ def register_routes(app):
             return jsonify({'error': 'Unauthorized'}), 401
         
         try:
+            from collections import Counter
             from tasks import update_all_prices
-            result = update_all_prices(app)
-            return jsonify({'status': 'success', 'updated': result}), 200
+            stats = Counter()
+            result = update_all_prices(app, stats=stats)
+            skip_ratio = stats['unchanged'] / stats['checked'] if stats['checked'] else 0.0
+            return jsonify({
+                'status': 'success',
+                'updated': result,
+                'checked': stats['checked'],
+                'unchanged': stats['unchanged'],
+                'skip_ratio': round(skip_ratio, 4)
+            }), 200
         except Exception as e:
             app.logger.error(f"Error in API price update: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -0,0 +1,263 @@
+"""
+Leader-elected price refresh scheduler.
+
+Every process that runs the scheduler (gunicorn workers in development,
+worker.py in production) starts an APScheduler with one heartbeat job. On
+each heartbeat the process tries to take or keep a database-backed leader
+lock, and only the leader schedules the price refresh job:
+- PostgreSQL: a session-level advisory lock held on a dedicated connection
+- other databases (SQLite): a lease row in scheduler_lock that the leader
+  renews on every heartbeat and others take over once it expires
+
+The leader's refresh job releases the URLs that are due from the refresh
+queue (see refresh_queue.py) every REFRESH_DISPATCH_SECONDS, so the checks
+are spread over the whole interval instead of all starting at once.
+
+The refresh interval is an AppSetting row rather than an environment
+variable, so a change made through any process is picked up by the leader
+on its next heartbeat.
+"""
+
+import os
+import atexit
+import socket
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, update, delete, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = 'price_refresh'
+PRICE_JOB_ID = 'price_update_job'
+HEARTBEAT_JOB_ID = 'leader_heartbeat'
+INTERVAL_SETTING = 'scheduler_interval_minutes'
+DEFAULT_HEARTBEAT_SECONDS = 30
+# How often the leader releases due URLs from the refresh queue
+DEFAULT_DISPATCH_SECONDS = 60
+# A lease outlives two missed heartbeats before another process takes over
+LEASE_HEARTBEATS = 3
+
+def process_identity():
+    """Return a name unique to this process, for lock ownership and logs"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def get_schedule_interval(default):
+    """Return the refresh interval in minutes, from the database if set"""
+    from models import db, AppSetting
+
+    setting = db.session.get(AppSetting, INTERVAL_SETTING)
+    try:
+        return int(setting.value) if setting else int(default)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {INTERVAL_SETTING} setting {setting.value!r}")
+        return int(default)
+
+def set_schedule_interval(minutes):
+    """Store the refresh interval for the leader to pick up"""
+    from models import db, AppSetting
+
+    setting = db.session.get(AppSetting, INTERVAL_SETTING)
+    if setting is None:
+        setting = AppSetting(key=INTERVAL_SETTING, value=str(minutes))
+        db.session.add(setting)
+    else:
+        setting.value = str(minutes)
+    db.session.commit()
+
+class AdvisoryLock:
+    """PostgreSQL session-level advisory lock on its own connection"""
+
+    def __init__(self, engine, name):
+        self.engine = engine
+        # pg advisory locks take a signed 64-bit key
+        self.key = int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:15], 16)
+        self.connection = None
+
+    def acquire(self):
+        """Take or keep the lock; returns True while this process holds it"""
+        if self.connection is not None:
+            try:
+                self.connection.execute(text("SELECT 1"))
+                self.connection.commit()
+                return True
+            except SQLAlchemyError as e:
+                # The lock went away with the connection
+                logger.warning(f"Lost the leader lock connection: {str(e)}")
+                self._close()
+
+        connection = self.engine.connect()
+        try:
+            held = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': self.key}).scalar()
+            connection.commit()
+        except SQLAlchemyError:
+            connection.close()
+            raise
+        if held:
+            self.connection = connection
+        else:
+            connection.close()
+        return bool(held)
+
+    def release(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': self.key})
+            self.connection.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not release the leader lock: {str(e)}")
+        self._close()
+
+    def _close(self):
+        try:
+            self.connection.close()
+        except SQLAlchemyError:
+            pass
+        self.connection = None
+
+class LeaseLock:
+    """Expiring lock row, renewed by the holder on every heartbeat"""
+
+    def __init__(self, name, owner, ttl):
+        self.name = name
+        self.owner = owner
+        self.ttl = timedelta(seconds=ttl)
+
+    def acquire(self):
+        """Take or renew the lease; returns True while this process holds it"""
+        from models import db, SchedulerLock
+
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(SchedulerLock)
+            .where(SchedulerLock.name == self.name,
+                   or_(SchedulerLock.owner == self.owner, SchedulerLock.expires_at < now))
+            .values(owner=self.owner, expires_at=now + self.ttl)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            db.session.commit()
+            return True
+
+        try:
+            db.session.add(SchedulerLock(name=self.name, owner=self.owner, expires_at=now + self.ttl))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # Another process holds an unexpired lease
+            db.session.rollback()
+            return False
+
+    def release(self):
+        from models import db, SchedulerLock
+
+        db.session.execute(
+            delete(SchedulerLock)
+            .where(SchedulerLock.name == self.name, SchedulerLock.owner == self.owner)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+def leader_lock(engine, owner, heartbeat_seconds):
+    """Return the leader lock suited to the database"""
+    if engine.dialect.name == 'postgresql':
+        return AdvisoryLock(engine, LOCK_NAME)
+    return LeaseLock(LOCK_NAME, owner, heartbeat_seconds * LEASE_HEARTBEATS)
+
+class LeaderScheduler:
+    """APScheduler wrapper that schedules refresh work only while leader"""
+
+    def __init__(self, app, scheduler, lock, owner, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+                 dispatch_seconds=DEFAULT_DISPATCH_SECONDS):
+        self.app = app
+        self.scheduler = scheduler
+        self.lock = lock
+        self.owner = owner
+        self.heartbeat_seconds = heartbeat_seconds
+        self.dispatch_seconds = dispatch_seconds
+        self.is_leader = False
+        self.interval = None
+
+    def start(self):
+        self.scheduler.add_job(self.tick, 'interval', seconds=self.heartbeat_seconds, id=HEARTBEAT_JOB_ID,
+                               next_run_time=datetime.now(), max_instances=1, coalesce=True)
+        self.scheduler.start()
+        atexit.register(self.shutdown)
+
+    def tick(self):
+        """Take or keep leadership, then make the schedule match it"""
+        from refresh_ledger import finish_schedule_ledger
+
+        with self.app.app_context():
+            try:
+                leader = self.lock.acquire()
+            except SQLAlchemyError as e:
+                logger.error(f"Leader lock check failed: {str(e)}")
+                leader = False
+
+            if leader != self.is_leader:
+                logger.info(f"{self.owner} {'became' if leader else 'is no longer'} the scheduler leader")
+                self.is_leader = leader
+
+            if not leader:
+                if self.scheduler.get_job(PRICE_JOB_ID):
+                    self.scheduler.remove_job(PRICE_JOB_ID)
+                self.interval = None
+                # The next leader starts its own run
+                finish_schedule_ledger(self.app)
+                return
+
+            interval = get_schedule_interval(self.app.config['SCHEDULER_INTERVAL_MINUTES'])
+            if self.interval is not None and interval < self.interval:
+                # Due times set for the old, longer interval are respread
+                from refresh_queue import reschedule_beyond
+                reschedule_beyond(interval)
+            if interval != self.interval:
+                logger.info(f"Each URL is refreshed every {interval} minutes")
+                self.interval = interval
+            if not self.scheduler.get_job(PRICE_JOB_ID):
+                self.scheduler.add_job(self.run_price_update, 'interval', seconds=self.dispatch_seconds,
+                                       id=PRICE_JOB_ID, max_instances=1, coalesce=True)
+
+    def run_price_update(self):
+        """Check the URLs that are due, unless leadership was lost since the last heartbeat"""
+        from refresh_queue import dispatch_due
+
+        if not self.is_leader or self.interval is None:
+            return
+        dispatch_due(self.app, self.dispatch_seconds, self.interval)
+
+    def shutdown(self):
+        from refresh_ledger import finish_schedule_ledger
+
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        if self.is_leader:
+            with self.app.app_context():
+                finish_schedule_ledger(self.app)
+                try:
+                    self.lock.release()
+                except SQLAlchemyError as e:
+                    logger.warning(f"Could not release the leader lock: {str(e)}")
+            self.is_leader = False
+
+def start_scheduler(app):
+    """Start this process's leader-elected scheduler; returns the LeaderScheduler"""
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from models import db
+
+    heartbeat = int(app.config.get('SCHEDULER_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS))
+    dispatch = int(app.config.get('REFRESH_DISPATCH_SECONDS', DEFAULT_DISPATCH_SECONDS))
+    owner = process_identity()
+    with app.app_context():
+        lock = leader_lock(db.engine, owner, heartbeat)
+
+    leader = LeaderScheduler(app, BackgroundScheduler(), lock, owner, heartbeat, dispatch)
+    leader.start()
+    app.apscheduler = leader.scheduler
+    app.extensions['leader_scheduler'] = leader
+    return leader
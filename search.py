@@ -0,0 +1,252 @@
+"""
+Full-text product search.
+
+Product name, brand and description are indexed in a separate search table:
+- SQLite: an FTS5 virtual table ranked with bm25()
+- PostgreSQL: a weighted tsvector column with a GIN index, ranked with
+  ts_rank_cd()
+
+Text is normalized with the same Arabic-aware rules as product matching
+(hamza/taa marbuta/alef maqsura forms, diacritics, definite article, digits)
+before it reaches either engine, so both index the same terms. The index is
+kept in sync by mapper events on Product, inside the transaction that
+writes the product. Without a search table (e.g. SQLite built without FTS5)
+search falls back to LIKE over Product.normalized_name, which the same
+events fill on every write and upgrade_schema backfills for older rows.
+"""
+
+import logging
+
+from sqlalchemy import event, inspect, text, select, literal, and_, Integer, Float
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'product_search'
+# bm25 weights of the name, description and brand columns
+FTS5_WEIGHTS = '10.0, 1.0, 5.0'
+MAX_DESCRIPTION_TERMS = 1000
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# Whether each engine (by URL) has a search table; filled on first use
+_search_tables = {}
+
+def search_terms(value, limit=None):
+    """Return the normalized search terms of a text"""
+    from matching import normalize_name, name_terms
+
+    terms = name_terms(normalize_name(value))
+    return terms[:limit] if limit else terms
+
+def has_search_table(bind):
+    """Return True if the search table exists for the engine or connection"""
+    engine = getattr(bind, 'engine', bind)
+    key = engine.url.render_as_string()
+    if key not in _search_tables:
+        _search_tables[key] = inspect(bind).has_table(SEARCH_TABLE)
+    return _search_tables[key]
+
+def create_search_index(engine):
+    """Create the search table and its index if missing; returns True if created"""
+    if has_search_table(engine):
+        return False
+
+    if engine.dialect.name == 'sqlite':
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(name, description, brand, "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                ))
+        except OperationalError as e:
+            logger.warning(f"FTS5 is not available, product search will use LIKE: {str(e)}")
+            return False
+    elif engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE TABLE {SEARCH_TABLE} ("
+                f"product_id INTEGER PRIMARY KEY REFERENCES product (id) ON DELETE CASCADE, "
+                f"document TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text(f"CREATE INDEX ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"))
+    else:
+        return False
+
+    _search_tables[engine.url.render_as_string()] = True
+    logger.info(f"Created search table {SEARCH_TABLE}")
+    return True
+
+def index_product_text(connection, product_id, name, description, brand):
+    """Insert or replace one product's search document"""
+    params = {
+        'product_id': product_id,
+        'name': ' '.join(search_terms(name)),
+        'description': ' '.join(search_terms(description, MAX_DESCRIPTION_TERMS)),
+        'brand': ' '.join(search_terms(brand)),
+    }
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (:product_id, "
+            f"setweight(to_tsvector('simple', :name), 'A') || "
+            f"setweight(to_tsvector('simple', :brand), 'B') || "
+            f"setweight(to_tsvector('simple', :description), 'C')) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document"
+        ), params)
+    else:
+        connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :product_id"), params)
+        connection.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, brand) "
+            f"VALUES (:product_id, :name, :description, :brand)"
+        ), params)
+
+def remove_product_text(connection, product_id):
+    """Delete one product's search document"""
+    column = 'product_id' if connection.dialect.name == 'postgresql' else 'rowid'
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE {column} = :product_id"), {'product_id': product_id})
+
+def _before_write(mapper, connection, target):
+    from matching import normalize_name
+
+    if target.normalized_name is None or inspect(target).attrs.name.history.has_changes():
+        target.normalized_name = normalize_name(target.name)[:200]
+
+def _after_insert(mapper, connection, target):
+    if has_search_table(connection):
+        index_product_text(connection, target.id, target.name, target.description, target.brand)
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('name', 'description', 'brand')):
+        if has_search_table(connection):
+            index_product_text(connection, target.id, target.name, target.description, target.brand)
+
+def _after_delete(mapper, connection, target):
+    if has_search_table(connection):
+        remove_product_text(connection, target.id)
+
+def register_search(app):
+    """Keep the search index and normalized names in sync with Product writes"""
+    from models import Product
+
+    for name, listener in (('before_insert', _before_write), ('before_update', _before_write),
+                           ('after_insert', _after_insert), ('after_update', _after_update),
+                           ('after_delete', _after_delete)):
+        if not event.contains(Product, name, listener):
+            event.listen(Product, name, listener)
+
+def rebuild_search_index(batch_size=500):
+    """Re-index every product; returns the number of products indexed"""
+    from models import db, Product
+
+    connection = db.session.connection()
+    if not has_search_table(connection):
+        return 0
+
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Product.id, Product.name, Product.description, Product.brand) \
+            .filter(Product.id > last_id).order_by(Product.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            index_product_text(connection, row.id, row.name, row.description, row.brand)
+        indexed += len(rows)
+        last_id = rows[-1].id
+    db.session.commit()
+    logger.info(f"Indexed {indexed} products for search")
+    return indexed
+
+def backfill_normalized_names(batch_size=500):
+    """Fill Product.normalized_name where it is missing; returns the number of products filled"""
+    from matching import normalize_name
+    from models import db, Product
+
+    filled = 0
+    while True:
+        rows = db.session.query(Product.id, Product.name) \
+            .filter(Product.normalized_name.is_(None)).order_by(Product.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.bulk_update_mappings(Product, [
+            {'id': row.id, 'normalized_name': normalize_name(row.name)[:200]} for row in rows
+        ])
+        db.session.commit()
+        filled += len(rows)
+    if filled:
+        logger.info(f"Filled normalized names of {filled} products")
+    return filled
+
+def match_expression(terms, dialect_name):
+    """Return the engine query for terms, all required, the last one as a prefix"""
+    if dialect_name == 'postgresql':
+        return ' & '.join(f"'{term}'" for term in terms) + ':*'
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def ranked_matches(q):
+    """
+    Return a subquery of (product_id, score) for products matching q, lower
+    scores ranking first, or None if q has no searchable terms.
+    """
+    from models import db, Product
+
+    terms = search_terms(q)
+    if not terms:
+        return None
+
+    connection = db.session.connection()
+    dialect_name = connection.dialect.name
+    if not has_search_table(connection):
+        return select(Product.id.label('product_id'), literal(0.0).label('score')) \
+            .where(and_(*[Product.normalized_name.contains(term) for term in terms])) \
+            .subquery('ranked')
+
+    if dialect_name == 'postgresql':
+        statement = text(
+            f"SELECT product_id, -ts_rank_cd(document, to_tsquery('simple', :match)) AS score "
+            f"FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', :match)"
+        )
+    else:
+        statement = text(
+            f"SELECT rowid AS product_id, bm25({SEARCH_TABLE}, {FTS5_WEIGHTS}) AS score "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"
+        )
+    return statement.bindparams(match=match_expression(terms, dialect_name)) \
+        .columns(product_id=Integer, score=Float).subquery('ranked')
+
+def search_filter(q):
+    """Return a clause restricting a Product query to matches of q, or None"""
+    from models import Product
+
+    ranked = ranked_matches(q)
+    if ranked is None:
+        return None
+    return Product.id.in_(select(ranked.c.product_id))
+
+def clamp_page(page, per_page):
+    """Return (page, per_page) limited to valid values"""
+    return max(1, page or 1), max(1, min(per_page or DEFAULT_PER_PAGE, MAX_PER_PAGE))
+
+def search_products(user_id, q, page=1, per_page=DEFAULT_PER_PAGE):
+    """
+    Return ([(product, score)], total) for one page of the user's products
+    matching q. Call with page and per_page passed through clamp_page.
+    """
+    from sqlalchemy.orm import selectinload
+    from models import Product, URL
+
+    ranked = ranked_matches(q)
+    if ranked is None:
+        return [], 0
+
+    query = Product.query.join(ranked, ranked.c.product_id == Product.id) \
+        .filter(Product.urls.any(URL.user_id == user_id)) \
+        .options(selectinload(Product.urls))
+
+    total = query.count()
+    results = query.add_columns(ranked.c.score) \
+        .order_by(ranked.c.score, Product.id) \
+        .offset((page - 1) * per_page).limit(per_page).all()
+    return results, total
@@ -1,20 +1,56 @@
 import logging
 import time
+from collections import Counter
 from datetime import datetime
 from flask import current_app
 import traceback
 
+import metrics
+
 # This needs to be imported within functions to avoid circular imports
 # from models import db, URL, Product, PriceHistory
 # from extractors import get_product_info, batch_extract_product_data
 
 logger = logging.getLogger(__name__)
 
-def update_product_price(url_id):
-    """Update price for a single product URL"""
+def elapsed_ms(since):
+    """Milliseconds since a time.perf_counter() reading"""
+    return (time.perf_counter() - since) * 1000
+
+def record_write(attempt, write_started):
+    """Add a database write's duration to the attempt and the metrics"""
+    seconds = time.perf_counter() - write_started
+    metrics.DB_WRITE_SECONDS.observe(seconds)
+    attempt['write_ms'] = attempt.get('write_ms', 0) + seconds * 1000
+
+def finish_attempt(attempt, outcome, started):
+    """Record a finished check's outcome and duration in the attempt and the metrics"""
+    attempt['outcome'] = outcome
+    attempt['total_ms'] = elapsed_ms(started)
+    metrics.record_check(outcome, started)
+
+def update_product_price(url_id, stats=None, interval_minutes=None, attempt=None):
+    """
+    Update price for a single product URL and schedule its next check.
+    If stats (a Counter) is given, 'unchanged' is incremented when the page
+    fingerprint matched the previous run and extraction was skipped, and
+    'failed_<kind>' when the check failed (see refresh_queue.classify_failure).
+    If attempt (a dict) is given, it receives the check's started_at,
+    fetch_ms, parse_ms, write_ms, total_ms, bytes, status and outcome for
+    the refresh ledger.
+    interval_minutes defaults to the configured refresh interval.
+    """
     from models import db, URL, PriceHistory, Product
-    from extractors import get_product_info
+    from rollups import update_rollups
+    from cache import invalidate_product_followers
+    from matching import apply_product_identity, index_product
+    from refresh_queue import schedule_next_check, refresh_interval, record_failure, record_success
+    import extractors
     
+    if attempt is None:
+        attempt = {}
+    attempt['started_at'] = datetime.utcnow()
+    started = time.perf_counter()
     try:
         # Create app context
         with current_app.app_context():
@@ -24,13 +60,43 @@ def update_product_price(url_id):
                 logger.error(f"URL with ID {url_id} not found")
                 return False
                 
-            product_data = get_product_info(url_obj.url)
+            if interval_minutes is None:
+                interval_minutes = refresh_interval(current_app)
+                
+            fetch = extractors.fetch_page(url_obj.url)
+            attempt.update(fetch_ms=elapsed_ms(started), status=fetch.status, bytes=fetch.size)
+            page_content = fetch.content
+            fingerprint = extractors.page_fingerprint(page_content)
             
-            if not product_data or 'price' not in product_data or product_data['price'] is None:
-                logger.error(f"Failed to extract price for URL: {url_obj.url}")
-                url_obj.is_valid = False
+            # Skip parsing and writes entirely when the page has not changed
+            if fingerprint and url_obj.product_id and url_obj.is_valid and fingerprint == url_obj.content_hash:
+                logger.info(f"Page unchanged for URL ID {url_id}, skipping extraction")
                 url_obj.last_checked = datetime.utcnow()
+                schedule_next_check(url_obj, interval_minutes, url_obj.last_checked)
+                record_success(url_obj)
+                write_started = time.perf_counter()
+                db.session.commit()
+                record_write(attempt, write_started)
+                if stats is not None:
+                    stats['unchanged'] += 1
+                finish_attempt(attempt, 'unchanged', started)
+                return True
+                
+            parse_started = time.perf_counter()
+            product_data = extractors.get_product_info(url_obj.url, page_content=page_content) if page_content else None
+            attempt['parse_ms'] = elapsed_ms(parse_started)
+            
+            if not product_data or 'price' not in product_data or product_data['price'] is None:
+                # Retried with backoff, or quarantined if the page is gone or keeps failing
+                kind = record_failure(url_obj, fetch, interval_minutes)
+                logger.error(f"Failed to extract price for URL: {url_obj.url} ({kind}, "
+                             f"{url_obj.failure_count} in a row)")
+                write_started = time.perf_counter()
                 db.session.commit()
+                record_write(attempt, write_started)
+                if stats is not None:
+                    stats[f'failed_{kind}'] += 1
+                finish_attempt(attempt, f'failed_{kind}', started)
                 return False
                 
             # Get or create product
@@ -39,6 +105,7 @@ def update_product_price(url_id):
             if not product:
                 # Create a new product if one doesn't exist
                 logger.info(f"Creating new product for URL ID {url_id}")
+                write_started = time.perf_counter()
                 product = Product(
                     name=product_data.get('name', 'Unknown Product'),
                     current_price=product_data['price'],
@@ -47,13 +114,19 @@ def update_product_price(url_id):
                     description=product_data.get('description', ''),
                     availability=product_data.get('availability', 'unknown')
                 )
+                apply_product_identity(product, product_data)
                 db.session.add(product)
+                index_product(product)
                 db.session.commit()  # Commit to get the product ID
                 
                 # Link the product to the URL
                 # Get a fresh copy of the URL object to avoid stale data
                 url_obj = URL.query.get(url_id)
                 url_obj.product_id = product.id
+                url_obj.content_hash = fingerprint
+                url_obj.last_checked = datetime.utcnow()
+                schedule_next_check(url_obj, interval_minutes, url_obj.last_checked)
+                record_success(url_obj)
                 db.session.commit()
                 
                 # Verify the link was set
@@ -64,29 +137,40 @@ def update_product_price(url_id):
                 # Create initial price history entry
                 price_history = PriceHistory(
                     product_id=product.id,
-                    price=product_data['price']
+                    price=product_data['price'],
+                    timestamp=datetime.utcnow()
                 )
                 db.session.add(price_history)
+                update_rollups(product.id, price_history.price, price_history.timestamp)
                 db.session.commit()
+                record_write(attempt, write_started)
+                invalidate_product_followers(current_app, product.id)
                 
                 logger.info(f"Created new product: {product.name} with price {product.current_price}")
+                finish_attempt(attempt, 'created', started)
                 return True
                 
             # Check if price has changed
+            write_started = time.perf_counter()
             old_price = product.current_price
+            old_name = product.name
             new_price = product_data['price']
             
             if old_price != new_price:
+                changed_at = datetime.utcnow()
+                
                 # Create price history entry
                 price_history = PriceHistory(
                     product_id=product.id,
-                    price=new_price
+                    price=new_price,
+                    timestamp=changed_at
                 )
                 db.session.add(price_history)
+                update_rollups(product.id, new_price, changed_at)
                 
-                # Update product
-                product.current_price = new_price
-                product.updated_at = datetime.utcnow()
+                # Update product and its denormalized change fields
+                product.record_price_change(new_price, changed_at)
+                product.updated_at = changed_at
                 
                 # If we have additional data, update it
                 if 'name' in product_data and product_data['name']:
@@ -99,39 +183,73 @@ def update_product_price(url_id):
                     product.availability = product_data['availability']
                 
                 logger.info(f"Price updated for {product.name}: {old_price} -> {new_price}")
+                metrics.PRICE_CHANGES.inc(direction='down' if old_price is not None and new_price < old_price else 'up')
+            
+            # Keep the store identity and cross-store match group current;
+            # products indexed before matching existed are picked up here too
+            if apply_product_identity(product, product_data) or product.name != old_name or product.match_key is None:
+                index_product(product)
             
-            # Update last checked timestamp
+            # Update last checked timestamp and when the queue releases it next
             url_obj.last_checked = datetime.utcnow()
+            schedule_next_check(url_obj, interval_minutes, url_obj.last_checked)
+            record_success(url_obj)
+            url_obj.content_hash = fingerprint
             db.session.commit()
+            record_write(attempt, write_started)
             
+            # Cached dashboards of everyone tracking this product are now stale
+            if old_price != new_price:
+                invalidate_product_followers(current_app, product.id)
+            
+            finish_attempt(attempt, 'updated', started)
             return True
             
     except Exception as e:
         logger.error(f"Error updating product price for URL ID {url_id}: {str(e)}")
         logger.error(traceback.format_exc())
+        finish_attempt(attempt, 'error', started)
         return False
 
-def update_all_prices(app):
-    """Update prices for all valid URLs"""
+def update_all_prices(app, stats=None):
+    """
+    Update prices for all valid URLs now, e.g. from the "Update prices" button
+    or a cron job, and recheck the quarantined URLs whose backoff has passed.
+    The scheduler uses refresh_queue.dispatch_due() instead, which checks
+    only the URLs that are due.
+    Pass a Counter as stats to receive the run's counters ('checked', 'unchanged').
+    The run and each URL's timings are recorded in the refresh ledger.
+    """
+    from sqlalchemy import or_
     from models import db, URL, Product, PriceHistory
+    from refresh_queue import refresh_interval
+    from refresh_ledger import RefreshLedger
     
     logger.info("Starting price update for all products")
     start_time = time.time()
     updated_count = 0
+    if stats is None:
+        stats = Counter()
     
     # Use app context to ensure database operations work correctly
     with app.app_context():
-        # Get all valid URLs
-        valid_urls = URL.query.filter_by(is_valid=True).all()
+        # Get all valid URLs, and the quarantined ones due for a recheck
+        rows = db.session.query(URL.id, URL.url, URL.is_valid).filter(or_(
+            URL.is_valid == True,
+            URL.next_check_at.is_(None),
+            URL.next_check_at <= datetime.utcnow()
+        )).order_by(URL.id).all()
         
-        if not valid_urls:
+        if not rows:
             logger.info("No valid URLs found to update")
             return 0
             
-        logger.info(f"Found {len(valid_urls)} valid URLs to update")
+        quarantined = sum(1 for row in rows if not row.is_valid)
+        logger.info(f"Found {len(rows) - quarantined} valid URLs to update and {quarantined} quarantined URLs to recheck")
         
         # Create a list of URL IDs
-        url_ids = [url.id for url in valid_urls]
+        url_ids = [(row.id, row.url) for row in rows]
+        interval_minutes = refresh_interval(app)
         
         # Check if we're in a production environment
         is_production = bool(app.config.get('SERVERLESS', False)) or \
@@ -142,23 +260,116 @@ def update_all_prices(app):
         
         # Process URLs synchronously
         logger.info("Processing URLs synchronously")
-        for url_id in url_ids:
-            try:
-                success = update_product_price(url_id)
-                if success:
-                    updated_count += 1
-                # Small delay to avoid overloading servers
-                time.sleep(0.5)
-            except Exception as e:
-                logger.error(f"Error updating URL ID {url_id}: {str(e)}")
-                continue
+        ledger = RefreshLedger('manual')
+        try:
+            for url_id, url in url_ids:
+                attempt = {}
+                try:
+                    stats['checked'] += 1
+                    success = update_product_price(url_id, stats=stats, interval_minutes=interval_minutes,
+                                                   attempt=attempt)
+                    if success:
+                        updated_count += 1
+                    # Small delay to avoid overloading servers
+                    time.sleep(0.5)
+                except Exception as e:
+                    logger.error(f"Error updating URL ID {url_id}: {str(e)}")
+                    continue
+                finally:
+                    ledger.record(url_id, url, attempt)
+        finally:
+            ledger.finish()
         
     end_time = time.time()
     duration = end_time - start_time
     logger.info(f"Price update completed in {duration:.2f} seconds. Updated {updated_count} products.")
+    if stats['checked']:
+        skip_ratio = stats['unchanged'] / stats['checked']
+        logger.info(f"Skipped extraction for {stats['unchanged']} of {stats['checked']} unchanged pages ({skip_ratio:.1%})")
     
     return updated_count
 
+def latest_price_changes(product_ids=None):
+    """
+    Return a query of (product_id, price, previous_price, change_pct, timestamp)
+    for each product's latest PriceHistory row. The previous price comes from
+    LAG() over the product's history, so the whole computation runs in the
+    database (SQLite 3.25+ and PostgreSQL).
+    """
+    from sqlalchemy import case, func
+    from models import db, PriceHistory
+    
+    windowed = db.session.query(
+        PriceHistory.product_id,
+        PriceHistory.price,
+        PriceHistory.timestamp,
+        func.lag(PriceHistory.price).over(
+            partition_by=PriceHistory.product_id,
+            order_by=(PriceHistory.timestamp, PriceHistory.id)
+        ).label('previous_price'),
+        func.row_number().over(
+            partition_by=PriceHistory.product_id,
+            order_by=(PriceHistory.timestamp.desc(), PriceHistory.id.desc())
+        ).label('rank')
+    )
+    if product_ids is not None:
+        windowed = windowed.filter(PriceHistory.product_id.in_(product_ids))
+    windowed = windowed.subquery()
+    
+    change_pct = case(
+        (windowed.c.previous_price > 0,
+         (windowed.c.price - windowed.c.previous_price) * 100.0 / windowed.c.previous_price),
+        else_=0.0
+    )
+    return db.session.query(
+        windowed.c.product_id,
+        windowed.c.price,
+        windowed.c.previous_price,
+        change_pct.label('change_pct'),
+        windowed.c.timestamp
+    ).filter(windowed.c.rank == 1)
+
+def backfill_price_changes(batch_size=500):
+    """
+    Populate Product.previous_price, last_change_pct and last_changed_at from
+    the two latest PriceHistory rows of each product. Must run inside an app
+    context. Returns the number of products updated.
+    """
+    from models import db, Product
+    
+    updated = 0
+    last_id = 0
+    while True:
+        product_ids = [row.id for row in db.session.query(Product.id)
+                       .filter(Product.id > last_id)
+                       .order_by(Product.id)
+                       .limit(batch_size)]
+        if not product_ids:
+            break
+        last_id = product_ids[-1]
+        
+        changes = {row.product_id: row for row in latest_price_changes(product_ids)}
+        
+        mappings = []
+        for product_id in product_ids:
+            row = changes.get(product_id)
+            if row is not None and row.previous_price is not None:
+                mappings.append({
+                    'id': product_id,
+                    'previous_price': row.previous_price,
+                    'last_change_pct': row.change_pct,
+                    'last_changed_at': row.timestamp
+                })
+            else:
+                mappings.append({'id': product_id, 'previous_price': None, 'last_change_pct': 0, 'last_changed_at': None})
+                
+        db.session.bulk_update_mappings(Product, mappings)
+        db.session.commit()
+        updated += len(mappings)
+        logger.info(f"Backfilled price change fields for {updated} products")
+        
+    return updated
+
 # For standalone execution (e.g., from a cron job)
 if __name__ == "__main__":
     import os
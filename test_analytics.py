@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, User
+from analytics import compute_price_statistics
+
+def naive_statistics(timestamps, prices, now):
+    """Reference implementation for a single product"""
+    changes = [(b - a) / a * 100 for a, b in zip(prices, prices[1:]) if a > 0]
+    last_change = timestamps[0]
+    for i in range(1, len(prices)):
+        if prices[i] != prices[i - 1]:
+            last_change = timestamps[i]
+    peak, max_drop, max_drop_pct = prices[0], 0.0, 0.0
+    for price in prices:
+        peak = max(peak, price)
+        max_drop = max(max_drop, peak - price)
+        max_drop_pct = max(max_drop_pct, (peak - price) / peak * 100)
+    return {
+        'min_price': min(prices),
+        'max_price': max(prices),
+        'mean_price': sum(prices) / len(prices),
+        'volatility_pct': float(np.std(changes)) if changes else 0.0,
+        'seconds_since_change': int((now - last_change).total_seconds()),
+        'max_drop': max_drop,
+        'max_drop_pct': max_drop_pct,
+    }
+
+def test_vectorized_statistics_match_reference():
+    """Segmented NumPy statistics equal a per-product Python computation"""
+    rng = np.random.default_rng(7)
+    now = datetime(2024, 6, 1)
+    product_ids, timestamps, prices, expected = [], [], [], {}
+
+    for product_id in range(1, 40):
+        n = int(rng.integers(1, 60))
+        series_times = [datetime(2024, 1, 1) + timedelta(hours=int(h)) for h in np.sort(rng.choice(3000, n, replace=False))]
+        # Repeated prices make sure unchanged observations are handled
+        series_prices = [float(p) for p in np.round(rng.choice([50, 75, 80, 120, 200], n) * rng.uniform(0.9, 1.1), 0)]
+        product_ids += [product_id] * n
+        timestamps += series_times
+        prices += series_prices
+        expected[product_id] = naive_statistics(series_times, series_prices, now)
+
+    stats = compute_price_statistics(product_ids, np.array(timestamps, dtype='datetime64[us]'), prices, now=now)
+
+    assert stats['product_id'].tolist() == list(expected)
+    for i, product_id in enumerate(stats['product_id'].tolist()):
+        for name, value in expected[product_id].items():
+            assert np.isclose(stats[name][i], value), (product_id, name, stats[name][i], value)
+
+def test_analytics_endpoint_and_cli():
+    """The JSON endpoint and CLI report statistics for tracked products"""
+    with app.app_context():
+        user = User.query.filter_by(username='statsuser').first()
+        if not user:
+            user = User(username='statsuser', email='stats@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        product = Product(name='Stats Product', current_price=80.0)
+        db.session.add(product)
+        db.session.flush()
+        product_id = product.id
+        db.session.add(URL(url='https://stats-test.salla.sa/p/1', platform='salla', user_id=user_id, product_id=product_id))
+        now = datetime.utcnow()
+        for days_ago, price in [(5, 100.0), (4, 120.0), (3, 90.0), (2, 80.0)]:
+            db.session.add(PriceHistory(product_id=product_id, price=price, timestamp=now - timedelta(days=days_ago)))
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        data = client.get('/api/analytics?days=30').get_json()
+        assert len(data['products']) == 1
+        record = data['products'][0]
+        assert record['name'] == 'Stats Product'
+        assert record['min_price'] == 80.0 and record['max_price'] == 120.0
+        assert record['max_drop'] == 40.0
+        assert abs(record['max_drop_pct'] - 33.3333) < 0.001
+        assert 2 * 86400 - 60 <= record['seconds_since_change'] <= 2 * 86400 + 60
+
+        # Only the last two days of history
+        data = client.get('/api/analytics?days=3').get_json()
+        assert data['products'][0]['observations'] == 1
+
+        result = app.test_cli_runner().invoke(args=['price-stats', '--product-id', str(product_id)])
+        assert result.exit_code == 0
+        assert json.loads(result.output)['mean_price'] == 97.5
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
@@ -0,0 +1,82 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import Product, PriceHistory, PriceHistoryArchive
+from archive import export_history_archive, load_manifest, HistoryArchiveReader
+from analytics import load_recent_history_arrays
+from sqlalchemy import event
+
+def test_incremental_archive_export_and_read(tmp_path):
+    """Exports append by id into monthly partitions that read back via mmap"""
+    archive_dir = str(tmp_path)
+
+    with app.app_context():
+        product = Product(name='Archive Product', current_price=10.0)
+        db.session.add(product)
+        db.session.commit()
+
+        start = datetime(2023, 1, 30)
+        oldest = PriceHistory(product_id=product.id, price=9.0, timestamp=start - timedelta(days=40))
+        db.session.add(oldest)
+        for i, price in enumerate([10.0, 11.0, 12.0, 13.0]):
+            db.session.add(PriceHistory(product_id=product.id, price=price, timestamp=start + timedelta(days=i)))
+        db.session.commit()
+
+        # Move the oldest row out of the live table the way compaction does
+        db.session.add(PriceHistoryArchive(id=oldest.id, product_id=product.id, price=oldest.price,
+                                           timestamp=oldest.timestamp))
+        db.session.delete(oldest)
+        db.session.commit()
+
+        try:
+            assert export_history_archive(archive_dir) >= 5
+            manifest = load_manifest(archive_dir)
+            months = {part['month'] for part in manifest['parts']}
+            assert {'2022-12', '2023-01', '2023-02'} <= months
+
+            reader = HistoryArchiveReader(archive_dir)
+            product_ids, timestamps, prices = reader.load_arrays([product.id])
+            assert prices.tolist() == [9.0, 10.0, 11.0, 12.0, 13.0]
+            assert set(product_ids.tolist()) == {product.id}
+
+            # Nothing new to export; then only the new row is appended
+            assert export_history_archive(archive_dir) == 0
+            db.session.add(PriceHistory(product_id=product.id, price=14.0, timestamp=start + timedelta(days=5)))
+            db.session.commit()
+
+            # Analytics read archived rows, including compacted ones, and only newer rows from the database
+            product_id = product.id
+            queries = []
+            listener = lambda conn, cursor, statement, *args: queries.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                _, _, prices = load_recent_history_arrays([product_id], archive_dir=archive_dir)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            assert prices.tolist() == [9.0, 10.0, 11.0, 12.0, 13.0, 14.0]
+            assert len(queries) == 1 and 'price_history.id >' in queries[0]
+
+            assert export_history_archive(archive_dir) == 1
+            _, _, prices = HistoryArchiveReader(archive_dir).load_arrays([product.id])
+            assert prices.tolist()[-1] == 14.0
+
+            # A row written just now waits until no lower id can still commit
+            db.session.add(PriceHistory(product_id=product.id, price=15.0, timestamp=datetime.utcnow()))
+            db.session.commit()
+            assert export_history_archive(archive_dir) == 0
+        finally:
+            PriceHistoryArchive.query.filter_by(product_id=product.id).delete()
+            PriceHistory.query.filter_by(product_id=product.id).delete()
+            Product.query.filter_by(id=product.id).delete()
+            db.session.commit()
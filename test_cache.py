@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, PriceRollup, User
+from cache import LRUCache, RedisCache, get_cache, dashboard_cache_key
+from tasks import update_product_price
+import extractors
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the redis client methods the cache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode('utf-8')
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode('utf-8')
+        return value
+
+def test_lru_eviction_and_expiry():
+    """Least recently used entries are evicted and expired entries are dropped"""
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    cache.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+
+def test_version_bump_changes_keys():
+    """Bumping a user's version makes their old keys unreachable on both backends"""
+    for cache in (LRUCache(), RedisCache(FakeRedis())):
+        key = dashboard_cache_key(cache, 1, {'sort_by': 'name'})
+        assert key == dashboard_cache_key(cache, 1, {'sort_by': 'name'})
+        assert key != dashboard_cache_key(cache, 1, {'sort_by': 'updated'})
+
+        cache.set(key, {'items': [1]})
+        assert cache.get(key) == {'items': [1]}
+
+        cache.bump_version('user:1')
+        assert dashboard_cache_key(cache, 1, {'sort_by': 'name'}) != key
+        # Other users keep their pages
+        other = dashboard_cache_key(cache, 2, {})
+        cache.bump_version('user:1')
+        assert dashboard_cache_key(cache, 2, {}) == other
+
+def test_price_change_invalidates_followers(monkeypatch):
+    """A price update drops cached dashboards of users tracking the product"""
+    with app.app_context():
+        user = User.query.filter_by(username='cacheuser').first()
+        if not user:
+            user = User(username='cacheuser', email='cache@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        product = Product(name='Cache Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+        url = URL(url='https://cache-test.salla.sa/p/1', platform='salla', user=user, product_id=product.id)
+        db.session.add(url)
+        db.session.commit()
+        url_id, product_id = url.id, product.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        first = client.get('/api/products').get_json()
+        assert [item['current_price'] for item in first['items']] == [100.0]
+
+        monkeypatch.setattr(extractors, 'fetch_page', lambda u: extractors.PageFetch('<span class="price">90 SAR</span>', 200))
+        monkeypatch.setattr(extractors, 'get_product_info', lambda u, page_content=None: {'price': 90.0})
+
+        with app.app_context():
+            cache = get_cache(app)
+            stale_key = dashboard_cache_key(cache, user_id, {}, 'data')
+
+            assert update_product_price(url_id)
+            assert dashboard_cache_key(cache, user_id, {}, 'data') != stale_key
+
+        second = client.get('/api/products').get_json()
+        assert [item['current_price'] for item in second['items']] == [90.0]
+
+        # A refresh in another process bumps only that process's cache versions;
+        # the database version still moves this process's key
+        with app.app_context():
+            Product.query.filter_by(id=product_id).update({'current_price': 80.0, 'updated_at': datetime.utcnow()})
+            db.session.commit()
+        third = client.get('/api/products').get_json()
+        assert [item['current_price'] for item in third['items']] == [80.0]
+    finally:
+        with app.app_context():
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            PriceRollup.query.filter_by(product_id=product_id).delete()
+            URL.query.filter_by(id=url_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
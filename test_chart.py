@@ -0,0 +1,99 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, User
+from downsample import lttb, minmax
+
+def spiky_series(n=10000):
+    """A noisy series with one sharp drop and one sharp spike"""
+    rng = np.random.default_rng(42)
+    x = np.arange(n, dtype=np.float64)
+    y = 100 + np.cumsum(rng.normal(0, 0.1, n))
+    y[2500] = 10.0
+    y[7500] = 500.0
+    return x, y
+
+def test_lttb_keeps_shape():
+    """LTTB returns threshold sorted points including the endpoints and extremes"""
+    x, y = spiky_series()
+    keep = lttb(x, y, 200)
+
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+    assert 2500 in keep and 7500 in keep
+
+    # Short series are returned untouched
+    assert list(lttb(x[:50], y[:50], 200)) == list(range(50))
+
+def test_minmax_keeps_every_bucket_extreme():
+    """Min/max bucketing never loses the global minimum or maximum"""
+    x, y = spiky_series()
+    keep = minmax(x, y, 200)
+
+    assert len(keep) <= 202
+    assert np.all(np.diff(keep) > 0)
+    assert y[keep].min() == y.min()
+    assert y[keep].max() == y.max()
+
+def test_chart_endpoint():
+    """The chart API downsamples, filters by range and checks ownership"""
+    with app.app_context():
+        user = User.query.filter_by(username='chartuser').first()
+        if not user:
+            user = User(username='chartuser', email='chart@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        product = Product(name='Chart Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(URL(url='https://chart-test.salla.sa/p/1', platform='salla', user=user, product_id=product.id))
+
+        start = datetime(2024, 1, 1)
+        db.session.bulk_insert_mappings(PriceHistory, [
+            {'product_id': product.id, 'price': 100.0 + (i % 7), 'timestamp': start + timedelta(hours=i)}
+            for i in range(2000)
+        ])
+        db.session.commit()
+        product_id = product.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        data = client.get(f'/api/products/{product_id}/chart?points=100').get_json()
+        assert data['total_points'] == 2000
+        assert len(data['dates']) == len(data['prices']) == 100
+        assert data['dates'][0] == '2024-01-01 00:00'
+
+        data = client.get(f'/api/products/{product_id}/chart?points=100&method=minmax&start=2024-02-01').get_json()
+        assert data['total_points'] == 2000 - 31 * 24
+        assert min(data['prices']) == 100.0 and max(data['prices']) == 106.0
+
+        assert client.get(f'/api/products/{product_id}/chart?start=yesterday').status_code == 400
+        assert client.get(f'/api/products/{product_id}/chart?method=cubic').status_code == 400
+        assert client.get(f'/product/{product_id}').status_code == 200
+    finally:
+        with app.app_context():
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            URL.query.filter_by(product_id=product_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
@@ -0,0 +1,70 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import Product, PriceHistory, PriceHistoryArchive
+from compaction import RetentionPolicy, compact_price_history
+
+def test_compaction_merges_downsamples_and_archives():
+    """Each retention tier is applied and reclaimed rows are reported"""
+    now = datetime(2024, 12, 31, 12, 0)
+    policy = RetentionPolicy(full_resolution_days=30, archive_after_days=180, flap_window_hours=6)
+
+    with app.app_context():
+        product = Product(name='Compaction Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+
+        def add(days_ago, hour, price):
+            db.session.add(PriceHistory(
+                product_id=product.id,
+                price=price,
+                timestamp=now - timedelta(days=days_ago) + timedelta(hours=hour)
+            ))
+
+        # Archive tier: two rows older than 180 days
+        add(300, 0, 90.0)
+        add(250, 0, 95.0)
+        # Downsample tier: a flapping sale badge, a repeat and two changes in one day
+        add(100, 0, 100.0)
+        add(100, 2, 80.0)    # blip lasting 1 hour
+        add(100, 3, 100.0)
+        add(90, 0, 100.0)    # identical to the previous price
+        add(60, 1, 110.0)
+        add(60, 5, 115.0)    # same day, only the last price survives
+        # Full resolution tier: kept untouched
+        add(10, 0, 120.0)
+        add(10, 1, 120.0)
+        db.session.commit()
+
+        try:
+            report = compact_price_history(policy, batch_size=1, now=now)
+            assert report['archived'] == 2
+            assert report['merged'] == 4
+            assert report['reclaimed'] == 6
+
+            remaining = [h.price for h in PriceHistory.query.filter_by(product_id=product.id)
+                         .order_by(PriceHistory.timestamp)]
+            assert remaining == [100.0, 115.0, 120.0, 120.0]
+
+            archived = [a.price for a in PriceHistoryArchive.query.filter_by(product_id=product.id)
+                        .order_by(PriceHistoryArchive.timestamp)]
+            assert archived == [90.0, 95.0]
+
+            # Compaction is idempotent
+            assert compact_price_history(policy, now=now)['reclaimed'] == 0
+        finally:
+            PriceHistoryArchive.query.filter_by(product_id=product.id).delete()
+            PriceHistory.query.filter_by(product_id=product.id).delete()
+            Product.query.filter_by(id=product.id).delete()
+            db.session.commit()
@@ -0,0 +1,93 @@
+import os
+import sys
+import logging
+from collections import Counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, PriceRollup, User
+from tasks import update_product_price
+import extractors
+
+PAGE = '''<html><head>
+<meta name="csrf-token" content="{token}">
+<script nonce="{token}">window.generatedAt = "{stamp}";</script>
+</head><body><!-- rendered in {token}ms -->
+<span class="price">{price} SAR</span></body></html>'''
+
+def render_page(price, token, stamp):
+    return PAGE.format(price=price, token=token, stamp=stamp)
+
+def test_fingerprint_ignores_volatile_content():
+    """Tokens, nonces, comments and timestamps do not change the fingerprint"""
+    first = render_page(100, 'abc123', '2024-05-01T10:00:00Z')
+    second = render_page(100, 'zzz999', '2024-05-02T11:30:15.120+03:00')
+    changed = render_page(95, 'abc123', '2024-05-01T10:00:00Z')
+
+    assert extractors.page_fingerprint(first) == extractors.page_fingerprint(second)
+    assert extractors.page_fingerprint(first) != extractors.page_fingerprint(changed)
+    assert extractors.page_fingerprint(None) is None
+
+def test_unchanged_page_skips_extraction(monkeypatch):
+    """A matching fingerprint only bumps last_checked"""
+    with app.app_context():
+        user = User.query.filter_by(username='hashuser').first()
+        if not user:
+            user = User(username='hashuser', email='hash@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+
+        product = Product(name='Hash Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+
+        url = URL(
+            url='https://hash-test.salla.sa/p/1',
+            platform='salla',
+            user=user,
+            product_id=product.id,
+            content_hash=extractors.page_fingerprint(render_page(100, 'a', '2024-05-01T10:00:00Z'))
+        )
+        db.session.add(url)
+        db.session.commit()
+        url_id, product_id = url.id, product.id
+
+        def fail_extraction(url, page_content=None):
+            raise AssertionError("extraction should be skipped")
+
+        monkeypatch.setattr(extractors, 'fetch_page', lambda u: extractors.PageFetch(render_page(100, 'b', '2024-06-01T09:00:00Z'), 200))
+        monkeypatch.setattr(extractors, 'get_product_info', fail_extraction)
+
+        try:
+            stats = Counter()
+            assert update_product_price(url_id, stats=stats)
+            assert stats['unchanged'] == 1
+
+            db.session.expire_all()
+            assert db.session.get(URL, url_id).last_checked is not None
+            assert PriceHistory.query.filter_by(product_id=product_id).count() == 0
+
+            # A real price change is parsed and recorded
+            monkeypatch.setattr(extractors, 'fetch_page', lambda u: extractors.PageFetch(render_page(90, 'c', '2024-06-02T09:00:00Z'), 200))
+            monkeypatch.setattr(extractors, 'get_product_info', lambda u, page_content=None: {'price': 90.0, 'name': 'Hash Product'})
+
+            assert update_product_price(url_id, stats=stats)
+            assert stats['unchanged'] == 1
+
+            db.session.expire_all()
+            assert db.session.get(Product, product_id).current_price == 90.0
+            assert PriceHistory.query.filter_by(product_id=product_id).count() == 1
+        finally:
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            PriceRollup.query.filter_by(product_id=product_id).delete()
+            URL.query.filter_by(id=url_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
@@ -0,0 +1,93 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, User
+from cache import invalidate_user_dashboards
+from user_cache import get_user_cache
+
+def add_tracked_products(user, count, start_index=0):
+    """Create products with a URL and a short price history for user"""
+    for i in range(start_index, start_index + count):
+        product = Product(name=f'Query Product {i}', current_price=100.0 + i)
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(URL(url=f'https://query-test.salla.sa/p/{user.id}/{i}', platform='salla',
+                           user=user, product_id=product.id))
+        for day in range(3):
+            db.session.add(PriceHistory(product_id=product.id, price=100.0 + i + day,
+                                        timestamp=datetime(2024, 1, 1) + timedelta(days=day)))
+    db.session.commit()
+    # Rows written directly bypass the routes, so drop cached pages by hand
+    invalidate_user_dashboards(app, [user.id])
+
+def count_dashboard_queries(client, query_string=''):
+    """Request the dashboard and return the number of SQL statements run"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    # Count the user lookup on every request, not just the first
+    get_user_cache(app).clear()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(f'/dashboard{query_string}')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert response.status_code == 200
+    logger.info(f"Dashboard ran {len(statements)} queries")
+    return len(statements)
+
+def test_dashboard_query_count_is_constant():
+    """Dashboard queries do not grow with the number of tracked products"""
+    with app.app_context():
+        user = User.query.filter_by(username='queryuser').first()
+        if not user:
+            user = User(username='queryuser', email='query@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+        add_tracked_products(user, 2)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        small = count_dashboard_queries(client)
+
+        with app.app_context():
+            add_tracked_products(db.session.get(User, user_id), 8, start_index=2)
+
+        large = count_dashboard_queries(client)
+        assert large == small
+        # User lookup, the ETag version, products, their URLs and one history query
+        assert large <= 5
+
+        # Filters and change sorts stay in SQL as well
+        assert count_dashboard_queries(client, '?platform=salla&sort_by=change_desc') == large
+    finally:
+        with app.app_context():
+            urls = URL.query.filter_by(user_id=user_id).all()
+            product_ids = [url.product_id for url in urls]
+            URL.query.filter_by(user_id=user_id).delete()
+            PriceHistory.query.filter(PriceHistory.product_id.in_(product_ids)).delete()
+            Product.query.filter(Product.id.in_(product_ids)).delete()
+            db.session.commit()
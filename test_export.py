@@ -0,0 +1,178 @@
+import os
+import sys
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, User
+import exports
+from exports import history_export_bound
+
+def create_export_user(username):
+    """Return the id of a test user, creating it if needed"""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        user = User(username=username, email=f'{username}@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+    return user.id
+
+def logged_in_client(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+def test_streaming_csv_export():
+    """The CSV export streams one row per product from a single query"""
+    with app.app_context():
+        user_id = create_export_user('exportuser')
+        user = db.session.get(User, user_id)
+
+        product_ids = []
+        for i in range(3):
+            product = Product(name=f'Export Product {i}', current_price=50.0 + i, last_change_pct=i * 1.5)
+            db.session.add(product)
+            db.session.flush()
+            product_ids.append(product.id)
+            db.session.add(URL(url=f'https://export-test.salla.sa/p/{i}', platform='salla', user=user, product_id=product.id))
+            for day in range(2):
+                db.session.add(PriceHistory(product_id=product.id, price=50.0 + i + day,
+                                            timestamp=datetime(2024, 3, 1) + timedelta(days=day)))
+        # A second URL on another platform for the first product
+        db.session.add(URL(url='https://export-test.zid.store/p/0', platform='zid', user=user, product_id=product_ids[0]))
+        db.session.commit()
+
+    client = logged_in_client(user_id)
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get('/export-data')
+        assert response.is_streamed
+        body = response.get_data(as_text=True)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    try:
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'].startswith('attachment; filename=price_data_export_')
+
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert [row['Product Name'] for row in rows] == ['Export Product 0', 'Export Product 1', 'Export Product 2']
+        assert rows[0]['Platform'] == 'salla, zid'
+        assert rows[0]['URLs'] == 'https://export-test.salla.sa/p/0, https://export-test.zid.store/p/0'
+        assert rows[1]['Price History'] == '51.0 (2024-03-01), 52.0 (2024-03-02)'
+        assert rows[2]['Last Change %'] == '3.0'
+
+        # User lookup plus one export query, however many products there are
+        assert len(statements) <= 2
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            PriceHistory.query.filter(PriceHistory.product_id.in_(product_ids)).delete()
+            Product.query.filter(Product.id.in_(product_ids)).delete()
+            db.session.commit()
+
+def test_incremental_history_export(monkeypatch):
+    """JSONL and Parquet history exports honour date ranges and the since cursor"""
+    import pyarrow.parquet as pq
+
+    with app.app_context():
+        user_id = create_export_user('historyexport')
+        product = Product(name='منتج التصدير', current_price=10.0, currency='SAR')
+        db.session.add(product)
+        db.session.flush()
+        product_id = product.id
+        db.session.add(URL(url='https://history-export.salla.sa/p/1', platform='salla',
+                           user_id=user_id, product_id=product_id))
+        for day in range(5):
+            db.session.add(PriceHistory(product_id=product_id, price=10.0 + day,
+                                        timestamp=datetime(2024, 4, 1) + timedelta(days=day)))
+        db.session.commit()
+
+    client = logged_in_client(user_id)
+    try:
+        response = client.get('/api/export/history')
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [row['price'] for row in rows] == [10.0, 11.0, 12.0, 13.0, 14.0]
+        assert rows[0]['product_name'] == 'منتج التصدير'
+        cursor = int(response.headers['X-Next-Since'])
+        assert cursor >= rows[-1]['id']
+
+        # Nothing new since the last sync
+        response = client.get(f'/api/export/history?since={cursor}')
+        assert response.get_data(as_text=True) == ''
+
+        # New rows after the cursor are picked up
+        with app.app_context():
+            db.session.add(PriceHistory(product_id=product_id, price=15.0, timestamp=datetime(2024, 4, 6)))
+            db.session.commit()
+        response = client.get(f'/api/export/history?since={cursor}')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [row['price'] for row in rows] == [15.0]
+
+        # Date range as Parquet
+        response = client.get('/api/export/history?format=parquet&start=2024-04-02&end=2024-04-03')
+        assert response.status_code == 200
+        table = pq.read_table(io.BytesIO(response.get_data()))
+        assert table.column('price').to_pylist() == [11.0, 12.0]
+        assert table.column('product_id').to_pylist() == [product_id, product_id]
+
+        assert client.get('/api/export/history?format=xml').status_code == 400
+        assert client.get('/api/export/history?since=abc').status_code == 400
+
+        # Without pyarrow, as on the serverless build, Parquet is refused cleanly
+        with monkeypatch.context() as patch:
+            patch.setattr(exports, 'parquet_available', lambda: False)
+            response = client.get('/api/export/history?format=parquet')
+            assert response.status_code == 501 and 'jsonl' in response.get_json()['error']
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
+
+def test_history_cursor_lags_recent_rows():
+    """The sync cursor stops before rows whose lower-id neighbours may not have committed yet"""
+    with app.app_context():
+        product = Product(name='Cursor Lag Product', current_price=10.0)
+        db.session.add(product)
+        db.session.flush()
+        old = PriceHistory(product_id=product.id, price=10.0, timestamp=datetime.utcnow() - timedelta(minutes=5))
+        db.session.add(old)
+        db.session.flush()
+        recent = PriceHistory(product_id=product.id, price=11.0, timestamp=datetime.utcnow())
+        db.session.add(recent)
+        db.session.commit()
+        try:
+            bound = history_export_bound()
+            assert old.id <= bound < recent.id
+            assert history_export_bound(lag_seconds=0) >= recent.id
+            # A cursor never moves backwards
+            assert history_export_bound(since=recent.id + 1000) == recent.id + 1000
+        finally:
+            PriceHistory.query.filter_by(product_id=product.id).delete()
+            Product.query.filter_by(id=product.id).delete()
+            db.session.commit()
@@ -0,0 +1,80 @@
+import os
+import sys
+import logging
+
+import pytest
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from factory import create_app
+
+def test_profiles_build_only_their_components(monkeypatch):
+    """Each profile registers only the components its deployment needs"""
+    monkeypatch.setenv('SCHEMA_CHECK_ON_STARTUP', 'false')
+    monkeypatch.setenv('RUN_SCHEDULER', 'false')
+
+    web = create_app('web')
+    assert 'dashboard' in web.view_functions
+    assert 'upgrade-db' in web.cli.commands
+    assert hasattr(web, 'login_manager')
+
+    serverless = create_app('serverless')
+    assert 'dashboard' in serverless.view_functions
+    assert 'upgrade-db' not in serverless.cli.commands
+    assert serverless.config['SQLALCHEMY_DATABASE_URI'] == os.getenv('DATABASE_URL', 'sqlite:///:memory:')
+
+    worker = create_app('worker')
+    assert 'dashboard' not in worker.view_functions
+    assert not hasattr(worker, 'login_manager')
+    assert worker.config['PROFILE'] == 'worker'
+
+    cli = create_app('cli')
+    assert 'dashboard' not in cli.view_functions
+    assert 'rebuild-search-index' in cli.cli.commands
+    assert cli.apscheduler is None
+
+    with pytest.raises(ValueError):
+        create_app('batch')
+
+def test_worker_runs_scheduler(monkeypatch):
+    """The worker profile runs the leader-elected scheduler by default"""
+    monkeypatch.setenv('SCHEMA_CHECK_ON_STARTUP', 'false')
+    monkeypatch.delenv('RUN_SCHEDULER', raising=False)
+
+    worker = create_app('worker')
+    leader = worker.extensions['leader_scheduler']
+    try:
+        assert worker.apscheduler is leader.scheduler
+        assert worker.apscheduler.get_job('leader_heartbeat') is not None
+    finally:
+        leader.shutdown()
+
+    # Serverless never schedules, even when asked for a schema check
+    monkeypatch.setenv('SCHEMA_CHECK_ON_STARTUP', 'true')
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    assert create_app('serverless').apscheduler is None
+
+def test_schema_check_defaults(monkeypatch):
+    """Only development processes upgrade the schema at startup; production runs upgrade-db"""
+    monkeypatch.delenv('SCHEMA_CHECK_ON_STARTUP', raising=False)
+    monkeypatch.setenv('RUN_SCHEDULER', 'false')
+    monkeypatch.delenv('FLASK_ENV', raising=False)
+    for name in ('RENDER', 'HEROKU_APP_ID', 'VERCEL_ENV', 'SERVERLESS'):
+        monkeypatch.delenv(name, raising=False)
+
+    assert create_app('web').config['SCHEMA_CHECK_ON_STARTUP']
+    assert not create_app('worker').config['SCHEMA_CHECK_ON_STARTUP']
+
+    monkeypatch.setenv('FLASK_ENV', 'production')
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///unused.db')
+    assert not create_app('web').config['SCHEMA_CHECK_ON_STARTUP']
+    assert not create_app('worker').config['SCHEMA_CHECK_ON_STARTUP']
+
+    # An in-memory database has no release step to create its tables
+    monkeypatch.delenv('DATABASE_URL')
+    assert create_app('web').config['SCHEMA_CHECK_ON_STARTUP']
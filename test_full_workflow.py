@@ -87,9 +87,9 @@ def test_full_workflow(url_to_test):
         # Create a mock function to simulate different price extraction
         original_get_product_info = __import__('extractors').get_product_info
         
-        def mock_get_product_info(url):
+        def mock_get_product_info(url, page_content=None):
             # Get the real product info
-            product_data = original_get_product_info(url)
+            product_data = original_get_product_info(url, page_content=page_content)
             if product_data:
                 # Modify the price
                 product_data['price'] = simulated_price
@@ -99,6 +99,10 @@ def test_full_workflow(url_to_test):
         # Replace the real function with our mock
         __import__('extractors').get_product_info = mock_get_product_info
         
+        # Forget the page fingerprint so the unchanged page is parsed again
+        url.content_hash = None
+        db.session.commit()
+        
         try:
             # Step 7: Update the price again
             logger.info("STEP 3: Updating product price")
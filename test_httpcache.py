@@ -0,0 +1,167 @@
+import os
+import sys
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, User
+from sqlalchemy import event
+from httpcache import asset_fingerprint
+from cache import get_cache, validate_url_cache_key
+import extractors
+
+def test_conditional_pages(monkeypatch):
+    """Unchanged pages revalidate with 304 without running the view"""
+    with app.app_context():
+        user = User.query.filter_by(username='httpcacheuser').first()
+        if not user:
+            user = User(username='httpcacheuser', email='httpcache@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        product = Product(name='Conditional Kettle', current_price=80.0)
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(URL(url=f'https://httpcache.salla.sa/p/{product.id}', platform='salla',
+                           user_id=user_id, product_id=product.id))
+        db.session.commit()
+        product_id = product.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        for path in ('/dashboard', '/api/products', f'/product/{product_id}', f'/api/products/{product_id}/chart'):
+            response = client.get(path)
+            assert response.status_code == 200, path
+            etag = response.headers['ETag']
+            assert 'private' in response.headers['Cache-Control']
+            assert 'no-cache' in response.headers['Cache-Control']
+
+            statements = []
+            count_statements = lambda *args: statements.append(args[2])
+            with app.app_context():
+                engine = db.engine
+            event.listen(engine, 'before_cursor_execute', count_statements)
+            try:
+                revalidated = client.get(path, headers={'If-None-Match': etag})
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_statements)
+            assert revalidated.status_code == 304, path
+            assert revalidated.get_data() == b''
+            # Only the user lookup and the version query run
+            assert len(statements) <= 2, statements
+
+            # A timestamp alone cannot tell a deletion apart, so only the ETag revalidates
+            since = response.headers.get('Last-Modified')
+            if since:
+                assert client.get(path, headers={'If-Modified-Since': since}).status_code == 200
+
+        response = client.get('/api/products')
+        etag = response.headers['ETag']
+
+        # Changing the product changes the version
+        with app.app_context():
+            db.session.get(Product, product_id).current_price = 75.0
+            db.session.commit()
+        response = client.get('/api/products', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+        # Another user never shares the validator
+        with app.app_context():
+            other = User.query.filter_by(username='httpcacheother').first()
+            if not other:
+                other = User(username='httpcacheother', email='httpcacheother@example.com')
+                other.set_password('password')
+                db.session.add(other)
+                db.session.commit()
+            other_id = other.id
+        other_client = app.test_client()
+        with other_client.session_transaction() as session:
+            session['_user_id'] = str(other_id)
+            session['_fresh'] = True
+        assert other_client.get('/api/products', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+        # Pages with pending flash messages are not cached
+        with client.session_transaction() as session:
+            session['_flashes'] = [('info', 'One-off message')]
+        response = client.get('/dashboard')
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
+
+def test_fingerprinted_assets():
+    """Templates link fingerprinted assets, which are cached as immutable"""
+    client = app.test_client()
+    with app.app_context():
+        digest = asset_fingerprint('css/style.css')
+
+    page = client.get('/login').get_data(as_text=True)
+    assert f'/assets/css/style.{digest}.css' in page
+
+    response = client.get(f'/assets/css/style.{digest}.css')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    response.close()
+
+    # A stale fingerprint still serves the file, without the long lifetime
+    response = client.get('/assets/css/style.000000000000.css')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers['Cache-Control']
+    response.close()
+
+def test_validate_url_post_only(monkeypatch):
+    """URL validation takes a JSON POST and reuses a recent result without fetching"""
+    with app.app_context():
+        user = User.query.filter_by(username='httpcacheuser').first()
+        if not user:
+            user = User(username='httpcacheuser', email='httpcache@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+        get_cache(app).delete(validate_url_cache_key('https://mugs.salla.sa/p/1'))
+
+    fetched = []
+    monkeypatch.setattr(extractors, 'get_page_content', lambda url: '<html>salla</html>')
+    monkeypatch.setattr(extractors, 'get_product_info',
+                        lambda url, page_content=None: fetched.append(url) or
+                        {'name': 'Validated Mug', 'price': 25.0, 'currency': 'SAR'})
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    # A cross-site link or image cannot trigger a fetch
+    assert client.get('/api/validate-url?url=https://mugs.salla.sa/p/1').status_code == 405
+    form_post = client.post('/api/validate-url', data={'url': 'https://mugs.salla.sa/p/1'})
+    assert form_post.get_json()['valid'] is False
+    assert fetched == []
+
+    for _ in range(2):
+        response = client.post('/api/validate-url', json={'url': 'https://mugs.salla.sa/p/1'})
+        assert response.get_json()['valid'] is True
+        assert response.get_json()['name'] == 'Validated Mug'
+    assert fetched == ['https://mugs.salla.sa/p/1']
+
+    with app.app_context():
+        get_cache(app).delete(validate_url_cache_key('https://mugs.salla.sa/p/1'))
+
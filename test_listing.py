@@ -0,0 +1,145 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, User
+from listing import encode_cursor, decode_cursor
+
+SORT_MODES = ['name', 'price_asc', 'price_desc', 'change_asc', 'change_desc', 'updated']
+
+def walk_pages(client, endpoint, query_string, per_page):
+    """Follow next_cursor through a JSON listing and return all item ids"""
+    ids = []
+    cursor = None
+    while True:
+        url = f'{endpoint}?per_page={per_page}{query_string}'
+        if cursor:
+            url += f'&cursor={cursor}'
+        data = client.get(url).get_json()
+        assert len(data['items']) <= per_page
+        ids.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids
+
+def test_cursor_round_trip():
+    """Cursors survive encoding, including datetimes"""
+    stamp = datetime(2024, 5, 1, 10, 30)
+    assert decode_cursor(encode_cursor(stamp, 7)) == (stamp, 7)
+    assert decode_cursor(encode_cursor('Widget', 3)) == ('Widget', 3)
+
+def test_keyset_pages_cover_every_sort_mode():
+    """Walking the pages returns every product exactly once, in sort order"""
+    with app.app_context():
+        user = User.query.filter_by(username='pageuser').first()
+        if not user:
+            user = User(username='pageuser', email='page@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        # Duplicate prices, names and change values exercise the id tie-breaker
+        base = datetime(2024, 1, 1)
+        for i in range(7):
+            product = Product(name=f'Page Product {i % 3}', current_price=float(10 * (i % 4)),
+                              last_change_pct=float(i % 2), updated_at=base + timedelta(hours=i % 5))
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(URL(url=f'https://page-test.salla.sa/p/{i}', platform='salla' if i % 2 else 'zid',
+                               user=user, product_id=product.id))
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        for sort_by in SORT_MODES:
+            full = walk_pages(client, '/api/products', f'&sort_by={sort_by}', per_page=100)
+            paged = walk_pages(client, '/api/products', f'&sort_by={sort_by}', per_page=2)
+            assert len(full) == 7
+            assert paged == full, sort_by
+
+        salla = walk_pages(client, '/api/products', '&platform=salla', per_page=2)
+        assert len(salla) == 3
+
+        # Change thresholds combine with sorting and pagination in SQL
+        changed = walk_pages(client, '/api/products', '&change_min=0.5&sort_by=price_desc', per_page=2)
+        assert len(changed) == 3
+        unchanged = walk_pages(client, '/api/products', '&change_max=0.5', per_page=2)
+        assert len(unchanged) == 4
+
+        urls = walk_pages(client, '/api/urls', '', per_page=3)
+        assert len(urls) == 7
+        assert urls == sorted(urls, reverse=True)
+
+        assert client.get('/api/products?cursor=not-a-cursor').status_code == 400
+        assert client.get('/dashboard?per_page=2').status_code == 200
+        assert client.get('/urls?per_page=2').status_code == 200
+    finally:
+        with app.app_context():
+            product_ids = [url.product_id for url in URL.query.filter_by(user_id=user_id)]
+            URL.query.filter_by(user_id=user_id).delete()
+            Product.query.filter(Product.id.in_(product_ids)).delete()
+            db.session.commit()
+
+def test_keyset_pages_with_null_sort_keys():
+    """Products without a price or update time come last and never end the listing early"""
+    with app.app_context():
+        user = User.query.filter_by(username='pagenulluser').first()
+        if not user:
+            user = User(username='pagenulluser', email='pagenull@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        base = datetime(2024, 1, 1)
+        prices = [None, 5.0, None, 10.0, 5.0]
+        products = []
+        for i, price in enumerate(prices):
+            product = Product(name=f'Null Page Product {i}', current_price=price)
+            db.session.add(product)
+            db.session.flush()
+            product.updated_at = base + timedelta(hours=i) if price is not None else None
+            db.session.add(URL(url=f'https://page-null-test.salla.sa/p/{i}', platform='salla',
+                               user=user, product_id=product.id))
+            products.append(product)
+        db.session.commit()
+        ids = [product.id for product in products]
+        assert Product.query.filter(Product.id.in_(ids), Product.updated_at.is_(None)).count() == 2
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        priced = [(price, product_id) for price, product_id in zip(prices, ids) if price is not None]
+        nulls = [product_id for price, product_id in zip(prices, ids) if price is None]
+        expected = {
+            'price_asc': [product_id for _, product_id in sorted(priced)] + nulls,
+            'price_desc': [product_id for _, product_id in sorted(priced, reverse=True)] + nulls[::-1],
+            'updated': [product_id for _, product_id in sorted(priced, key=lambda item: -item[1])] + nulls[::-1],
+        }
+        for sort_by, order in expected.items():
+            # Page sizes 1 to 3 put a NULL key at a page boundary in every mode
+            for per_page in (1, 2, 3, 100):
+                assert walk_pages(client, '/api/products', f'&sort_by={sort_by}', per_page) == order, (sort_by, per_page)
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            Product.query.filter(Product.id.in_(ids)).delete()
+            db.session.commit()
@@ -0,0 +1,125 @@
+import os
+import sys
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from sqlalchemy import text
+from models import URL, Product, PriceHistory, PriceRollup, ProductNameToken, User
+from matching import normalize_name, name_tokens, similarity, cheapest_across_stores
+from tasks import update_product_price
+import extractors
+
+def test_arabic_name_normalization():
+    """Spelling variants of the same Arabic name produce the same tokens"""
+    first = name_tokens(normalize_name('زيت الزيتون البكر الممتاز ٥٠٠ مل'))
+    second = name_tokens(normalize_name('زيتُ زيتون بِكر ممتاز - 500ml'))
+    assert first == second == {'زيت', 'زيتون', 'بكر', 'ممتاز', '500', 'ml'}
+
+    assert normalize_name('إبريق شاي أزرق') == normalize_name('ابريق شاى ازرق')
+    assert normalize_name('قهوة عربية') == 'قهوه عربيه'
+    # Different quantities never collapse into one token set
+    assert name_tokens(normalize_name('حليب 1 لتر')) != name_tokens(normalize_name('حليب 2 لتر'))
+
+def test_variants_never_match():
+    """Names differing only in a variant word such as organic are different products"""
+    plain = name_tokens(normalize_name('زيت زيتون بكر ممتاز 500ml'))
+    organic = name_tokens(normalize_name('زيت زيتون بكر ممتاز عضوي 500ml'))
+    assert similarity(plain, organic) == 0.0
+    assert similarity(organic, name_tokens(normalize_name('زيت الزيتون البكر الممتاز العضوي ٥٠٠ مل'))) == 1.0
+
+def test_cross_store_matching(monkeypatch):
+    """Products from different stores are grouped by SKU or by normalized name"""
+    with app.app_context():
+        user = User.query.filter_by(username='matchuser').first()
+        if not user:
+            user = User(username='matchuser', email='match@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+        other = User.query.filter_by(username='matchother').first()
+        if not other:
+            other = User(username='matchother', email='matchother@example.com')
+            other.set_password('password')
+            db.session.add(other)
+            db.session.commit()
+        other_id = other.id
+
+        pages = {
+            'https://match-a.salla.sa/p/1': {'price': 30.0, 'name': 'زيت الزيتون البكر الممتاز ٥٠٠ مل', 'store_name': 'متجر أ'},
+            'https://match-b.zid.store/p/1': {'price': 27.5, 'name': 'زيت زيتون بكر ممتاز 500ml', 'store_name': 'متجر ب'},
+            'https://match-c.zid.store/p/1': {'price': 29.0, 'name': 'زيت زيتون بكر ممتاز عضوي 500ml', 'store_name': 'متجر ج'},
+            'https://match-d.salla.sa/p/1': {'price': 12.0, 'name': 'Coffee Beans', 'sku': 'CB-1001', 'brand': 'Acme'},
+            'https://match-e.zid.store/p/1': {'price': 11.0, 'name': 'حبوب قهوة', 'sku': 'cb1001', 'brand': 'ACME'},
+            # The same oil, cheapest of all, but tracked by another user only
+            'https://match-f.salla.sa/p/1': {'price': 20.0, 'name': 'زيت زيتون بكر ممتاز 500 مل', 'store_name': 'متجر و'},
+        }
+        owners = {'https://match-f.salla.sa/p/1': other_id}
+        monkeypatch.setattr(extractors, 'fetch_page', lambda url: extractors.PageFetch(f'<html>{url}</html>', 200))
+        monkeypatch.setattr(extractors, 'get_product_info', lambda url, page_content=None: dict(pages[url]))
+
+        url_ids = []
+        for page_url in pages:
+            url = URL(url=page_url, platform='salla' if 'salla' in page_url else 'zid',
+                      user_id=owners.get(page_url, user_id))
+            db.session.add(url)
+            db.session.commit()
+            url_ids.append(url.id)
+            assert update_product_price(url.id)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        with app.app_context():
+            products = {url.url: url.product for url in URL.query.filter(URL.id.in_(url_ids))}
+            oil_a, oil_b, oil_c = (products[u] for u in list(pages)[:3])
+            coffee_d, coffee_e, oil_f = (products[u] for u in list(pages)[3:])
+
+            # Exact name tokens; the organic variant is a different product
+            assert oil_a.match_key == oil_b.match_key == oil_f.match_key != oil_c.match_key
+            assert oil_a.store_name == 'متجر أ'
+            # Exact SKU and brand
+            assert coffee_d.match_key == coffee_e.match_key != oil_a.match_key
+            assert coffee_d.match_key.startswith('sku:')
+
+            # Only the user's own products are offered
+            cheapest = cheapest_across_stores(oil_a, user_id)
+            assert [p.current_price for p in cheapest] == [27.5, 30.0]
+            assert [p.current_price for p in cheapest_across_stores(oil_a, other_id)] == [20.0]
+
+            if db.engine.dialect.name == 'sqlite':
+                query = Product.query.filter(Product.match_key == oil_a.match_key).order_by(Product.current_price)
+                compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+                plan = ' | '.join(row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+                assert 'ix_product_match_key_current_price' in plan
+                assert 'TEMP B-TREE' not in plan
+
+            oil_a_id, coffee_d_id = oil_a.id, coffee_d.id
+
+        data = client.get(f'/api/products/{oil_a_id}/offers').get_json()
+        assert [offer['store_name'] for offer in data['offers']] == ['متجر ب', 'متجر أ']
+        assert data['offers'][0]['url'] == 'https://match-b.zid.store/p/1'
+
+        response = client.get(f'/product/{coffee_d_id}')
+        assert response.status_code == 200
+        assert 'Other Stores' in response.get_data(as_text=True)
+    finally:
+        with app.app_context():
+            product_ids = [url.product_id for url in URL.query.filter(URL.id.in_(url_ids))]
+            URL.query.filter(URL.id.in_(url_ids)).delete()
+            PriceHistory.query.filter(PriceHistory.product_id.in_(product_ids)).delete()
+            PriceRollup.query.filter(PriceRollup.product_id.in_(product_ids)).delete()
+            ProductNameToken.query.filter(ProductNameToken.product_id.in_(product_ids)).delete()
+            Product.query.filter(Product.id.in_(product_ids)).delete()
+            db.session.commit()
@@ -0,0 +1,111 @@
+import os
+import sys
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL
+import extractors
+import metrics
+import tasks
+from extractors import PageFetch
+
+def test_registry_renders_text_format():
+    """Counters, gauges and cumulative histogram buckets render in Prometheus format"""
+    registry = metrics.Registry()
+    requests_total = metrics.Counter('demo_requests_total', 'Requests', ['status'], registry=registry)
+    depth = metrics.Gauge('demo_depth', 'Depth', registry=registry)
+    latency = metrics.Histogram('demo_seconds', 'Latency', ['host'], buckets=(0.1, 1), registry=registry)
+
+    requests_total.inc(status=200)
+    requests_total.inc(2, status=200)
+    requests_total.inc(status='error')
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, host='a"b.com')
+
+    text = registry.render()
+    assert '# TYPE demo_requests_total counter' in text
+    assert 'demo_requests_total{status="200"} 3' in text
+    assert 'demo_requests_total{status="error"} 1' in text
+    assert 'demo_depth 7' in text
+    assert 'demo_seconds_bucket{host="a\\"b.com",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{host="a\\"b.com",le="1"} 2' in text
+    assert 'demo_seconds_bucket{host="a\\"b.com",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{host="a\\"b.com"} 3' in text
+
+    try:
+        requests_total.inc(host='x')
+        assert False, "wrong labels should raise"
+    except ValueError:
+        pass
+
+def test_fetch_page_records_platform_metrics(monkeypatch):
+    """Each request records its latency, status and size under the store's platform, never its host"""
+    class FakeResponse:
+        status_code = 404
+        content = b'missing'
+        text = 'missing'
+
+    monkeypatch.setattr(extractors.requests, 'get', lambda *args, **kwargs: FakeResponse())
+    before = metrics.FETCH_RESPONSES.value(platform='zid', status=404)
+
+    fetch = extractors.fetch_page('https://metrics-test.zid.store/p/1')
+    assert fetch.content is None and fetch.status == 404
+    # A 404 is final, so it is requested once
+    assert metrics.FETCH_RESPONSES.value(platform='zid', status=404) == before + 1
+    assert metrics.FETCH_BYTES.value(platform='zid') >= len(FakeResponse.content)
+    assert metrics.FETCH_SECONDS.value(platform='zid') >= 1
+
+    assert metrics.platform_label('https://shop.salla.sa/p/1') == 'salla'
+    assert metrics.platform_label('https://my-store.example.com/p/1') == 'other'
+    assert metrics.platform_label('https://notsalla.sa.example.com/') == 'other'
+
+def test_metrics_endpoint(monkeypatch):
+    """/metrics reports check outcomes and queue depth, and honours METRICS_TOKEN"""
+    monkeypatch.setattr(extractors, 'fetch_page', lambda url: PageFetch(None, None, 'Connection refused'))
+    with app.app_context():
+        url = URL(url='https://metrics-endpoint-test.example.com/p/1', platform='salla')
+        db.session.add(url)
+        db.session.commit()
+        url_id = url.id
+
+    client = app.test_client()
+    try:
+        before = metrics.URL_CHECKS.value(outcome='failed_network')
+        with app.app_context():
+            assert not tasks.update_product_price(url_id, interval_minutes=60)
+        assert metrics.URL_CHECKS.value(outcome='failed_network') == before + 1
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        text = response.get_data(as_text=True)
+        assert f'pricetracker_url_checks_total{{outcome="failed_network"}} {before + 1}' in text
+        assert 'pricetracker_refresh_queue_urls{state="due"}' in text
+        assert 'pricetracker_url_check_seconds_count' in text
+
+        app.config['METRICS_TOKEN'] = 'secret'
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+        # A non-ASCII header is rejected, not an error
+        assert client.get('/metrics', headers={'Authorization': 'Bearer sécret'}).status_code == 401
+
+        # Production refuses to serve metrics without a token
+        app.config['METRICS_TOKEN'] = None
+        app.config['METRICS_REQUIRE_TOKEN'] = True
+        assert client.get('/metrics').status_code == 404
+        assert metrics.serve_metrics(app, 0) is None
+    finally:
+        app.config['METRICS_TOKEN'] = None
+        app.config['METRICS_REQUIRE_TOKEN'] = False
+        with app.app_context():
+            URL.query.filter_by(id=url_id).delete()
+            db.session.commit()
@@ -0,0 +1,66 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import Product, PriceHistory
+from tasks import backfill_price_changes, latest_price_changes
+
+def test_record_price_change():
+    """The write path keeps the denormalized change fields current"""
+    product = Product(name='Change Product', current_price=200.0)
+    changed_at = datetime(2024, 1, 2, 12, 0)
+
+    product.record_price_change(150.0, changed_at)
+
+    assert product.current_price == 150.0
+    assert product.previous_price == 200.0
+    assert product.last_change_pct == -25.0
+    assert product.last_changed_at == changed_at
+    assert product.last_price_change == -25.0
+
+def test_backfill_price_changes():
+    """The backfill derives the change fields from the two latest history rows"""
+    with app.app_context():
+        product = Product(name='Backfill Product', current_price=110.0)
+        single = Product(name='Backfill Single', current_price=50.0)
+        db.session.add_all([product, single])
+        db.session.commit()
+
+        start = datetime(2024, 1, 1)
+        for days, price in [(0, 80.0), (1, 100.0), (2, 110.0)]:
+            db.session.add(PriceHistory(product_id=product.id, price=price, timestamp=start + timedelta(days=days)))
+        db.session.add(PriceHistory(product_id=single.id, price=50.0, timestamp=start))
+        db.session.commit()
+
+        try:
+            # LAG() computes the latest change in the database
+            latest = {row.product_id: row for row in latest_price_changes([product.id, single.id])}
+            assert latest[product.id].previous_price == 100.0
+            assert round(latest[product.id].change_pct, 2) == 10.0
+            assert latest[single.id].previous_price is None
+
+            assert backfill_price_changes(batch_size=1) >= 2
+
+            db.session.expire_all()
+            product = db.session.get(Product, product.id)
+            assert product.previous_price == 100.0
+            assert round(product.last_change_pct, 2) == 10.0
+            assert product.last_changed_at == start + timedelta(days=2)
+
+            single = db.session.get(Product, single.id)
+            assert single.previous_price is None
+            assert single.last_change_pct == 0
+        finally:
+            PriceHistory.query.filter(PriceHistory.product_id.in_([product.id, single.id])).delete()
+            Product.query.filter(Product.id.in_([product.id, single.id])).delete()
+            db.session.commit()
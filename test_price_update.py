@@ -38,9 +38,9 @@ def test_price_update():
         # Create a mock function to simulate different price extraction
         original_get_product_info = __import__('extractors').get_product_info
         
-        def mock_get_product_info(url):
+        def mock_get_product_info(url, page_content=None):
             # Get the real product info
-            product_data = original_get_product_info(url)
+            product_data = original_get_product_info(url, page_content=page_content)
             if product_data:
                 # Modify the price
                 product_data['price'] = simulated_price
@@ -50,6 +50,10 @@ def test_price_update():
         # Replace the real function with our mock
         __import__('extractors').get_product_info = mock_get_product_info
         
+        # Forget the page fingerprint so the unchanged page is parsed again
+        url.content_hash = None
+        db.session.commit()
+        
         try:
             # Update the price
             success = update_product_price(url.id)
@@ -0,0 +1,55 @@
+import os
+import sys
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from sqlalchemy import text
+from models import URL, Product, PriceHistory, PriceAlert
+
+def query_plan(query):
+    """Return SQLite's EXPLAIN QUERY PLAN output for an ORM query"""
+    compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+    plan = ' | '.join(row[-1] for row in rows)
+    logger.info(f"Plan: {plan}")
+    return plan
+
+def test_hot_queries_use_indexes():
+    """The dashboard, detail, refresh and alert queries hit the composite indexes"""
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            logger.info("Query plan test only runs on SQLite")
+            return
+
+        # Dashboard / export: products for a user
+        plan = query_plan(Product.query.join(Product.urls).filter_by(user_id=1))
+        assert 'ix_url_user_id' in plan
+
+        # Product detail / charts: one product's history in time order
+        plan = query_plan(PriceHistory.query.filter_by(product_id=1).order_by(PriceHistory.timestamp))
+        assert 'ix_price_history_product_id_timestamp' in plan
+        assert 'TEMP B-TREE' not in plan
+
+        # Refresh: valid URLs ordered by staleness
+        plan = query_plan(URL.query.filter_by(is_valid=True).order_by(URL.last_checked))
+        assert 'ix_url_is_valid_last_checked' in plan
+
+        # URL lookup by product
+        plan = query_plan(URL.query.filter_by(product_id=1))
+        assert 'ix_url_product_id' in plan
+
+        # Dashboard sort by last price change
+        plan = query_plan(Product.query.order_by(Product.last_change_pct.desc()))
+        assert 'ix_product_last_change_pct' in plan
+
+        # Active alerts for a product
+        plan = query_plan(PriceAlert.query.filter_by(product_id=1, is_active=True))
+        assert 'ix_price_alert_product_id_is_active' in plan
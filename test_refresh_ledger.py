@@ -0,0 +1,202 @@
+import os
+import sys
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from sqlalchemy import event
+from models import URL, User, RefreshRun, RefreshAttempt
+import extractors
+import tasks
+from extractors import PageFetch
+from refresh_ledger import RefreshLedger, schedule_ledger, finish_schedule_ledger, slowest_hosts, slowest_urls, daily_trend, recent_runs, prune_ledger
+
+HOST = 'ledger-test.example.com'
+
+def attempt(outcome, total_ms, status=200):
+    return {'started_at': datetime.utcnow(), 'fetch_ms': total_ms * 0.8, 'parse_ms': total_ms * 0.1,
+            'write_ms': total_ms * 0.1, 'total_ms': total_ms, 'bytes': 2048, 'status': status, 'outcome': outcome}
+
+def delete_runs(run_ids):
+    RefreshAttempt.query.filter(RefreshAttempt.run_id.in_(run_ids)).delete(synchronize_session=False)
+    RefreshRun.query.filter(RefreshRun.id.in_(run_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+def get_user(username, is_admin):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        user = User(username=username, email=f'{username}@example.com', is_admin=is_admin)
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+    return user.id
+
+def test_ledger_batches_inserts():
+    """Attempts are inserted a batch at a time, and the run gets its totals on finish"""
+    with app.app_context():
+        statements = []
+
+        def count_inserts(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO refresh_attempt'):
+                statements.append(statement)
+
+        ledger = RefreshLedger('manual', batch_size=2)
+        event.listen(db.engine, 'before_cursor_execute', count_inserts)
+        try:
+            ledger.record(1, f'https://{HOST}/a', attempt('updated', 100))
+            ledger.record(2, f'https://{HOST}/b', attempt('unchanged', 50))
+            assert RefreshAttempt.query.filter_by(run_id=ledger.run_id).count() == 2
+            ledger.record(3, f'https://{HOST}/c', attempt('failed_http_5xx', 900, status=503))
+            assert RefreshAttempt.query.filter_by(run_id=ledger.run_id).count() == 2
+            ledger.finish()
+
+            # One statement per batch instead of one INSERT per URL
+            assert len(statements) == 2
+            run = db.session.get(RefreshRun, ledger.run_id)
+            assert (run.checked, run.updated, run.unchanged, run.failed) == (3, 1, 1, 1)
+            assert run.finished_at is not None and run.duration_seconds >= 0
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_inserts)
+            delete_runs([ledger.run_id])
+
+def test_schedule_dispatches_share_a_run():
+    """Dispatches within one interval record into one run, which closes once the interval is over"""
+    with app.app_context():
+        finish_schedule_ledger(app)
+        first = schedule_ledger(app, 60)
+        first.record(1, f'https://{HOST}/a', attempt('updated', 100))
+        assert schedule_ledger(app, 60) is first
+        first.record(2, f'https://{HOST}/b', attempt('unchanged', 100))
+        # Buffered until the batch fills or the oldest attempt has waited long enough
+        assert RefreshAttempt.query.filter_by(run_id=first.run_id).count() == 0
+
+        first.started -= 3600
+        first.flushed -= 3600
+        first.record(3, f'https://{HOST}/c', attempt('unchanged', 100))
+        assert RefreshAttempt.query.filter_by(run_id=first.run_id).count() == 3
+
+        second = schedule_ledger(app, 60)
+        try:
+            assert second is not first
+            run = db.session.get(RefreshRun, first.run_id)
+            db.session.refresh(run)
+            assert run.finished_at is not None and run.checked == 3
+            assert db.session.get(RefreshRun, second.run_id).finished_at is None
+        finally:
+            finish_schedule_ledger(app)
+            delete_runs([first.run_id, second.run_id])
+
+def test_attempts_after_close_are_written():
+    """A dispatch still recording after the heartbeat closed its run loses no attempts"""
+    with app.app_context():
+        finish_schedule_ledger(app)
+        ledger = schedule_ledger(app, 60)
+        try:
+            ledger.record(1, f'https://{HOST}/a', attempt('updated', 100))
+
+            # Leadership is lost: the heartbeat thread closes the run
+            def lose_leadership():
+                with app.app_context():
+                    finish_schedule_ledger(app)
+            heartbeat = threading.Thread(target=lose_leadership)
+            heartbeat.start()
+            heartbeat.join()
+            assert 'schedule_ledger' not in app.extensions
+
+            ledger.record(2, f'https://{HOST}/b', attempt('failed_network', 100))
+            assert RefreshAttempt.query.filter_by(run_id=ledger.run_id).count() == 2
+            run = db.session.get(RefreshRun, ledger.run_id)
+            db.session.refresh(run)
+            assert run.finished_at is not None
+            assert (run.checked, run.updated, run.failed) == (2, 1, 1)
+        finally:
+            delete_runs([ledger.run_id])
+
+def test_update_product_price_fills_attempt(monkeypatch):
+    """A check reports its phase timings, bytes, status and outcome"""
+    monkeypatch.setattr(extractors, 'fetch_page', lambda url: PageFetch(None, 404, None, 512))
+    with app.app_context():
+        url = URL(url=f'https://{HOST}/gone', platform='salla')
+        db.session.add(url)
+        db.session.commit()
+        url_id = url.id
+        try:
+            result = {}
+            assert not tasks.update_product_price(url_id, interval_minutes=60, attempt=result)
+            assert result['outcome'] == 'failed_http_4xx'
+            assert result['status'] == 404 and result['bytes'] == 512
+            assert result['total_ms'] >= result['fetch_ms'] >= 0
+            assert result['write_ms'] >= 0 and result['started_at'] is not None
+        finally:
+            URL.query.filter_by(id=url_id).delete()
+            db.session.commit()
+
+def test_reports_and_admin_view():
+    """Slow hosts, slow URLs, trends and run-over-run change are reported to admins only"""
+    with app.app_context():
+        first = RefreshLedger('manual')
+        first.record(1, f'https://{HOST}/slow', attempt('updated', 4000))
+        first.record(2, f'https://{HOST}/fast', attempt('unchanged', 1000))
+        first.finish()
+        second = RefreshLedger('manual')
+        second.record(1, f'https://{HOST}/slow', attempt('updated', 6000))
+        second.record(2, f'https://{HOST}/fast', attempt('failed_network', 2000, status=None))
+        second.finish()
+        run_ids = [first.run_id, second.run_id]
+        admin_id = get_user('ledgeradmin', True)
+        user_id = get_user('ledgeruser', False)
+
+    try:
+        with app.app_context():
+            host = next(row for row in slowest_hosts(7, limit=1000) if row.host == HOST)
+            assert host.checks == 4 and host.failures == 1 and round(host.avg_ms) == 3250
+
+            urls = [row for row in slowest_urls(7, limit=1000) if HOST in row.url]
+            assert urls[0].url == f'https://{HOST}/slow' and round(urls[0].avg_ms) == 5000
+
+            assert sum(day.checks for day in daily_trend(1)) >= 4
+
+            runs = {item['run'].id: item for item in recent_runs(limit=50)}
+            assert round(runs[second.run_id]['change_pct']) == 60
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        assert client.get('/admin/refresh-runs').status_code == 403
+
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+            session['_fresh'] = True
+        response = client.get('/admin/refresh-runs?days=1')
+        assert response.status_code == 200
+        page = response.get_data(as_text=True)
+        assert HOST in page and 'Slowest URLs' in page
+    finally:
+        with app.app_context():
+            delete_runs(run_ids)
+
+def test_prune_ledger():
+    """Old runs are deleted together with their attempts"""
+    with app.app_context():
+        ledger = RefreshLedger('schedule')
+        ledger.record(1, f'https://{HOST}/old', attempt('updated', 100))
+        ledger.finish()
+        RefreshRun.query.filter_by(id=ledger.run_id).update({'started_at': datetime.utcnow() - timedelta(days=400)})
+        db.session.commit()
+        try:
+            runs, attempts = prune_ledger(365)
+            assert runs >= 1 and attempts >= 1
+            assert db.session.get(RefreshRun, ledger.run_id) is None
+            assert RefreshAttempt.query.filter_by(run_id=ledger.run_id).count() == 0
+        finally:
+            delete_runs([ledger.run_id])
@@ -0,0 +1,289 @@
+import os
+import sys
+import random
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import URL, Product, PriceHistory, PriceRollup, ProductNameToken, RefreshRun, RefreshAttempt
+import tasks
+import refresh_queue
+import extractors
+from extractors import PageFetch
+from refresh_ledger import finish_schedule_ledger
+from refresh_queue import (dispatch_budget, interleave_hosts, next_check_time, spread_unscheduled,
+                           claim_due_urls, dispatch_due, classify_failure, retry_delay_minutes,
+                           JITTER_FRACTION, QUARANTINE_AFTER, RETRY_BASE_MINUTES)
+
+TEST_PREFIX = 'https://refresh-queue-test'
+
+def make_urls(specs):
+    """Create test URLs from (host, path, next_check_at); returns their ids"""
+    ids = []
+    for host, path, due in specs:
+        url = URL(url=f'{TEST_PREFIX}-{host}.example.com/{path}', platform='salla', is_valid=True, next_check_at=due)
+        db.session.add(url)
+        db.session.flush()
+        ids.append(url.id)
+    db.session.commit()
+    return ids
+
+def delete_test_urls():
+    # Dispatches record their checks in the app's open schedule run
+    finish_schedule_ledger(app)
+    run_ids = [row.run_id for row in db.session.query(RefreshAttempt.run_id)
+               .filter(RefreshAttempt.url.like(f'{TEST_PREFIX}%')).distinct()]
+    RefreshAttempt.query.filter(RefreshAttempt.run_id.in_(run_ids)).delete(synchronize_session=False)
+    RefreshRun.query.filter(RefreshRun.id.in_(run_ids)).delete(synchronize_session=False)
+    URL.query.filter(URL.url.like(f'{TEST_PREFIX}%')).delete(synchronize_session=False)
+    db.session.commit()
+
+def test_dispatch_budget():
+    """Each dispatch releases the steady-rate share plus catch-up slack"""
+    assert dispatch_budget(0, 60, 60) == 0
+    # 1440 URLs checked daily is one per minute
+    assert dispatch_budget(1440, 1440, 60) == 2
+    assert dispatch_budget(10, 1440, 60) == 1
+    assert dispatch_budget(600, 60, 60) == 15
+
+def test_next_check_time_jitter():
+    """Due times stay within the jitter band around one interval"""
+    now = datetime(2024, 1, 1)
+    rng = random.Random(1)
+    times = [next_check_time(60, now, rng) for _ in range(200)]
+    assert all(abs((t - now).total_seconds() - 3600) <= 3600 * JITTER_FRACTION for t in times)
+    assert len(set(times)) > 1
+
+def test_interleave_hosts():
+    """Released URLs alternate between stores, keeping due order per store"""
+    rows = [(1, 'https://a.com/1'), (2, 'https://a.com/2'), (3, 'https://a.com/3'),
+            (4, 'https://b.com/1'), (5, 'https://c.com/1'), (6, 'https://B.com/2')]
+    assert interleave_hosts(rows) == [1, 4, 5, 2, 6, 3]
+
+def test_spread_and_claim():
+    """Unscheduled URLs are spread over the interval; claims take the earliest due first"""
+    now = datetime.utcnow()
+    with app.app_context():
+        try:
+            delete_test_urls()
+            unscheduled = make_urls([('a', 'new', None)])
+            due = make_urls([('a', 'late', now - timedelta(days=3650)),
+                             ('b', 'later', now - timedelta(days=3649)),
+                             ('c', 'future', now + timedelta(hours=1))])
+
+            assert spread_unscheduled(60, now) >= 1
+            spread = db.session.get(URL, unscheduled[0]).next_check_at
+            assert now <= spread <= now + timedelta(minutes=60)
+
+            claimed = claim_due_urls(1, 60, now)
+            assert [row[0] for row in claimed] == [due[0]]
+            # A claimed URL is not released again while its check runs or after it fails
+            db.session.expire_all()
+            assert db.session.get(URL, due[0]).next_check_at > now + timedelta(minutes=50)
+            assert claim_due_urls(1, 60, now)[0][0] == due[1]
+        finally:
+            delete_test_urls()
+
+def test_dispatch_due_checks_only_due_urls(monkeypatch):
+    """A dispatch checks the earliest due URLs within its budget, without real fetches"""
+    checked = []
+
+    def fake_update(url_id, stats=None, interval_minutes=None, attempt=None):
+        checked.append(url_id)
+        return True
+
+    monkeypatch.setattr(tasks, 'update_product_price', fake_update)
+    now = datetime.utcnow()
+    with app.app_context():
+        delete_test_urls()
+        due = make_urls([('a', 'first', now - timedelta(days=3650)),
+                         ('b', 'second', now - timedelta(days=3649))])
+        not_due = make_urls([('c', 'future', now + timedelta(days=1))])
+        total = URL.query.filter_by(is_valid=True).count()
+
+    try:
+        # A daily interval over a small database releases one URL per dispatch
+        budget = dispatch_budget(total, 1440, 60)
+        assert dispatch_due(app, 60, 1440, sleep=lambda seconds: None) == len(checked)
+        assert checked[0] == due[0]
+        assert len(checked) <= budget
+        assert not_due[0] not in checked
+    finally:
+        with app.app_context():
+            delete_test_urls()
+
+def test_dispatch_pacing_counts_fetch_time(monkeypatch):
+    """Slow checks use up their slot instead of adding to it, so a dispatch ends within its window"""
+    clock = [0.0]
+    starts = []
+
+    def slow_update(url_id, stats=None, interval_minutes=None, attempt=None):
+        starts.append(clock[0])
+        clock[0] += 10
+        return True
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    budgets = iter([3, 0])
+    monkeypatch.setattr(tasks, 'update_product_price', slow_update)
+    monkeypatch.setattr(refresh_queue, 'dispatch_budget', lambda *args: next(budgets))
+    now = datetime.utcnow()
+    with app.app_context():
+        delete_test_urls()
+        make_urls([('a', 'one', now - timedelta(days=3650)), ('b', 'two', now - timedelta(days=3650)),
+                   ('c', 'three', now - timedelta(days=3650))])
+
+    try:
+        dispatch_due(app, 60, 1440, sleep=sleep, rng=random.Random(3), clock=lambda: clock[0])
+        assert len(starts) == 3
+        # Each check starts within its own 20 second slot, and the window is not overrun
+        assert all(20 * i - 10 <= start <= 20 * i + 10 for i, start in enumerate(starts))
+        assert clock[0] <= 60
+    finally:
+        with app.app_context():
+            delete_test_urls()
+
+def test_classify_failure():
+    """Failures are told apart by whether a response and a page arrived"""
+    assert classify_failure(PageFetch(None, None, 'Connection refused')) == 'network'
+    assert classify_failure(PageFetch(None, 404)) == 'http_4xx'
+    assert classify_failure(PageFetch(None, 503)) == 'http_5xx'
+    assert classify_failure(PageFetch('<html></html>', 200)) == 'parse'
+
+def test_retry_delay_backoff():
+    """Valid URLs retry sooner than the interval; quarantined ones back off beyond it"""
+    assert [retry_delay_minutes(n, 1440, False) for n in (1, 2, 3)] == \
+        [RETRY_BASE_MINUTES, RETRY_BASE_MINUTES * 2, RETRY_BASE_MINUTES * 4]
+    assert retry_delay_minutes(20, 60, False) == 60
+    # Quarantined rechecks start one interval apart and double with each failed recheck,
+    # however many failures led to the quarantine
+    assert [retry_delay_minutes(1, 1440, True, rechecks) for rechecks in (0, 1, 2)] == [1440, 2880, 5760]
+    assert [retry_delay_minutes(n, 1440, True) for n in (1, QUARANTINE_AFTER)] == [1440, 1440]
+    assert retry_delay_minutes(30, 1440, True, 27) == 30 * 24 * 60
+
+def test_failures_quarantine_and_recover(monkeypatch):
+    """Transient failures back off then quarantine; a gone page quarantines at once; success restores"""
+    monkeypatch.setattr(extractors, 'get_product_info', lambda url, page_content=None: {'price': 10.0, 'name': 'Backoff'})
+    now = datetime.utcnow()
+    with app.app_context():
+        try:
+            delete_test_urls()
+            flaky, gone = make_urls([('a', 'flaky', now), ('b', 'gone', now)])
+
+            monkeypatch.setattr(extractors, 'fetch_page', lambda u: PageFetch(None, 503))
+            delays = []
+            for attempt in range(QUARANTINE_AFTER):
+                stats = Counter()
+                assert not tasks.update_product_price(flaky, stats=stats, interval_minutes=1440)
+                assert stats['failed_http_5xx'] == 1
+                db.session.expire_all()
+                url = db.session.get(URL, flaky)
+                delays.append((url.next_check_at - url.last_checked).total_seconds() / 60)
+                assert url.failure_count == attempt + 1
+                assert url.is_valid == (attempt + 1 < QUARANTINE_AFTER)
+            assert url.failure_kind == 'http_5xx' and url.last_error == 'HTTP 503'
+            assert delays[0] < delays[1] < delays[2]
+            assert abs(delays[2] - 1440) <= 1440 * JITTER_FRACTION
+
+            monkeypatch.setattr(extractors, 'fetch_page', lambda u: PageFetch(None, 404))
+            delays = []
+            for recheck in range(3):
+                assert not tasks.update_product_price(gone, interval_minutes=1440)
+                db.session.expire_all()
+                url = db.session.get(URL, gone)
+                assert url.is_valid is False and url.failure_kind == 'http_4xx'
+                assert url.failure_count == recheck + 1 and url.failed_rechecks == recheck
+                delays.append((url.next_check_at - url.last_checked).total_seconds() / 60)
+            # A gone page backs off from its first failed recheck
+            for delay, expected in zip(delays, (1440, 2880, 5760)):
+                assert abs(delay - expected) <= expected * JITTER_FRACTION
+
+            # A quarantined URL that comes back is valid again
+            monkeypatch.setattr(extractors, 'fetch_page', lambda u: PageFetch('<html>back</html>', 200))
+            assert tasks.update_product_price(flaky, interval_minutes=1440)
+            db.session.expire_all()
+            url = db.session.get(URL, flaky)
+            assert url.is_valid and url.failure_count == 0 and url.failure_kind is None and url.last_error is None
+            assert url.failed_rechecks == 0
+        finally:
+            product_ids = [u.product_id for u in URL.query.filter(URL.url.like(f'{TEST_PREFIX}%')) if u.product_id]
+            delete_test_urls()
+            PriceHistory.query.filter(PriceHistory.product_id.in_(product_ids)).delete()
+            PriceRollup.query.filter(PriceRollup.product_id.in_(product_ids)).delete()
+            ProductNameToken.query.filter(ProductNameToken.product_id.in_(product_ids)).delete()
+            Product.query.filter(Product.id.in_(product_ids)).delete()
+            db.session.commit()
+
+def test_dispatch_records_failed_checks(monkeypatch):
+    """A check that raises is still recorded in the schedule run"""
+    def explode(url_id, stats=None, interval_minutes=None, attempt=None):
+        raise RuntimeError('extractor crashed')
+    monkeypatch.setattr(tasks, 'update_product_price', explode)
+    with app.app_context():
+        delete_test_urls()
+        make_urls([('x', 'crash', datetime.utcnow() - timedelta(days=3650))])
+
+    try:
+        with pytest.raises(RuntimeError):
+            dispatch_due(app, 60, 1440, sleep=lambda seconds: None)
+        ledger = app.extensions['schedule_ledger']
+        assert ledger.outcomes[None] == 1
+        assert [row['url'] for row in ledger.pending] == [f'{TEST_PREFIX}-x.example.com/crash']
+    finally:
+        with app.app_context():
+            delete_test_urls()
+
+def test_dispatch_rechecks_quarantined(monkeypatch):
+    """Due quarantined URLs are released on their own budget"""
+    checked = []
+    monkeypatch.setattr(tasks, 'update_product_price',
+                        lambda url_id, stats=None, interval_minutes=None, attempt=None: checked.append(url_id) or False)
+    with app.app_context():
+        delete_test_urls()
+        quarantined = make_urls([('q', 'dead', datetime.utcnow() - timedelta(days=3650))])
+        URL.query.filter_by(id=quarantined[0]).update({'is_valid': False})
+        db.session.commit()
+
+    try:
+        dispatch_due(app, 60, 1440, sleep=lambda seconds: None)
+        assert quarantined[0] in checked
+    finally:
+        with app.app_context():
+            delete_test_urls()
+
+def test_update_all_prices_rechecks_due_quarantined(monkeypatch):
+    """A full update, as run by a cron job, also rechecks quarantined URLs whose backoff has passed"""
+    checked = []
+    monkeypatch.setattr(tasks, 'update_product_price',
+                        lambda url_id, stats=None, interval_minutes=None, attempt=None: checked.append(url_id) or False)
+    monkeypatch.setattr(tasks.time, 'sleep', lambda seconds: None)
+    now = datetime.utcnow()
+    with app.app_context():
+        delete_test_urls()
+        due, waiting = make_urls([('q', 'due', now - timedelta(minutes=1)), ('q', 'waiting', now + timedelta(days=2))])
+        URL.query.filter(URL.id.in_([due, waiting])).update({'is_valid': False})
+        db.session.commit()
+        latest_run = db.session.query(db.func.max(RefreshRun.id)).scalar() or 0
+
+    try:
+        tasks.update_all_prices(app)
+        assert due in checked and waiting not in checked
+    finally:
+        with app.app_context():
+            run_ids = [row.id for row in RefreshRun.query.filter(RefreshRun.id > latest_run)]
+            RefreshAttempt.query.filter(RefreshAttempt.run_id.in_(run_ids)).delete(synchronize_session=False)
+            RefreshRun.query.filter(RefreshRun.id.in_(run_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            delete_test_urls()
@@ -0,0 +1,100 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from models import Product, PriceHistory, PriceRollup
+from rollups import bucket_start, update_rollups, rebuild_rollups, choose_resolution
+from downsample import get_chart_data
+
+def rollup_rows(product_id, resolution):
+    rows = PriceRollup.query.filter_by(product_id=product_id, resolution=resolution) \
+        .order_by(PriceRollup.bucket_start).all()
+    return [(r.bucket_start, r.open_price, r.high_price, r.low_price, r.close_price, r.sample_count) for r in rows]
+
+def test_bucket_start():
+    """Days truncate to midnight and weeks to Monday"""
+    timestamp = datetime(2024, 5, 2, 15, 30)  # A Thursday
+    assert bucket_start(timestamp, 'day') == datetime(2024, 5, 2)
+    assert bucket_start(timestamp, 'week') == datetime(2024, 4, 29)
+
+def test_incremental_rollups_match_rebuild():
+    """Rollups maintained on write equal a rebuild from history"""
+    with app.app_context():
+        product = Product(name='Rollup Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+
+        start = datetime(2024, 1, 1, 8, 0)
+        prices = [100.0, 120.0, 90.0, 95.0, 130.0, 125.0, 80.0, 85.0]
+        try:
+            for i, price in enumerate(prices):
+                timestamp = start + timedelta(hours=5 * i)
+                db.session.add(PriceHistory(product_id=product.id, price=price, timestamp=timestamp))
+                update_rollups(product.id, price, timestamp)
+                db.session.commit()
+
+            incremental = {res: rollup_rows(product.id, res) for res in ('day', 'week')}
+            first_day = incremental['day'][0]
+            assert first_day[1:] == (100.0, 120.0, 90.0, 95.0, 4)
+
+            rebuild_rollups([product.id])
+            rebuilt = {res: rollup_rows(product.id, res) for res in ('day', 'week')}
+            assert rebuilt == incremental
+        finally:
+            PriceRollup.query.filter_by(product_id=product.id).delete()
+            PriceHistory.query.filter_by(product_id=product.id).delete()
+            Product.query.filter_by(id=product.id).delete()
+            db.session.commit()
+
+def test_choose_resolution():
+    """The coarsest rollup with at least as many buckets as chart points is read"""
+    start = datetime(2020, 1, 1)
+    assert choose_resolution(start, start + timedelta(days=90), 100) == 'raw'
+    assert choose_resolution(start, start + timedelta(days=400), 100) == 'day'
+    assert choose_resolution(start, start + timedelta(days=1000), 100) == 'week'
+
+def test_long_range_chart_reads_rollups():
+    """Charts of long ranges come from the daily rollup, keeping spikes with minmax"""
+    with app.app_context():
+        product = Product(name='Long Rollup Product', current_price=100.0)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+        start = datetime(2023, 1, 1)
+        prices = [100.0 + (i % 5) for i in range(400)]
+        prices[150] = 500.0
+        try:
+            db.session.bulk_insert_mappings(PriceHistory, [
+                {'product_id': product_id, 'price': price, 'timestamp': start + timedelta(hours=12 * i)}
+                for i, price in enumerate(prices)
+            ])
+            db.session.commit()
+            rebuild_rollups([product_id])
+
+            # 200 days do not fit in 100 points, so the daily rollup is downsampled
+            data = get_chart_data(product_id, points=100)
+            assert data['resolution'] == 'day' and data['total_points'] == 400
+            assert len(data['prices']) == 100
+            assert data['dates'][0] == '2023-01-01 00:00'
+
+            data = get_chart_data(product_id, points=100, method='minmax')
+            assert max(data['prices']) == 500.0 and min(data['prices']) == 100.0
+
+            # A budget larger than the number of days reads the raw rows
+            assert get_chart_data(product_id, points=300)['resolution'] == 'raw'
+        finally:
+            PriceRollup.query.filter_by(product_id=product_id).delete()
+            PriceHistory.query.filter_by(product_id=product_id).delete()
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
@@ -0,0 +1,117 @@
+import os
+import sys
+import uuid
+import logging
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from apscheduler.schedulers.background import BackgroundScheduler
+from models import AppSetting, SchedulerLock, User
+from scheduler import (LeaseLock, LeaderScheduler, PRICE_JOB_ID, INTERVAL_SETTING,
+                       get_schedule_interval, set_schedule_interval)
+
+def expire_lease(name):
+    SchedulerLock.query.filter_by(name=name).update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+def test_lease_lock():
+    """Only one owner holds the lease until it expires or is released"""
+    name = f'test-{uuid.uuid4().hex[:8]}'
+    first, second = LeaseLock(name, 'first', 60), LeaseLock(name, 'second', 60)
+    with app.app_context():
+        try:
+            assert first.acquire()
+            assert not second.acquire()
+            # Renewal by the holder
+            assert first.acquire()
+
+            expire_lease(name)
+            assert second.acquire()
+            assert not first.acquire()
+
+            second.release()
+            assert SchedulerLock.query.filter_by(name=name).count() == 0
+            assert first.acquire()
+        finally:
+            SchedulerLock.query.filter_by(name=name).delete()
+            db.session.commit()
+
+def test_only_leader_schedules_refresh():
+    """The refresh job follows leadership and the interval stored in the database"""
+    name = f'test-{uuid.uuid4().hex[:8]}'
+    schedulers = []
+    for owner in ('first', 'second'):
+        scheduler = BackgroundScheduler()
+        # Paused: jobs are registered but never run
+        scheduler.start(paused=True)
+        schedulers.append(LeaderScheduler(app, scheduler, LeaseLock(name, owner, 60), owner))
+    first, second = schedulers
+
+    try:
+        first.tick()
+        second.tick()
+        assert first.is_leader and not second.is_leader
+        job = first.scheduler.get_job(PRICE_JOB_ID)
+        # The leader releases due URLs every dispatch window
+        assert job.trigger.interval == timedelta(seconds=first.dispatch_seconds)
+        assert first.interval == app.config['SCHEDULER_INTERVAL_MINUTES']
+        assert second.scheduler.get_job(PRICE_JOB_ID) is None
+
+        # A schedule change made anywhere reaches the leader
+        with app.app_context():
+            set_schedule_interval(30)
+        first.tick()
+        assert first.interval == 30
+
+        # The leader stops heartbeating; the other process takes over
+        with app.app_context():
+            expire_lease(name)
+        second.tick()
+        first.tick()
+        assert second.is_leader and not first.is_leader
+        assert second.scheduler.get_job(PRICE_JOB_ID) is not None
+        assert second.interval == 30
+        assert first.scheduler.get_job(PRICE_JOB_ID) is None
+    finally:
+        for leader in schedulers:
+            leader.shutdown()
+        with app.app_context():
+            SchedulerLock.query.filter_by(name=name).delete()
+            AppSetting.query.filter_by(key=INTERVAL_SETTING).delete()
+            db.session.commit()
+
+def test_update_schedule_persists_interval():
+    """The schedule form stores the interval instead of editing .env"""
+    with app.app_context():
+        user = User.query.filter_by(username='scheduleuser').first()
+        if not user:
+            user = User(username='scheduleuser', email='schedule@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    try:
+        response = client.post('/update-schedule', data={'interval': '360'})
+        assert response.status_code == 302
+        with app.app_context():
+            assert get_schedule_interval(1440) == 360
+    finally:
+        app.config['WTF_CSRF_ENABLED'] = True
+        with app.app_context():
+            AppSetting.query.filter_by(key=INTERVAL_SETTING).delete()
+            db.session.commit()
@@ -0,0 +1,137 @@
+import os
+import sys
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from sqlalchemy import text
+from models import URL, Product, User
+import search
+from search import has_search_table, search_products, backfill_normalized_names, SEARCH_TABLE
+
+def test_full_text_search():
+    """Search is ranked, Arabic-aware, paginated and follows product writes"""
+    with app.app_context():
+        user = User.query.filter_by(username='searchuser').first()
+        if not user:
+            user = User(username='searchuser', email='search@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        catalog = [
+            ('زيت الزيتون البكر الممتاز', 'عبوة زجاجية', 'الجوف'),
+            ('Olive Soap', 'Handmade soap with olive oil', None),
+            ('قهوة عربية', 'بن محمص مع الهيل', None),
+            ('Coffee Grinder', 'Grinds coffee beans', 'Hario'),
+        ]
+        products = []
+        for name, description, brand in catalog:
+            product = Product(name=name, description=description, brand=brand, current_price=10.0)
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(URL(url=f'https://search-test.salla.sa/p/{product.id}', platform='salla',
+                               user_id=user_id, product_id=product.id))
+            products.append(product)
+        # A matching product tracked by someone else is never returned
+        foreign = Product(name='Olive Jar', current_price=5.0)
+        db.session.add(foreign)
+        db.session.commit()
+        ids = [product.id for product in products]
+        oil_id, soap_id, coffee_id, grinder_id = ids
+        foreign_id = foreign.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    try:
+        with app.app_context():
+            fts = has_search_table(db.engine)
+            logger.info(f"Search table available: {fts}")
+
+            # Different Arabic spelling and the definite article still match
+            results, total = search_products(user_id, 'زيت زيتون', 1, 20)
+            assert [product.id for product, _ in results] == [oil_id]
+
+            if fts:
+                # A name match outranks a description-only match, prefixes match
+                results, total = search_products(user_id, 'olive', 1, 20)
+                assert [product.id for product, _ in results] == [soap_id]
+                results, total = search_products(user_id, 'coff', 1, 20)
+                assert [product.id for product, _ in results] == [grinder_id]
+                results, _ = search_products(user_id, 'الهيل', 1, 20)
+                assert [product.id for product, _ in results] == [coffee_id]
+
+                # Brand is searchable
+                results, _ = search_products(user_id, 'الجوف', 1, 20)
+                assert [product.id for product, _ in results] == [oil_id]
+
+                # Renaming a product updates the index in the same transaction
+                product = db.session.get(Product, grinder_id)
+                product.name = 'مطحنة قهوة'
+                db.session.commit()
+                results, _ = search_products(user_id, 'مطحنه', 1, 20)
+                assert [product.id for product, _ in results] == [grinder_id]
+
+        data = client.get('/api/search?q=olive&per_page=1').get_json()
+        assert data['total'] >= 1 and len(data['items']) == 1
+        assert foreign_id not in [item['id'] for item in data['items']]
+        assert client.get('/api/search').status_code == 400
+
+        # The dashboard filter narrows the listing
+        response = client.get('/api/products?q=' + 'قهوه')
+        names = [item['name'] for item in response.get_json()['items']]
+        assert 'قهوة عربية' in names and 'Olive Soap' not in names
+    finally:
+        with app.app_context():
+            URL.query.filter_by(user_id=user_id).delete()
+            for product in Product.query.filter(Product.id.in_(ids + [foreign_id])).all():
+                db.session.delete(product)
+            db.session.commit()
+            if has_search_table(db.engine):
+                remaining = db.session.execute(
+                    text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE rowid IN ({','.join(map(str, ids))})")
+                ).scalar()
+                assert remaining == 0
+
+def test_like_fallback_matches_every_product(monkeypatch):
+    """Without a search table, products written directly or before normalization still match"""
+    with app.app_context():
+        user = User.query.filter_by(username='searchuser').first()
+        user_id = user.id
+        written = Product(name='إبريق شاي', current_price=10.0)
+        legacy = Product(name='إبريق قهوة', current_price=12.0)
+        db.session.add_all([written, legacy])
+        db.session.flush()
+        for product in (written, legacy):
+            db.session.add(URL(url=f'https://search-like.salla.sa/p/{product.id}', platform='salla',
+                               user_id=user_id, product_id=product.id))
+        db.session.commit()
+        ids = [written.id, legacy.id]
+        # Written through the ORM, the normalized name is filled at once
+        assert written.normalized_name == 'ابريق شاي'
+
+        # A row from before normalized names existed is backfilled
+        db.session.execute(text("UPDATE product SET normalized_name = NULL WHERE id = :id"), {'id': legacy.id})
+        db.session.commit()
+        assert backfill_normalized_names() >= 1
+
+        monkeypatch.setattr(search, 'has_search_table', lambda bind: False)
+        try:
+            results, total = search_products(user_id, 'ابريق', 1, 20)
+            assert sorted(product.id for product, _ in results) == sorted(ids)
+        finally:
+            URL.query.filter(URL.product_id.in_(ids)).delete()
+            for product in Product.query.filter(Product.id.in_(ids)).all():
+                db.session.delete(product)
+            db.session.commit()
@@ -0,0 +1,36 @@
+import os
+import sys
+import sqlite3
+import logging
+import tempfile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import run_child, CHILD, HEAVY_MODULES
+
+def test_serverless_cold_start():
+    """The serverless import skips scrapers, numpy and schema checks"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.db')
+        env = dict(os.environ, SERVERLESS='true', LOG_LEVEL='WARNING', DATABASE_URL=f'sqlite:///{path}')
+        env.pop('SCHEMA_CHECK_ON_STARTUP', None)
+
+        result = run_child(CHILD.format(heavy=HEAVY_MODULES, path='/login'), env)
+        logger.info(f"Cold start: {result}")
+        assert result['heavy_modules'] == []
+        assert result['status'] == 200
+
+        # No tables were created on import
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT count(*) FROM sqlite_master WHERE name = 'product'").fetchone()[0] == 0
+
+    # Without DATABASE_URL the in-memory database still gets its schema
+    env = dict(os.environ, SERVERLESS='true', LOG_LEVEL='WARNING')
+    env.pop('DATABASE_URL', None)
+    env.pop('SCHEMA_CHECK_ON_STARTUP', None)
+    assert run_child(CHILD.format(heavy=HEAVY_MODULES, path='/login'), env)['status'] == 200
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import the app
+from app import app, db
+from sqlalchemy import event, text
+from models import User
+from user_cache import get_user_cache, CLAIMS_KEY
+
+def user_statements(client, path, method='get'):
+    """Request path and return the SQL statements that touched the user table"""
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        response = getattr(client, method)(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return response, [s for s in statements if 'FROM user' in s and 'user.id = ?' in s]
+
+def create_cache_user(username, is_admin=False):
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        user.is_admin = is_admin
+        db.session.commit()
+        return user.id
+
+def test_cached_user_loader():
+    """Repeat requests load the user from the cache until it changes"""
+    user_id = create_cache_user('usercacheuser')
+    cache = get_user_cache(app)
+    cache.clear()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    _, first = user_statements(client, '/api/analytics')
+    assert len(first) == 1
+    before = cache.snapshot_stats()
+    response, second = user_statements(client, '/api/analytics')
+    assert response.status_code == 200
+    assert second == []
+    assert cache.snapshot_stats()['db_round_trips_saved'] == before['db_round_trips_saved'] + 1
+
+    # A change through the ORM drops the snapshot
+    with app.app_context():
+        db.session.get(User, user_id).email = f'usercache-{time.time_ns()}@example.com'
+        db.session.commit()
+    _, third = user_statements(client, '/api/analytics')
+    assert len(third) == 1
+
+    # Attributes missing from the snapshot are not needed to serve the page
+    response, _ = user_statements(client, '/dashboard')
+    assert response.status_code == 200
+
+def test_session_claims():
+    """With session claims, GET requests on a cold cache skip the lookup"""
+    user_id = create_cache_user('usercacheclaims')
+    admin_id = create_cache_user('usercacheadmin', is_admin=True)
+    cache = get_user_cache(app)
+    app.config['USER_SESSION_CLAIMS'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    try:
+        client = app.test_client()
+        response = client.post('/login', data={'username': 'usercacheclaims', 'password': 'password'})
+        assert response.status_code == 302
+        with client.session_transaction() as session:
+            assert session[CLAIMS_KEY]['user']['id'] == user_id
+
+        # Another worker with an empty cache
+        cache.clear()
+        response, statements = user_statements(client, '/api/analytics')
+        assert response.status_code == 200
+        assert statements == []
+
+        # Writes never trust the cookie
+        cache.clear()
+        _, statements = user_statements(client, '/delete-url/999999999', method='post')
+        assert len(statements) == 1
+
+        # A local change rejects claims issued before it
+        with app.app_context():
+            db.session.get(User, user_id).email = f'usercacheclaims-{time.time_ns()}@example.com'
+            db.session.commit()
+        _, statements = user_statements(client, '/api/analytics')
+        assert len(statements) == 1
+
+        client.get('/logout')
+        with client.session_transaction() as session:
+            assert CLAIMS_KEY not in session
+    finally:
+        app.config['USER_SESSION_CLAIMS'] = False
+        app.config['WTF_CSRF_ENABLED'] = True
+
+    admin = app.test_client()
+    with admin.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    stats = admin.get('/api/user-cache/stats').get_json()
+    assert stats['db_round_trips_saved'] == stats['hits'] + stats['claims']
+    assert stats['claims'] >= 1
+
+    user = app.test_client()
+    with user.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    assert user.get('/api/user-cache/stats').status_code == 403
+
+def test_demoted_admin_loses_access():
+    """Admin views read the admin flag from the database, not the cached snapshot or claims"""
+    admin_id = create_cache_user('usercachedemoted', is_admin=True)
+    app.config['USER_SESSION_CLAIMS'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    try:
+        admin = app.test_client()
+        admin.post('/login', data={'username': 'usercachedemoted', 'password': 'password'})
+        assert admin.get('/admin/refresh-runs').status_code == 200
+
+        # Demoted by another worker: this process's snapshot and the cookie still say admin
+        with app.app_context():
+            db.session.execute(text("UPDATE user SET is_admin = 0 WHERE id = :id"), {'id': admin_id})
+            db.session.commit()
+        assert admin.get('/admin/refresh-runs').status_code == 403
+        assert admin.get('/api/user-cache/stats').status_code == 403
+    finally:
+        app.config['USER_SESSION_CLAIMS'] = False
+        app.config['WTF_CSRF_ENABLED'] = True
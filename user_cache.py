@@ -0,0 +1,195 @@
+"""
+Cached user loading for Flask-Login.
+
+Flask-Login calls the user loader on every authenticated request. Instead of
+a SELECT each time, the loader keeps a short-lived in-process snapshot of
+each user's columns and attaches it to the request's session with
+db.session.merge(load=False), which issues no SQL. Writes to a User through
+the ORM drop the snapshot in this process; other workers pick the change up
+when their snapshot expires (USER_CACHE_TTL seconds).
+
+With USER_SESSION_CLAIMS enabled, the user's id, username, email and admin
+flag are also kept in the signed session cookie. GET and HEAD requests that
+miss the in-process cache (e.g. on another worker) build the user from those
+claims instead of querying; they expire after USER_CACHE_TTL like the cache.
+Any other attribute is loaded from the database only when accessed.
+
+Neither the snapshot nor the claims are trusted for privileges: admin-only
+views call current_user_is_admin(), which reads the flag from the database,
+so a demoted admin loses access on the next request.
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+
+from flask import current_app, has_app_context, request, session
+from flask_login import user_logged_in, user_logged_out
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60
+CLAIMS_KEY = '_user_claims'
+CLAIM_COLUMNS = ('id', 'username', 'email', 'is_admin')
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+class UserCache:
+    """Thread-safe map of user id to column snapshot, with expiry and stats"""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        # user id -> time of the last local change, to reject older claims
+        self._changed_at = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._entries[user_id]
+                entry = None
+            return entry[0] if entry else None
+
+    def set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (snapshot, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._changed_at[user_id] = time.time()
+            self.stats['invalidations'] += 1
+
+    def changed_at(self, user_id):
+        with self._lock:
+            return self._changed_at.get(user_id, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot_stats(self):
+        """Return loader counters, including the database round trips saved"""
+        with self._lock:
+            stats = dict(self.stats)
+            entries = len(self._entries)
+        loads = stats.get('hits', 0) + stats.get('claims', 0) + stats.get('misses', 0)
+        saved = stats.get('hits', 0) + stats.get('claims', 0)
+        return {
+            'loads': loads,
+            'hits': stats.get('hits', 0),
+            'claims': stats.get('claims', 0),
+            'misses': stats.get('misses', 0),
+            'invalidations': stats.get('invalidations', 0),
+            'entries': entries,
+            'db_round_trips_saved': saved,
+            'saved_per_request': round(saved / loads, 4) if loads else 0.0,
+        }
+
+def get_user_cache(app):
+    """Return the app's user cache, creating it from config on first use"""
+    cache = app.extensions.get('user_cache')
+    if cache is None:
+        cache = UserCache(ttl=int(app.config.get('USER_CACHE_TTL', DEFAULT_TTL)))
+        app.extensions['user_cache'] = cache
+    return cache
+
+def user_snapshot(user):
+    """Return the loaded column values of a user"""
+    state = inspect(user)
+    return {attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict}
+
+def attach_user(values):
+    """Return a session-bound User built from column values, without a query"""
+    from models import db, User
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def store_claims(user):
+    """Put the user's claims into the signed session"""
+    session[CLAIMS_KEY] = {
+        'user': {column: getattr(user, column) for column in CLAIM_COLUMNS},
+        'iat': time.time(),
+    }
+
+def valid_claims(cache, user_id):
+    """Return the session's claims for user_id if they are usable for this request"""
+    if request.method not in READ_ONLY_METHODS:
+        return None
+    claims = session.get(CLAIMS_KEY)
+    if not claims or claims.get('user', {}).get('id') != user_id:
+        return None
+    issued_at = claims.get('iat', 0)
+    if issued_at + cache.ttl < time.time() or issued_at <= cache.changed_at(user_id):
+        return None
+    return claims['user']
+
+def load_user(user_id):
+    """Flask-Login user loader backed by the user cache"""
+    from models import db, User
+
+    app = current_app._get_current_object()
+    cache = get_user_cache(app)
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    snapshot = cache.get(user_id)
+    if snapshot is not None:
+        cache.stats['hits'] += 1
+        return attach_user(snapshot)
+
+    use_claims = app.config.get('USER_SESSION_CLAIMS')
+    if use_claims:
+        claims = valid_claims(cache, user_id)
+        if claims is not None:
+            cache.stats['claims'] += 1
+            return attach_user(claims)
+
+    cache.stats['misses'] += 1
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    cache.set(user_id, user_snapshot(user))
+    if use_claims and valid_claims(cache, user_id) is None and request.method in READ_ONLY_METHODS:
+        store_claims(user)
+    return user
+
+def current_user_is_admin():
+    """Return the current user's admin flag from the database, not the cache or session claims"""
+    from flask_login import current_user
+    from models import db, User
+
+    if not current_user.is_authenticated:
+        return False
+    return bool(db.session.query(User.is_admin).filter(User.id == current_user.id).scalar())
+
+def _user_changed(mapper, connection, target):
+    if has_app_context():
+        get_user_cache(current_app).invalidate(target.id)
+
+def _logged_in(app, user):
+    if app.config.get('USER_SESSION_CLAIMS'):
+        store_claims(user)
+
+def _logged_out(app, user):
+    session.pop(CLAIMS_KEY, None)
+
+def register_user_loader(app, login_manager):
+    """Install the cached user loader and keep the cache in sync with User writes"""
+    from models import User
+
+    login_manager.user_loader(load_user)
+    for name in ('after_update', 'after_delete'):
+        if not event.contains(User, name, _user_changed):
+            event.listen(User, name, _user_changed)
+    user_logged_in.connect(_logged_in, app)
+    user_logged_out.connect(_logged_out, app)
@@ -0,0 +1,31 @@
+"""
+Price refresh worker.
+Runs the scheduler from the worker profile of factory.create_app, without
+routes, templates or login, until interrupted. Several workers can run at
+once; only the one holding the leader lock refreshes prices.
+
+    python worker.py
+"""
+
+import time
+import logging
+
+from factory import create_app
+
+logger = logging.getLogger(__name__)
+
+def main():
+    app = create_app('worker')
+    if app.apscheduler is None:
+        logger.error("Scheduler is disabled (RUN_SCHEDULER=false), nothing to do")
+        return
+    try:
+        while True:
+            time.sleep(60)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Stopping worker")
+        # Release the leader lock so another worker can take over at once
+        app.extensions['leader_scheduler'].shutdown()
+
+if __name__ == '__main__':
+    main()